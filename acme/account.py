@@ -3,18 +3,22 @@
 """ Account class """
 from __future__ import print_function
 import json
-from acme.helper import generate_random_string, validate_email, date_to_datestr, load_config
+from acme.helper import generate_random_string, validate_email, date_to_datestr, jwk_cache_invalidate, jwk_thumbprint_get, load_config
 from acme.db_handler import DBstore
 from acme.message import Message
 
 class Account(object):
     """ ACME server class """
 
-    def __init__(self, debug=None, srv_name=None, logger=None):
+    def __init__(self, debug=None, srv_name=None, logger=None, context=None):
         self.server_name = srv_name
         self.logger = logger
-        self.dbstore = DBstore(debug, self.logger)
-        self.message = Message(debug, self.server_name, self.logger)
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.dbstore = DBstore(debug, self.logger)
+        self.message = Message(debug, self.server_name, self.logger, self.context)
         self.path_dic = {'acct_path' : '/acme/acct/'}
         self.inner_header_nonce_allow = False
 
@@ -37,6 +41,7 @@ class Account(object):
                 'name': account_name,
                 'alg': content['alg'],
                 'jwk': json.dumps(content['jwk']),
+                'thumbprint': jwk_thumbprint_get(self.logger, content['jwk']),
                 'contact': json.dumps(contact),
             }
 
@@ -98,6 +103,7 @@ class Account(object):
         """ delete account """
         self.logger.debug('Account.delete({0})'.format(aname))
         result = self.dbstore.account_delete(aname)
+        jwk_cache_invalidate(self.logger, aname)
 
         if result:
             code = 200
@@ -185,7 +191,7 @@ class Account(object):
         self.logger.debug('Account.key_change_validate({0})'.format(aname))
         if 'jwk' in inner_protected:
             # check if we already have the key stored in DB
-            key_exists = self.lookup(json.dumps(inner_protected['jwk']), 'jwk')
+            key_exists = self.lookup(jwk_thumbprint_get(self.logger, inner_protected['jwk']), 'thumbprint')
             if not key_exists:
                 (code, message, detail) = self.inner_jws_check(outer_protected, inner_protected)
 
@@ -214,8 +220,9 @@ class Account(object):
                 if code == 200:
                     (code, message, detail) = self.key_change_validate(aname, protected, inner_protected, inner_payload)
                     if code == 200:
-                        data_dic = {'name' : aname, 'jwk' : json.dumps(inner_protected['jwk'])}
+                        data_dic = {'name' : aname, 'jwk' : json.dumps(inner_protected['jwk']), 'thumbprint' : jwk_thumbprint_get(self.logger, inner_protected['jwk'])}
                         result = self.dbstore.account_update(data_dic)
+                        jwk_cache_invalidate(self.logger, aname)
                         if result:
                             code = 200
                             message = None
@@ -267,7 +274,10 @@ class Account(object):
     def load_config(self):
         """" load config from file """
         self.logger.debug('load_config()')
-        config_dic = load_config()
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
         if 'Account' in config_dic:
             self.inner_header_nonce_allow = config_dic.getboolean('Account', 'inner_header_nonce_allow', fallback=False)
 
@@ -337,7 +347,7 @@ class Account(object):
                 detail = None
 
                 if 'jwk' in protected:
-                    result = self.dbstore.account_lookup('jwk', json.dumps(protected['jwk']))
+                    result = self.dbstore.account_lookup('thumbprint', jwk_thumbprint_get(self.logger, protected['jwk']))
                     if result:
                         code = 200
                         message = result['name']
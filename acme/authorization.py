@@ -5,25 +5,32 @@ from __future__ import print_function
 import json
 from acme.db_handler import DBstore
 from acme.challenge import Challenge
-from acme.helper import generate_random_string, uts_now, uts_to_date_utc
+from acme.helper import generate_random_string, load_config, state_cache_get, state_cache_set, uts_now, uts_to_date_utc
 from acme.message import Message
 from acme.nonce import Nonce
 
 class Authorization(object):
     """ class for order handling """
 
-    def __init__(self, debug=None, srv_name=None, logger=None, expiry=86400):
+    def __init__(self, debug=None, srv_name=None, logger=None, expiry=86400, context=None):
         self.server_name = srv_name
         self.debug = debug
         self.logger = logger
-        self.dbstore = DBstore(debug, self.logger)
-        self.message = Message(debug, self.server_name, self.logger)
-        self.nonce = Nonce(debug, self.logger)
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+            self.nonce = self.context.nonce_get()
+        else:
+            self.dbstore = DBstore(debug, self.logger)
+            self.nonce = Nonce(debug, self.logger)
+        self.message = Message(debug, self.server_name, self.logger, self.context)
         self.expiry = expiry
         self.path_dic = {'authz_path' : '/acme/authz/'}
+        self.state_cache_lifetime = 0
 
     def __enter__(self):
         """ Makes ACMEHandler a Context Manager """
+        self.load_config()
         return self
 
     def __exit__(self, *args):
@@ -33,29 +40,57 @@ class Authorization(object):
         """ return authzs information """
         self.logger.debug('Authorization.info({0})'.format(url))
         authz_name = url.replace('{0}{1}'.format(self.server_name, self.path_dic['authz_path']), '')
+        if self.state_cache_lifetime:
+            (authz_info_dic, generation) = state_cache_get(self.logger, ('authz', authz_name))
+            if not authz_info_dic:
+                authz_info_dic = self.authz_load(authz_name)
+                if authz_info_dic:
+                    state_cache_set(self.logger, ('authz', authz_name), authz_info_dic, self.state_cache_lifetime, generation)
+        else:
+            authz_info_dic = self.authz_load(authz_name)
+
+        self.logger.debug('Authorization.authz_info() returns: {0}'.format(json.dumps(authz_info_dic)))
+        return authz_info_dic
+
+    def authz_load(self, authz_name):
+        """ load authorization information from database """
+        self.logger.debug('Authorization.authz_load({0})'.format(authz_name))
         expires = uts_now() + self.expiry
         token = generate_random_string(self.logger, 32)
         authz_info_dic = {}
-        if self.dbstore.authorization_lookup('name', authz_name):
-
-            # update authorization with expiry date and token (just to be sure)
-            self.dbstore.authorization_update({'name' : authz_name, 'token' : token, 'expires' : expires})
+        tnauth = None
+        auth_info = self.dbstore.authorization_lookup('name', authz_name, ['status__name', 'type', 'value', 'expires'])
+        if auth_info:
+            if auth_info[0].get('expires'):
+                # expiry date and challenges got set by the first request - polling must not change them
+                expires = auth_info[0]['expires']
+            else:
+                # first request - set expiry date and token
+                self.dbstore.authorization_update({'name' : authz_name, 'token' : token, 'expires' : expires})
             authz_info_dic['expires'] = uts_to_date_utc(expires)
 
             # get authorization information from db to be inserted in message
-            tnauth = None
-            auth_info = self.dbstore.authorization_lookup('name', authz_name, ['status__name', 'type', 'value'])
-            if auth_info:
-                authz_info_dic['status'] = auth_info[0]['status__name']
-                authz_info_dic['identifier'] = {'type' : auth_info[0]['type'], 'value' : auth_info[0]['value']}
-                if auth_info[0]['type'] == 'TNAuthList':
-                    tnauth = True
-            challenge = Challenge(self.debug, self.server_name, self.logger, expires)
+            authz_info_dic['status'] = auth_info[0]['status__name']
+            authz_info_dic['identifier'] = {'type' : auth_info[0]['type'], 'value' : auth_info[0]['value']}
+            if auth_info[0]['type'] == 'TNAuthList':
+                tnauth = True
+            challenge = Challenge(self.debug, self.server_name, self.logger, expires, self.context)
             authz_info_dic['challenges'] = challenge.new_set(authz_name, token, tnauth)
 
-        self.logger.debug('Authorization.authz_info() returns: {0}'.format(json.dumps(authz_info_dic)))
+        self.logger.debug('Authorization.authz_load() ended')
         return authz_info_dic
 
+    def load_config(self):
+        """" load config from file """
+        self.logger.debug('Authorization.load_config()')
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
+        if 'Order' in config_dic:
+            self.state_cache_lifetime = config_dic.getint('Order', 'state_cache_lifetime', fallback=0)
+        self.logger.debug('Authorization.load_config() ended')
+
     def new_get(self, url):
         """ challenge computation based on get request """
         self.logger.debug('Authorization.new_get()')
@@ -3,7 +3,7 @@
 """ ca hanlder for Insta Certifier via REST-API class """
 from __future__ import print_function
 import json
-from acme.helper import b64_url_recode, generate_random_string, cert_san_get, cert_tnauthlist_get, uts_now, uts_to_date_utc, load_config, csr_san_get, csr_tnauthlist_get
+from acme.helper import generate_random_string, cert_fingerprint_get, cert_metadata_get, cert_parse, cert_san_get, cert_tnauthlist_get, uts_now, uts_to_date_utc, load_config, csr_parse, csr_san_get, csr_tnauthlist_get
 from acme.ca_handler import CAhandler
 from acme.db_handler import DBstore
 from acme.message import Message
@@ -11,12 +11,16 @@ from acme.message import Message
 class Certificate(object):
     """ CA  handler """
 
-    def __init__(self, debug=None, srv_name=None, logger=None):
+    def __init__(self, debug=None, srv_name=None, logger=None, context=None):
         self.debug = debug
         self.server_name = srv_name
         self.logger = logger
-        self.dbstore = DBstore(self.debug, self.logger)
-        self.message = Message(self.debug, self.server_name, self.logger)
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.dbstore = DBstore(self.debug, self.logger)
+        self.message = Message(self.debug, self.server_name, self.logger, self.context)
         self.path_dic = {'cert_path' : '/acme/cert/'}
         self.tnauthlist_support = False
 
@@ -32,6 +36,9 @@ class Certificate(object):
         """ cenroll and store certificater """
         self.logger.debug('Certificate.enroll_and_store({0},{1})'.format(certificate_name, csr))
 
+        # parse csr once for csr check and ca handler
+        csr = csr_parse(self.logger, csr)
+
         # check csr against order
         csr_check_result = self.csr_check(certificate_name, csr)
         error = None
@@ -39,7 +46,7 @@ class Certificate(object):
 
         # only continue if self.csr_check returned True
         if csr_check_result:
-            with CAhandler(self.debug, self.logger) as ca_handler:
+            with self.ca_handler_get() as ca_handler:
                 (error, certificate, certificate_raw) = ca_handler.enroll(csr)
                 if certificate:
                     result = self.store_cert(certificate_name, certificate, certificate_raw)
@@ -55,6 +62,15 @@ class Certificate(object):
         self.logger.debug('Certificate.enroll_and_store() ended with: {0}:{1}'.format(result, error))
         return (result, error, detail)
 
+    def ca_handler_get(self):
+        """ get ca handler - the one from application context if there is one """
+        self.logger.debug('Certificate.ca_handler_get()')
+        if self.context:
+            ca_handler = self.context.ca_handler_get()
+        else:
+            ca_handler = CAhandler(self.debug, self.logger)
+        return ca_handler
+
     def info(self, certificate_name):
         """ get certificate from database """
         self.logger.debug('Certificate.info({0})'.format(certificate_name))
@@ -112,12 +128,14 @@ class Certificate(object):
 
         if code == 200:
             if 'certificate' in payload:
+                # decode the certificate once - checks and ca handler share the parsed object
+                payload['certificate'] = cert_parse(self.logger, payload['certificate'])
                 (code, error) = self.revocation_request_validate(account_name, payload)
                 if code == 200:
                     # revocation starts here
                     # revocation reason is stored in error variable
                     rev_date = uts_to_date_utc(uts_now())
-                    with CAhandler(self.debug, self.logger) as ca_handler:
+                    with self.ca_handler_get() as ca_handler:
                         (code, message, detail) = ca_handler.revoke(payload['certificate'], error, rev_date)
                 else:
                     message = error
@@ -136,10 +154,40 @@ class Certificate(object):
         self.logger.debug('Certificate.revoke() ended with: {0}'.format(response_dic))
         return response_dic
 
+    def metadata_backfill(self, batch=100):
+        """ store metadata of certificates issued before the metadata columns existed """
+        self.logger.debug('Certificate.metadata_backfill({0})'.format(batch))
+        count = 0
+        last_id = 0
+        certificate_list = self.dbstore.certificate_backfill_list(last_id, batch)
+        while certificate_list:
+            for cert_dic in certificate_list:
+                self.store_cert(cert_dic['name'], cert_dic['cert'], cert_dic['cert_raw'])
+                count += 1
+            last_id = certificate_list[-1]['id']
+            certificate_list = self.dbstore.certificate_backfill_list(last_id, batch)
+        self.logger.debug('Certificate.metadata_backfill() ended with: {0}'.format(count))
+        return count
+
+    def san_list_get(self, certificate):
+        """ get SANs of a certificate from database - parse certificates without metadata """
+        self.logger.debug('Certificate.san_list_get()')
+        cert_dic = self.dbstore.certificate_lookup('fingerprint', cert_fingerprint_get(self.logger, certificate), ['san'])
+        if cert_dic and cert_dic['san']:
+            san_list = json.loads(cert_dic['san'])
+        else:
+            san_list = cert_san_get(self.logger, certificate)
+        return san_list
+
     def store_cert(self, certificate_name, certificate, raw):
         """ get key for a specific account id """
         self.logger.debug('Certificate.store_cert({0})'.format(certificate_name))
         data_dic = {'cert' : certificate, 'name': certificate_name, 'cert_raw' : raw}
+        try:
+            data_dic.update(cert_metadata_get(self.logger, raw))
+        except BaseException as err:
+            # certificate still gets stored - lookups fall back to cert_raw
+            self.logger.error('Certificate.store_cert(): metadata extraction failed: {0}'.format(err))
         cert_id = self.dbstore.certificate_add(data_dic)
         self.logger.debug('Certificate.store_cert({0}) ended'.format(cert_id))
         return cert_id
@@ -225,7 +273,7 @@ class Certificate(object):
     def account_check(self, account_name, certificate):
         """ check account """
         self.logger.debug('Certificate.issuer_check()')
-        return self.dbstore.certificate_account_check(account_name, b64_url_recode(self.logger, certificate))
+        return self.dbstore.certificate_account_check(account_name, cert_parse(self.logger, certificate))
 
     def authorization_check(self, order_name, certificate):
         """ check if an acount holds authorization for all identifiers = SANs in the certificate """
@@ -266,7 +314,7 @@ class Certificate(object):
                             identifier_status.append(False)
             else:
                 # get sans
-                san_list = cert_san_get(self.logger, certificate)
+                san_list = self.san_list_get(certificate)
                 identifier_status = self.identifer_status_list(identifiers, san_list)
 
         result = False
@@ -279,7 +327,10 @@ class Certificate(object):
     def load_config(self):
         """" load config from file """
         self.logger.debug('Certificate.load_config()')
-        config_dic = load_config()
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
         if 'Order' in config_dic:
             self.tnauthlist_support = config_dic.getboolean('Order', 'tnauthlist_support', fallback=False)
         self.logger.debug('Certificate.load_config() ended.')
@@ -3,23 +3,46 @@
 """ Challenge class """
 from __future__ import print_function
 import json
-from acme.helper import generate_random_string, parse_url, load_config, jwk_thumbprint_get, url_get, sha256_hash, b64_url_encode, txt_get
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from acme.helper import generate_random_string, parse_url, load_config, jwk_cache_get, url_get, sha256_hash, b64_url_encode, txt_get, uts_now
 from acme.db_handler import DBstore
 from acme.message import Message
 
+# worker pool for background validation: created on first use, recreated in forked children
+# orders: {order_name: [running validations, deque of waiting (challenge_name, payload)]}
+VALIDATION_POOL_DIC = {'lock': threading.Lock(), 'executor': None, 'pid': None, 'orders': {}}
+
+# validations in progress: {challenge_name: [event set once the check finished, result]}
+VALIDATION_FLIGHT_DIC = {'lock': threading.Lock(), 'flights': {}}
+
 class Challenge(object):
     """ Challenge handler """
 
-    def __init__(self, debug=None, srv_name=None, logger=None, expiry=3600):
-        # self.debug = debug
+    def __init__(self, debug=None, srv_name=None, logger=None, expiry=3600, context=None):
+        self.debug = debug
         self.server_name = srv_name
         self.logger = logger
-        self.dbstore = DBstore(debug, self.logger)
-        self.message = Message(debug, self.server_name, self.logger)
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.dbstore = DBstore(debug, self.logger)
+        self.message = Message(debug, self.server_name, self.logger, self.context)
         self.path_dic = {'chall_path' : '/acme/chall/', 'authz_path' : '/acme/authz/'}
         self.expiry = expiry
         self.challenge_validation_disable = False
         self.tnauthlist_support = False
+        self.validation_workers = 0
+        self.validation_order_limit = 0
+        self.validation_lease = 120
+        self.dns_server_list = None
+        self.dns_timeout = 5
+        self.dns_cache_ttl = 60
+        self.dns_negative_ttl = 5
+        self.jwk_cache_lifetime = 0
 
     def __enter__(self):
         """ Makes ACMEHandler a Context Manager """
@@ -34,9 +57,8 @@ class Challenge(object):
         self.logger.debug('challenge.check({0})'.format(challenge_name))
         challenge_dic = self.dbstore.challenge_lookup('name', challenge_name, ['type', 'status__name', 'token', 'authorization__name', 'authorization__type', 'authorization__value', 'authorization__token', 'authorization__order__account__name'])
         if 'type' in challenge_dic and 'authorization__value' in challenge_dic and 'token' in challenge_dic and 'authorization__order__account__name' in challenge_dic:
-            pub_key = self.dbstore.jwk_load(challenge_dic['authorization__order__account__name'])
+            (pub_key, jwk_thumbprint) = jwk_cache_get(self.logger, self.dbstore, challenge_dic['authorization__order__account__name'], self.jwk_cache_lifetime)
             if  pub_key:
-                jwk_thumbprint = jwk_thumbprint_get(self.logger, pub_key)
                 if challenge_dic['type'] == 'http-01' and jwk_thumbprint:
                     result = self.validate_http_challenge(challenge_dic['authorization__value'], challenge_dic['token'], jwk_thumbprint)
                 elif challenge_dic['type'] == 'dns-01' and jwk_thumbprint:
@@ -71,9 +93,22 @@ class Challenge(object):
     def load_config(self):
         """" load config from file """
         self.logger.debug('Challenge.load_config()')
-        config_dic = load_config()
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
         if 'Challenge' in config_dic:
             self.challenge_validation_disable = config_dic.getboolean('Challenge', 'challenge_validation_disable', fallback=False)
+            self.validation_workers = config_dic.getint('Challenge', 'validation_workers', fallback=0)
+            self.validation_order_limit = config_dic.getint('Challenge', 'validation_order_limit', fallback=0)
+            self.validation_lease = config_dic.getint('Challenge', 'validation_lease', fallback=120)
+            if 'dns_server_list' in config_dic['Challenge']:
+                self.dns_server_list = [server.strip() for server in config_dic['Challenge']['dns_server_list'].split(',') if server.strip()]
+            self.dns_timeout = config_dic.getint('Challenge', 'dns_timeout', fallback=5)
+            self.dns_cache_ttl = config_dic.getint('Challenge', 'dns_cache_ttl', fallback=60)
+            self.dns_negative_ttl = config_dic.getint('Challenge', 'dns_negative_ttl', fallback=5)
+        if 'Account' in config_dic:
+            self.jwk_cache_lifetime = config_dic.getint('Account', 'jwk_cache_lifetime', fallback=0)
         if 'Order' in config_dic:
             self.tnauthlist_support = config_dic.getboolean('Order', 'tnauthlist_support', fallback=False)
         self.logger.debug('Challenge.load_config() ended.')
@@ -87,6 +122,16 @@ class Challenge(object):
             (challenge_name, _sinin) = challenge_name.split('/', 1)
         return challenge_name
 
+    def dic_build(self, challenge_name, mtype, token):
+        """ build challenge object returned to the client """
+        challenge_dic = {}
+        challenge_dic['type'] = mtype
+        challenge_dic['url'] = '{0}{1}{2}'.format(self.server_name, self.path_dic['chall_path'], challenge_name)
+        challenge_dic['token'] = token
+        if mtype == 'tkauth-01':
+            challenge_dic['tkauth-type'] = 'atc'
+        return challenge_dic
+
     def new(self, authz_name, mtype, token):
         """ new challenge """
         self.logger.debug('Challenge.new({0})'.format(mtype))
@@ -105,22 +150,22 @@ class Challenge(object):
 
         challenge_dic = {}
         if chid:
-            challenge_dic['type'] = mtype
-            challenge_dic['url'] = '{0}{1}{2}'.format(self.server_name, self.path_dic['chall_path'], challenge_name)
-            challenge_dic['token'] = token
-            if mtype == 'tkauth-01':
-                challenge_dic['tkauth-type'] = 'atc'
+            challenge_dic = self.dic_build(challenge_name, mtype, token)
         return challenge_dic
 
     def new_set(self, authz_name, token, tnauth=False):
-        """ net challenge set """
+        """ net challenge set - created once per authorization """
         self.logger.debug('Challenge.new_set({0}, {1})'.format(authz_name, token))
         challenge_list = []
-        if not tnauth:
-            challenge_list.append(self.new(authz_name, 'http-01', token))
-            challenge_list.append(self.new(authz_name, 'dns-01', token))
-        else:
-            challenge_list.append(self.new(authz_name, 'tkauth-01', token))
+        # challenges got created by an earlier request - return them instead of adding new ones
+        for challenge in self.dbstore.challenges_lookup('authorization__name', authz_name, ['name', 'type', 'token']):
+            challenge_list.append(self.dic_build(challenge['name'], challenge['type'], challenge['token']))
+        if not challenge_list:
+            if not tnauth:
+                challenge_list.append(self.new(authz_name, 'http-01', token))
+                challenge_list.append(self.new(authz_name, 'dns-01', token))
+            else:
+                challenge_list.append(self.new(authz_name, 'tkauth-01', token))
         self.logger.debug('Challenge.new_set returned ({0})'.format(challenge_list))
         return challenge_list
 
@@ -143,10 +188,11 @@ class Challenge(object):
                         (code, message, detail) = self.validate_tnauthlist_payload(payload, challenge_dic)
 
                     if code == 200:
-                        # update challenge state to 'processing' - i am not so sure about this
-                        # self.update({'name' : challenge_name, 'status' : 4})
-                        # start validation
-                        _validation = self.validate(challenge_name, payload)
+                        # start validation - in background if a worker pool is configured
+                        if self.validation_workers and challenge_dic:
+                            self.validation_submit(challenge_name, payload, challenge_dic)
+                        else:
+                            _validation = self.validate(challenge_name, payload)
                         if challenge_dic:
                             response_dic['data'] = {}
                             challenge_dic['url'] = protected['url']
@@ -189,8 +235,32 @@ class Challenge(object):
         # print(authz_name)
 
     def validate(self, challenge_name, payload):
-        """ validate challenge"""
+        """ validate challenge - concurrent requests for the same challenge share a single check """
         self.logger.debug('Challenge.validate({0}: {1})'.format(challenge_name, payload))
+        with VALIDATION_FLIGHT_DIC['lock']:
+            flight = VALIDATION_FLIGHT_DIC['flights'].get(challenge_name)
+            leader = flight is None
+            if leader:
+                flight = [threading.Event(), False]
+                VALIDATION_FLIGHT_DIC['flights'][challenge_name] = flight
+
+        if leader:
+            try:
+                flight[1] = self.validate_execute(challenge_name, payload)
+            finally:
+                with VALIDATION_FLIGHT_DIC['lock']:
+                    del VALIDATION_FLIGHT_DIC['flights'][challenge_name]
+                flight[0].set()
+        else:
+            self.logger.debug('Challenge.validate(): validation of {0} in progress. Waiting for result'.format(challenge_name))
+            flight[0].wait()
+
+        self.logger.debug('Challenge.validate() ended with:{0}'.format(flight[1]))
+        return flight[1]
+
+    def validate_execute(self, challenge_name, payload):
+        """ check challenge and update challenge and authorization """
+        self.logger.debug('Challenge.validate_execute({0})'.format(challenge_name))
         if self.challenge_validation_disable:
             self.logger.debug('CHALLENGE VALIDATION DISABLED. SETTING challenge status to valid')
             challenge_check = True
@@ -208,7 +278,94 @@ class Challenge(object):
                 data_dic = {'name' : challenge_name, 'keyauthorization' : payload['keyAuthorization']}
                 self.update(data_dic)
 
-        self.logger.debug('Challenge.validate() ended with:{0}'.format(challenge_check))
+        self.logger.debug('Challenge.validate_execute() ended with:{0}'.format(challenge_check))
+        return challenge_check
+
+    def validation_executor_get(self):
+        """ get worker pool for background validation """
+        self.logger.debug('Challenge.validation_executor_get()')
+        with VALIDATION_POOL_DIC['lock']:
+            # threads do not survive a fork - a child process needs its own pool
+            if not VALIDATION_POOL_DIC['executor'] or VALIDATION_POOL_DIC['pid'] != os.getpid():
+                self.logger.debug('Challenge.validation_executor_get(): create pool with {0} workers'.format(self.validation_workers))
+                VALIDATION_POOL_DIC['executor'] = ThreadPoolExecutor(max_workers=self.validation_workers)
+                VALIDATION_POOL_DIC['pid'] = os.getpid()
+                # validations queued in the parent will never run here
+                VALIDATION_POOL_DIC['orders'] = {}
+            executor = VALIDATION_POOL_DIC['executor']
+        return executor
+
+    def validation_run(self, challenge_name, payload):
+        """ validate challenge in a worker thread """
+        self.logger.debug('Challenge.validation_run({0})'.format(challenge_name))
+        # dbstore and message objects are not thread-safe - use a fresh challenge object
+        with Challenge(self.debug, self.server_name, self.logger, self.expiry, self.context) as challenge:
+            try:
+                result = challenge.validate(challenge_name, payload)
+            except BaseException as err:
+                self.logger.error('Challenge.validation_run(): validation of {0} failed: {1}'.format(challenge_name, err))
+                result = False
+            if not result:
+                # same as synchronous validation - client can trigger another validation
+                challenge.update({'name' : challenge_name, 'status' : 'pending'})
+        self.logger.debug('Challenge.validation_run() ended with: {0}'.format(result))
+        return result
+
+    def validation_submit(self, challenge_name, payload, challenge_dic):
+        """ set challenge to processing and hand over validation to the worker pool """
+        self.logger.debug('Challenge.validation_submit({0})'.format(challenge_name))
+        with VALIDATION_FLIGHT_DIC['lock']:
+            in_flight = challenge_name in VALIDATION_FLIGHT_DIC['flights']
+        if challenge_dic.get('status') == 'valid' or in_flight:
+            self.logger.debug('Challenge.validation_submit(): challenge is {0}. Skipping'.format(challenge_dic.get('status')))
+        # processing challenges get claimed again once the lease of the validating process expired
+        elif self.dbstore.challenge_claim(challenge_name, uts_now(), self.validation_lease):
+            challenge_dic['status'] = 'processing'
+            order_dic = self.dbstore.challenge_lookup('name', challenge_name, ['authorization__order__name'])
+            if order_dic:
+                self.validation_schedule(order_dic['authorization__order__name'], challenge_name, payload)
+            else:
+                self.validation_executor_get().submit(self.validation_run, challenge_name, payload)
+        else:
+            self.logger.debug('Challenge.validation_submit(): challenge {0} claimed by another validation. Skipping'.format(challenge_name))
+
+    def validation_schedule(self, order_name, challenge_name, payload):
+        """ submit validation to the worker pool or queue it if the order reached validation_order_limit """
+        self.logger.debug('Challenge.validation_schedule({0}:{1})'.format(order_name, challenge_name))
+        executor = self.validation_executor_get()
+        with VALIDATION_POOL_DIC['lock']:
+            order = VALIDATION_POOL_DIC['orders'].setdefault(order_name, [0, deque()])
+            if self.validation_order_limit and order[0] >= self.validation_order_limit:
+                order[1].append((challenge_name, payload))
+                submit = False
+            else:
+                order[0] += 1
+                submit = True
+        if submit:
+            executor.submit(self.validation_order_run, order_name, challenge_name, payload)
+        else:
+            self.logger.debug('Challenge.validation_schedule(): order limit reached. {0} queued'.format(challenge_name))
+        return submit
+
+    def validation_order_run(self, order_name, challenge_name, payload):
+        """ validate challenge and hand over the next queued validation of the order to the pool """
+        self.logger.debug('Challenge.validation_order_run({0}:{1})'.format(order_name, challenge_name))
+        try:
+            result = self.validation_run(challenge_name, payload)
+        finally:
+            next_run = None
+            with VALIDATION_POOL_DIC['lock']:
+                order = VALIDATION_POOL_DIC['orders'].get(order_name)
+                if order and order[1]:
+                    # resubmit instead of looping so that other orders get their turn
+                    next_run = order[1].popleft()
+                elif order:
+                    order[0] -= 1
+                    if not order[0]:
+                        del VALIDATION_POOL_DIC['orders'][order_name]
+            if next_run:
+                self.validation_executor_get().submit(self.validation_order_run, order_name, next_run[0], next_run[1])
+        return result
 
     def validate_dns_challenge(self, fqdn, token, jwk_thumbprint):
         """ validate dns challenge """
@@ -220,10 +377,10 @@ class Challenge(object):
         # compute sha256 hash
         _hash = b64_url_encode(self.logger, sha256_hash(self.logger, '{0}.{1}'.format(token, jwk_thumbprint)))
         # query dns
-        txt = txt_get(self.logger, fqdn)
+        txt_list = txt_get(self.logger, fqdn, self.dns_server_list, self.dns_timeout, self.dns_cache_ttl, self.dns_negative_ttl)
 
-        # compare computed hash with result from DNS query
-        if _hash == txt:
+        # compare computed hash with results from DNS query - there may be one record per pending challenge
+        if _hash in txt_list:
             result = True
         else:
             result = False
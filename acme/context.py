@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Context class """
+from __future__ import print_function
+import threading
+from acme.helper import load_config
+from acme.ca_handler import CAhandler
+from acme.db_handler import DBstore
+from acme.nonce import Nonce
+
+class Context(object):
+    """ application context - created once at startup and handed over to the handler classes """
+
+    def __init__(self, debug=None, logger=None, config_dic=None):
+        self.debug = debug
+        self.logger = logger
+        # a config handed over by the caller never gets reloaded
+        self.config_static = config_dic
+        # dbstore, nonce and ca handler keep state per call - one instance per thread
+        self.local = threading.local()
+
+    def __enter__(self):
+        """ Makes ACMEHandler a Context Manager """
+        return self
+
+    def __exit__(self, *args):
+        """ cose the connection at the end of the context """
+
+    @property
+    def config_dic(self):
+        """ configuration - load_config() parses the file once and reloads it after changes """
+        if self.config_static:
+            config_dic = self.config_static
+        else:
+            config_dic = load_config()
+        return config_dic
+
+    def ca_handler_get(self):
+        """ get ca handler of the current thread """
+        return self.instance_get('ca_handler', lambda: CAhandler(self.debug, self.logger))
+
+    def dbstore_get(self):
+        """ get database handler of the current thread """
+        return self.instance_get('dbstore', lambda: DBstore(self.debug, self.logger))
+
+    def instance_get(self, name, create):
+        """ get object of the current thread - recreated after a config reload as it caches its settings """
+        config_dic = self.config_dic
+        (instance, instance_config) = getattr(self.local, name, (None, None))
+        if instance is None or instance_config is not config_dic:
+            self.logger.debug('Context.instance_get(): create {0}'.format(name))
+            instance = create()
+            setattr(self.local, name, (instance, config_dic))
+        return instance
+
+    def nonce_get(self):
+        """ get nonce handler of the current thread """
+        return self.instance_get('nonce', lambda: Nonce(self.debug, self.logger, self))
@@ -12,6 +12,9 @@ import configparser
 import os
 import sys
 import textwrap
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from string import digits, ascii_letters
 try:
@@ -27,6 +30,25 @@ import pytz
 import dns.resolver
 import OpenSSL
 
+# parsed config files: {cfg_file: ((mtime, size), config)}
+CONFIG_CACHE_DIC = {'lock': threading.Lock(), 'files': {}}
+
+# parsed account keys: {account_name: (pub_key, thumbprint, jwk, trusted_until)} in lru order
+# entries get compared with the key stored in the database to pick up key-changes and deletions done by other workers
+JWK_CACHE_DIC = {'lock': threading.Lock(), 'keys': OrderedDict(), 'size': 1024}
+
+# http client used for challenge validation; sessions are kept per thread to reuse connections
+# timeouts in seconds, "deadline" limits the overall duration of a request, "size" the number of bytes read
+HTTP_CLIENT_DIC = {'local': threading.local(), 'connect_timeout': 5, 'read_timeout': 5, 'deadline': 10, 'size': 4096, 'redirects': 3, 'pool_size': 16}
+
+# resolver used for challenge validation and its cache: {fqdn: (txt_list, expires)} in lru order
+# "config" holds nameservers and timeout the resolver got created with
+DNS_RESOLVER_DIC = {'lock': threading.Lock(), 'resolver': None, 'config': None, 'cache': OrderedDict(), 'size': 4096}
+
+# order/authorization states served to polling clients: {(type, name): (value, expires)} in lru order
+# db handlers invalidate entries on status changes; the lifetime limits staleness towards other workers
+STATE_CACHE_DIC = {'lock': threading.Lock(), 'entries': OrderedDict(), 'size': 4096, 'generation': 0}
+
 def b64decode_pad(logger, string):
     """ b64 decoding and padding of missing "=" """
     logger.debug('b64decode_pad()')
@@ -49,7 +71,7 @@ def b64_encode(logger, string):
 def b64_url_encode(logger, string):
     """ encode a bytestream in base64 url and remove padding """
     logger.debug('b64_url_encode()')
-    encoded = base64.urlsafe_b64encode(string)
+    encoded = convert_byte_to_string(base64.urlsafe_b64encode(string))
     return encoded.rstrip("=")
 
 def b64_url_recode(logger, string):
@@ -84,44 +106,54 @@ def build_pem_file(logger, existing, certificate, wrap, csr=False):
 def cert_san_get(logger, certificate):
     """ get subject alternate names from certificate """
     logger.debug('cert_san_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, certificate), True)
-    cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    san = []
-    ext_count = cert.get_extension_count()
-    for i in range(0, ext_count):
-        ext = cert.get_extension(i)
-        if 'subjectAltName' in str(ext.get_short_name()):
-            san_list = ext.__str__().split(',')
-            for san_name in san_list:
-                san_name = san_name.rstrip()
-                san_name = san_name.lstrip()
-                san.append(san_name)
-
+    san = list(cert_parse(logger, certificate).san_list)
     logger.debug('cert_san_get() ended')
     return san
 
 def cert_tnauthlist_get(logger, certificate):
     """ get subject alternate names from certificate """
     logger.debug('cert_tnauthlist_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, certificate), True)
-    cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-
-    extension_list = []
-    ext_count = cert.get_extension_count()
-    for i in range(0, ext_count):
-        ext = cert.get_extension(i)
-        extension_list.append(base64.b64encode(ext.get_data()))
-
+    extension_list = [base64.b64encode(ext.get_data()) for ext in cert_parse(logger, certificate).extension_list]
     logger.debug('cert_tnauthlist_get() ended with: {0}'.format(extension_list))
     return extension_list
 
 def cert_serial_get(logger, certificate):
     """ get serial number form certificate """
     logger.debug('cert_serial_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, certificate), True)
-    cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    logger.debug('cert_serial_get() ended with: {0}'.format(cert.get_serial_number()))
-    return cert.get_serial_number()
+    serial = cert_parse(logger, certificate).serial
+    logger.debug('cert_serial_get() ended with: {0}'.format(serial))
+    return serial
+
+def cert_der_get(logger, certificate):
+    """ decode base64 or base64url encoded certificate """
+    logger.debug('cert_der_get()')
+    return base64.b64decode(b64_url_recode(logger, ''.join(convert_byte_to_string(certificate).split())))
+
+def cert_fingerprint_get(logger, certificate):
+    """ get sha256 fingerprint of a base64 encoded certificate """
+    logger.debug('cert_fingerprint_get()')
+    try:
+        result = cert_parse(logger, certificate).fingerprint
+    except (AttributeError, TypeError, ValueError) as err:
+        logger.error('cert_fingerprint_get(): decoding failed: {0}'.format(err))
+        result = None
+    return result
+
+def cert_metadata_get(logger, certificate):
+    """ get serial, fingerprint, validity, issuer and SANs of a certificate in database format """
+    logger.debug('cert_metadata_get()')
+    metadata_dic = dict(cert_parse(logger, certificate).metadata)
+    logger.debug('cert_metadata_get() ended with: {0}'.format(metadata_dic['fingerprint']))
+    return metadata_dic
+
+def cert_parse(logger, certificate):
+    """ get parsed certificate - an already parsed one gets reused """
+    if isinstance(certificate, ParsedCert):
+        result = certificate
+    else:
+        logger.debug('cert_parse()')
+        result = ParsedCert(logger, b64_url_recode(logger, ''.join(convert_byte_to_string(certificate).split())))
+    return result
 
 def convert_byte_to_string(value):
     """ convert a variable to string if needed """
@@ -137,71 +169,152 @@ def convert_string_to_byte(value):
     else:
         return value
 
+class ParsedString(str):
+    """ base64 encoded object decoded once - fields get extracted on first use
+    behaves like the encoded string so it can be handed over to ca handlers and the database """
+
+    def __new__(cls, logger, value):
+        obj = str.__new__(cls, value)
+        obj.logger = logger
+        obj.field_dic = {}
+        return obj
+
+    def field_get(self, name, extract):
+        """ get field from cache or extract it """
+        if name not in self.field_dic:
+            self.field_dic[name] = extract()
+        return self.field_dic[name]
+
+    @property
+    def san_list(self):
+        """ subject alternative names as "type:value" """
+        return self.field_get('san_list', self.san_list_extract)
+
+    def san_list_extract(self):
+        """ extract subject alternative names from extensions """
+        san = []
+        for ext in self.extension_list:
+            if 'subjectAltName' in str(ext.get_short_name()):
+                san.extend([san_name.strip() for san_name in ext.__str__().split(',')])
+        return san
+
+class ParsedCert(ParsedString):
+    """ base64 encoded certificate decoded once """
+
+    @property
+    def der(self):
+        """ certificate in der format """
+        return self.field_get('der', lambda: cert_der_get(self.logger, self))
+
+    @property
+    def cert(self):
+        """ certificate object loaded straight from der """
+        return self.field_get('cert', lambda: OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_ASN1, self.der))
+
+    @property
+    def extension_list(self):
+        """ list of extensions """
+        return self.field_get('extension_list', lambda: [self.cert.get_extension(i) for i in range(0, self.cert.get_extension_count())])
+
+    @property
+    def fingerprint(self):
+        """ sha256 fingerprint of the der encoding """
+        return self.field_get('fingerprint', lambda: hashlib.sha256(self.der).hexdigest())
+
+    @property
+    def metadata(self):
+        """ serial, fingerprint, validity, issuer and SANs in database format """
+        return self.field_get('metadata', lambda: {
+            'serial' : '{0:x}'.format(self.serial),
+            'fingerprint' : self.fingerprint,
+            'not_before' : date_to_uts_utc(convert_byte_to_string(self.cert.get_notBefore())),
+            'not_after' : date_to_uts_utc(convert_byte_to_string(self.cert.get_notAfter())),
+            'issuer' : "".join("/{0:s}={1:s}".format(name.decode(), value.decode()) for name, value in self.cert.get_issuer().get_components()),
+            'san' : json.dumps(self.san_list),
+        })
+
+    @property
+    def serial(self):
+        """ serial number """
+        return self.field_get('serial', self.cert.get_serial_number)
+
+class ParsedCsr(ParsedString):
+    """ base64 encoded certificate signing request decoded once """
+
+    @property
+    def req(self):
+        """ request object loaded straight from der """
+        return self.field_get('req', lambda: OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_ASN1, base64.b64decode(b64_url_recode(self.logger, ''.join(self.split())))))
+
+    @property
+    def components(self):
+        """ subject components as list of (name, value) tuples """
+        return self.field_get('components', lambda: [(convert_byte_to_string(name), convert_byte_to_string(value)) for name, value in self.req.get_subject().get_components()])
+
+    @property
+    def cn(self):
+        """ common name or None """
+        return self.field_get('cn', lambda: dict(self.components).get('CN'))
+
+    @property
+    def dn(self):
+        """ subject in openssl notation """
+        return self.field_get('dn', lambda: "".join("/{0:s}={1:s}".format(name, value) for name, value in self.components))
+
+    @property
+    def extension_list(self):
+        """ list of extensions """
+        return self.field_get('extension_list', self.req.get_extensions)
+
+    @property
+    def pubkey(self):
+        """ public key in pem format """
+        return self.field_get('pubkey', lambda: OpenSSL.crypto.dump_publickey(OpenSSL.crypto.FILETYPE_PEM, self.req.get_pubkey()))
+
+def csr_parse(logger, csr):
+    """ get parsed certificate request - an already parsed one gets reused """
+    if isinstance(csr, ParsedCsr):
+        result = csr
+    else:
+        logger.debug('csr_parse()')
+        result = ParsedCsr(logger, csr)
+    return result
+
 def csr_cn_get(logger, csr):
     """ get cn from certificate request """
     logger.debug('CAhandler.csr_cn_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, csr), True, True)
-    req = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    subject = req.get_subject()
-    components = dict(subject.get_components())
-    result = None
-    if 'CN' in components:
-        result = components['CN']
-
+    result = csr_parse(logger, csr).cn
     logger.debug('CAhandler.csr_cn_get() ended with: {0}'.format(result))
     return result
 
 def csr_dn_get(logger, csr):
     """ get subject from certificate request in openssl notation """
     logger.debug('CAhandler.csr_dn_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, csr), True, True)
-    req = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    subject = req.get_subject()
-    subject_str = "".join("/{0:s}={1:s}".format(name.decode(), value.decode()) for name, value in subject.get_components())
+    subject_str = csr_parse(logger, csr).dn
     logger.debug('CAhandler.csr_dn_get() ended with: {0}'.format(subject_str))
     return subject_str
 
 def csr_pubkey_get(logger, csr):
     """ get public key from certificate request """
     logger.debug('CAhandler.csr_pubkey_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, csr), True, True)
-    req = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    pubkey = req.get_pubkey()
-    pubkey_str = OpenSSL.crypto.dump_publickey(OpenSSL.crypto.FILETYPE_PEM, pubkey)
+    pubkey_str = csr_parse(logger, csr).pubkey
     logger.debug('CAhandler.csr_pubkey_get() ended with: {0}'.format(pubkey_str))
     return pubkey_str
 
 def csr_san_get(logger, csr):
     """ get subject alternate names from certificate """
     logger.debug('cert_san_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, csr), True, True)
-    req = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-    san = []
-    for ext in req.get_extensions():
-        if 'subjectAltName' in str(ext.get_short_name()):
-            san_list = ext.__str__().split(',')
-            for san_name in san_list:
-                san_name = san_name.rstrip()
-                san_name = san_name.lstrip()
-                san.append(san_name)
-
+    san = list(csr_parse(logger, csr).san_list)
     logger.debug('cert_san_get() ended with: {0}'.format(str(san)))
     return san
 
 def csr_tnauthlist_get(logger, csr):
     """ get subject alternate names from certificate """
     logger.debug('csr_tnauthlist_get()')
-    pem_file = build_pem_file(logger, None, b64_url_recode(logger, csr), True, True)
-    req = OpenSSL.crypto.load_certificate_request(OpenSSL.crypto.FILETYPE_PEM, pem_file)
-
-    extension_list = []
-    for ext in req.get_extensions():
-        extension_list.append(base64.b64encode(ext.get_data()))
-
+    extension_list = [base64.b64encode(ext.get_data()) for ext in csr_parse(logger, csr).extension_list]
     logger.debug('csr_tnauthlist_get() ended with: {0}'.format(extension_list))
     return extension_list
 
-
 def decode_deserialize(logger, string):
     """ decode and deserialize string """
     logger.debug('decode_deserialize()')
@@ -219,26 +332,11 @@ def decode_deserialize(logger, string):
 def decode_message(logger, message):
     """ decode jwstoken and return header, payload and signature """
     logger.debug('decode_message()')
-    jwstoken = jws.JWS()
-    result = False
-    error = None
-    try:
-        jwstoken.deserialize(message)
-        protected = json.loads(jwstoken.objects['protected'])
-        if bool(jwstoken.objects['payload']):
-            payload = json.loads(jwstoken.objects['payload'])
-        else:
-            payload = {}
+    (result, error, protected, payload, jwstoken) = jws_decode(logger, message)
+    if result:
         signature = jwstoken.objects['signature']
-        result = True
-    except BaseException as err:
-        error = str(err)
-        protected = {}
-        payload = {}
+    else:
         signature = None
-        
-    if payload:
-        payload = dkeys_lower(payload)    
     return(result, error, protected, payload, signature)
 
 def dkeys_lower(tree):
@@ -274,11 +372,24 @@ def get_url(environ, include_path=False):
         return '{0}://{1}'.format(proto, server_name)
 
 def load_config(logger=None, mfilter=None, cfg_file=os.path.dirname(__file__)+'/'+'acme_srv.cfg'):
-    """ small configparser wrappter to load a config file """
+    """ small configparser wrappter to load a config file - parsed once and reloaded if the file changes """
     if logger:
         logger.debug('load_config({1}:{0})'.format(mfilter, cfg_file))
-    config = configparser.RawConfigParser()
-    config.read(cfg_file)
+    try:
+        file_stat = os.stat(cfg_file)
+        mtime = (file_stat.st_mtime_ns, file_stat.st_size)
+    except OSError:
+        mtime = None
+
+    with CONFIG_CACHE_DIC['lock']:
+        (cached_mtime, config) = CONFIG_CACHE_DIC['files'].get(cfg_file, (None, None))
+        if not config or cached_mtime != mtime:
+            if logger and config:
+                logger.info('load_config(): {0} changed. Reloading'.format(cfg_file))
+            config = configparser.RawConfigParser()
+            config.read(cfg_file)
+            CONFIG_CACHE_DIC['files'][cfg_file] = (mtime, config)
+    # the parser is shared - never modify it
     return config
 
 def parse_url(logger, url):
@@ -355,6 +466,79 @@ def print_debug(debug, text):
     if debug:
         print('{0}: {1}'.format(datetime.now(), text))
 
+def jws_decode(logger, message):
+    """ deserialize jwstoken and return header, payload and the token object for signature verification """
+    logger.debug('jws_decode()')
+    jwstoken = jws.JWS()
+    result = False
+    error = None
+    try:
+        jwstoken.deserialize(message)
+        # flattened json serialization only - raises an exception otherwise
+        _signature = jwstoken.objects['signature']
+        protected = json.loads(jwstoken.objects['protected'])
+        if bool(jwstoken.objects['payload']):
+            payload = json.loads(jwstoken.objects['payload'])
+        else:
+            payload = {}
+        result = True
+    except BaseException as err:
+        error = str(err)
+        protected = {}
+        payload = {}
+        jwstoken = None
+
+    if payload:
+        payload = dkeys_lower(payload)
+    return(result, error, protected, payload, jwstoken)
+
+def jwk_cache_get(logger, dbstore, aname, lifetime=0):
+    """ get parsed public key and thumbprint of an account - cached keys get used if the stored key did not change
+    within lifetime seconds after loading they are trusted without asking the database """
+    logger.debug('jwk_cache_get({0})'.format(aname))
+    now = uts_now()
+    with JWK_CACHE_DIC['lock']:
+        entry = JWK_CACHE_DIC['keys'].get(aname)
+        if entry:
+            JWK_CACHE_DIC['keys'].move_to_end(aname)
+
+    if entry and lifetime and entry[3] >= now:
+        (pub_key, thumbprint, _jwk, _trusted_until) = entry
+    else:
+        pub_key = dbstore.jwk_load(aname)
+        thumbprint = None
+        if entry and pub_key == entry[2]:
+            # key unchanged - no need to parse it again
+            (jwkey, thumbprint) = entry[:2]
+        elif pub_key:
+            try:
+                jwkey = jwk.JWK(**pub_key)
+                thumbprint = jwkey.thumbprint()
+            except BaseException:
+                jwkey = None
+        else:
+            jwkey = None
+        with JWK_CACHE_DIC['lock']:
+            # keep unparsable keys uncached so signature_check() can report the error
+            if jwkey:
+                JWK_CACHE_DIC['keys'][aname] = (jwkey, thumbprint, pub_key, now + lifetime)
+                JWK_CACHE_DIC['keys'].move_to_end(aname)
+                while len(JWK_CACHE_DIC['keys']) > JWK_CACHE_DIC['size']:
+                    JWK_CACHE_DIC['keys'].popitem(last=False)
+            else:
+                JWK_CACHE_DIC['keys'].pop(aname, None)
+        if jwkey:
+            pub_key = jwkey
+
+    logger.debug('jwk_cache_get() ended with: {0}'.format(thumbprint))
+    return(pub_key, thumbprint)
+
+def jwk_cache_invalidate(logger, aname):
+    """ remove account key from cache """
+    logger.debug('jwk_cache_invalidate({0})'.format(aname))
+    with JWK_CACHE_DIC['lock']:
+        JWK_CACHE_DIC['keys'].pop(aname, None)
+
 def jwk_thumbprint_get(logger, pub_key):
     """ get thumbprint """
     logger.debug('jwk_thumbprint_get()')
@@ -377,7 +561,7 @@ def sha256_hash(logger, string):
 
     result = hashlib.sha256(string.encode('utf-8')).digest()
 
-    logger.debug('sha256_hash() ended with {0} (base64-encoded)'.format(b64_encode(logger, result)))
+    logger.debug('sha256_hash() ended with {0} (base64-encoded)'.format(convert_byte_to_string(base64.b64encode(result))))
     return result
 
 def signature_check(logger, message, pub_key):
@@ -388,18 +572,24 @@ def signature_check(logger, message, pub_key):
     error = None
 
     if pub_key:
-        # load key
-        try:
-            jwkey = jwk.JWK(**pub_key)
-        except BaseException as err:
-            jwkey = None
-            result = False
-            error = str(err)
+        # load key unless we got an already parsed one
+        if isinstance(pub_key, jwk.JWK):
+            jwkey = pub_key
+        else:
+            try:
+                jwkey = jwk.JWK(**pub_key)
+            except BaseException as err:
+                jwkey = None
+                result = False
+                error = str(err)
 
-        # verify signature
+        # verify signature - deserialize message unless we got an already parsed token
         if jwkey:
-            jwstoken = jws.JWS()
-            jwstoken.deserialize(message)
+            if isinstance(message, jws.JWS):
+                jwstoken = message
+            else:
+                jwstoken = jws.JWS()
+                jwstoken.deserialize(message)
             try:
                 jwstoken.verify(jwkey)
                 result = True
@@ -411,24 +601,130 @@ def signature_check(logger, message, pub_key):
     # return result
     return(result, error)
 
+def state_cache_get(logger, key):
+    """ get cached order/authorization state - returns a copy which can be modified by the caller
+    and the cache generation to be handed over to state_cache_set() after a cache miss """
+    logger.debug('state_cache_get({0})'.format(key))
+    with STATE_CACHE_DIC['lock']:
+        entry = STATE_CACHE_DIC['entries'].get(key)
+        if entry and entry[1] >= uts_now():
+            STATE_CACHE_DIC['entries'].move_to_end(key)
+            result = copy.deepcopy(entry[0])
+        else:
+            result = None
+        generation = STATE_CACHE_DIC['generation']
+    return(result, generation)
+
+def state_cache_invalidate(logger, key_list):
+    """ remove order/authorization states from cache """
+    logger.debug('state_cache_invalidate({0})'.format(key_list))
+    with STATE_CACHE_DIC['lock']:
+        STATE_CACHE_DIC['generation'] += 1
+        for key in key_list:
+            STATE_CACHE_DIC['entries'].pop(key, None)
+
+def state_cache_set(logger, key, value, lifetime, generation):
+    """ cache order/authorization state - skipped if states changed since state_cache_get() """
+    logger.debug('state_cache_set({0})'.format(key))
+    with STATE_CACHE_DIC['lock']:
+        # value may got read before a concurrent update - do not cache it
+        if generation == STATE_CACHE_DIC['generation']:
+            STATE_CACHE_DIC['entries'][key] = (copy.deepcopy(value), uts_now() + lifetime)
+            STATE_CACHE_DIC['entries'].move_to_end(key)
+            while len(STATE_CACHE_DIC['entries']) > STATE_CACHE_DIC['size']:
+                STATE_CACHE_DIC['entries'].popitem(last=False)
+
+def http_session_get():
+    """ get http session of the current thread """
+    session = getattr(HTTP_CLIENT_DIC['local'], 'session', None)
+    if not session:
+        session = requests.Session()
+        session.max_redirects = HTTP_CLIENT_DIC['redirects']
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_CLIENT_DIC['pool_size'], pool_maxsize=HTTP_CLIENT_DIC['pool_size'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        HTTP_CLIENT_DIC['local'].session = session
+    return session
+
 def url_get(logger, url):
-    """ http get """
+    """ http get - reads at most HTTP_CLIENT_DIC['size'] bytes and gives up after HTTP_CLIENT_DIC['deadline'] seconds """
     logger.debug('url_get({0})'.format(url))
+    deadline = time.time() + HTTP_CLIENT_DIC['deadline']
     try:
-        req = requests.get(url)
-        result = req.text
-    except BaseException:
+        content = bytearray()
+        with http_session_get().get(url, timeout=(HTTP_CLIENT_DIC['connect_timeout'], HTTP_CLIENT_DIC['read_timeout']), stream=True) as req:
+            # read in chunks - the read timeout limits a single chunk, the deadline is checked after each of them
+            for chunk in req.iter_content(chunk_size=512):
+                content += chunk
+                if len(content) >= HTTP_CLIENT_DIC['size']:
+                    break
+                if time.time() > deadline:
+                    raise requests.exceptions.Timeout('deadline exceeded')
+            result = bytes(content[:HTTP_CLIENT_DIC['size']]).decode(req.encoding or 'utf-8', errors='replace')
+    except BaseException as err:
+        logger.debug('url_get() failed: {0}'.format(err))
         result = None
     logger.debug('url_get() ended with: {0}'.format(result))
     return result
 
-def txt_get(logger, fqdn):
-    """ dns query to get the TXt record """
+def dns_resolver_get(logger, nameserver_list=None, timeout=5):
+    """ get resolver shared by all threads - recreated if nameservers or timeout change """
+    config = (tuple(nameserver_list or ()), timeout)
+    with DNS_RESOLVER_DIC['lock']:
+        if not DNS_RESOLVER_DIC['resolver'] or DNS_RESOLVER_DIC['config'] != config:
+            logger.debug('dns_resolver_get(): create resolver for {0}'.format(config))
+            if nameserver_list:
+                resolver = dns.resolver.Resolver(configure=False)
+                resolver.nameservers = list(nameserver_list)
+            else:
+                # nameservers from /etc/resolv.conf
+                resolver = dns.resolver.Resolver()
+            resolver.lifetime = timeout
+            DNS_RESOLVER_DIC['resolver'] = resolver
+            DNS_RESOLVER_DIC['config'] = config
+            DNS_RESOLVER_DIC['cache'].clear()
+        resolver = DNS_RESOLVER_DIC['resolver']
+    return resolver
+
+def txt_get(logger, fqdn, nameserver_list=None, timeout=5, cache_ttl=60, negative_ttl=5):
+    """ dns query to get all TXT records of a fqdn
+    answers get cached for their ttl (at most cache_ttl seconds), missing records for negative_ttl seconds """
     logger.debug('txt_get({0})'.format(fqdn))
-    try:
-        result = dns.resolver.query(fqdn, 'TXT').response.answer[0][-1].strings[0]
-    except BaseException:
-        result = None
+    resolver = dns_resolver_get(logger, nameserver_list, timeout)
+    key = fqdn.lower().rstrip('.')
+    now = uts_now()
+    with DNS_RESOLVER_DIC['lock']:
+        entry = DNS_RESOLVER_DIC['cache'].get(key)
+        if entry and entry[1] > now:
+            DNS_RESOLVER_DIC['cache'].move_to_end(key)
+        else:
+            entry = None
+
+    if entry:
+        result = list(entry[0])
+    else:
+        ttl = 0
+        try:
+            # resolve() got introduced with dnspython 2.0
+            answer = getattr(resolver, 'resolve', resolver.query)(fqdn, 'TXT')
+            # long records are split into several strings
+            result = [convert_byte_to_string(b''.join(rdata.strings)) for rdata in answer]
+            ttl = min(answer.rrset.ttl, cache_ttl)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            result = []
+            ttl = negative_ttl
+        except BaseException as err:
+            # timeouts and server failures do not get cached
+            logger.debug('txt_get() failed: {0}'.format(err))
+            result = []
+        if ttl > 0:
+            with DNS_RESOLVER_DIC['lock']:
+                DNS_RESOLVER_DIC['cache'][key] = (result, now + ttl)
+                DNS_RESOLVER_DIC['cache'].move_to_end(key)
+                while len(DNS_RESOLVER_DIC['cache']) > DNS_RESOLVER_DIC['size']:
+                    DNS_RESOLVER_DIC['cache'].popitem(last=False)
+            result = list(result)
+
     logger.debug('txt_get() ended with: {0}'.format(result))
     return result
 
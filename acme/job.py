@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Job class """
+from __future__ import print_function
+import uuid
+from acme.helper import load_config, uts_now
+from acme.certificate import Certificate
+from acme.db_handler import DBstore
+
+class Job(object):
+    """ persistent queue of certificate enrollments """
+
+    def __init__(self, debug=None, srv_name=None, logger=None, context=None):
+        self.debug = debug
+        self.server_name = srv_name
+        self.logger = logger
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.dbstore = DBstore(self.debug, self.logger)
+        self.lease = 300
+        self.max_attempts = 5
+        self.backoff = 30
+
+    def __enter__(self):
+        """ Makes ACMEHandler a Context Manager """
+        self.load_config()
+        return self
+
+    def __exit__(self, *args):
+        """ cose the connection at the end of the context """
+
+    def add(self, order_name, certificate_name):
+        """ queue enrollment of a stored csr """
+        self.logger.debug('Job.add({0}:{1})'.format(order_name, certificate_name))
+        data_dic = {'name' : certificate_name, 'order_name' : order_name, 'next_run' : uts_now()}
+        result = self.dbstore.job_add(data_dic)
+        self.logger.debug('Job.add() ended with: {0}'.format(result))
+        return result
+
+    def dispatch(self, limit=0):
+        """ claim and run due jobs until the queue is empty or limit is reached """
+        self.logger.debug('Job.dispatch({0})'.format(limit))
+        count = 0
+        while not limit or count < limit:
+            job_dic = self.dbstore.job_claim(uuid.uuid4().hex, uts_now(), self.lease)
+            if not job_dic:
+                break
+            self.run(job_dic)
+            count += 1
+        self.logger.debug('Job.dispatch() ended with: {0}'.format(count))
+        return count
+
+    def load_config(self):
+        """" load config from file """
+        self.logger.debug('Job.load_config()')
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
+        if 'Job' in config_dic:
+            self.lease = config_dic.getint('Job', 'lease', fallback=300)
+            self.max_attempts = config_dic.getint('Job', 'max_attempts', fallback=5)
+            self.backoff = config_dic.getint('Job', 'backoff', fallback=30)
+        self.logger.debug('Job.load_config() ended')
+
+    def run(self, job_dic):
+        """ enroll the certificate of a claimed job and update job and order """
+        self.logger.debug('Job.run({0})'.format(job_dic['name']))
+        result = None
+        retry = False
+        if job_dic['attempts'] > self.max_attempts:
+            # lease expired too often - worker died during the previous attempts
+            error = 'maximum number of attempts exceeded'
+        else:
+            cert_dic = self.dbstore.certificate_lookup('name', job_dic['name'], ('csr',))
+            if cert_dic and cert_dic['csr']:
+                with Certificate(self.debug, self.server_name, self.logger, self.context) as certificate:
+                    try:
+                        (result, error, _detail) = certificate.enroll_and_store(job_dic['name'], cert_dic['csr'])
+                    except BaseException as err:
+                        self.logger.error('Job.run(): enrollment for {0} failed: {1}'.format(job_dic['name'], err))
+                        error = str(err)
+                # a csr not matching the order will never succeed
+                retry = not result and error != 'urn:ietf:params:acme:badCSR'
+            else:
+                error = 'csr not found'
+
+        now = uts_now()
+        data_dic = {'name' : job_dic['name'], 'token' : job_dic['token'], 'next_run' : now, 'error' : error}
+        if result:
+            data_dic['status'] = 'done'
+            data_dic['error'] = None
+            order_status = 'valid'
+        elif retry and job_dic['attempts'] < self.max_attempts:
+            data_dic['status'] = 'queued'
+            data_dic['next_run'] = now + self.backoff * 2 ** (job_dic['attempts'] - 1)
+            order_status = None
+        else:
+            data_dic['status'] = 'failed'
+            order_status = 'invalid'
+
+        if self.dbstore.job_update(data_dic):
+            if order_status:
+                self.dbstore.order_update({'name' : job_dic['order_name'], 'status' : order_status})
+        else:
+            self.logger.error('Job.run(): lease for {0} expired - job got claimed by another worker'.format(job_dic['name']))
+        self.logger.debug('Job.run() ended with: {0}:{1}'.format(data_dic['status'], error))
+        return data_dic['status']
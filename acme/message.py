@@ -3,7 +3,7 @@
 """ ca hanlder for Insta Certifier via REST-API class """
 from __future__ import print_function
 import json
-from acme.helper import decode_message, load_config
+from acme.helper import jws_decode, jwk_thumbprint_get, load_config
 from acme.error import Error
 from acme.db_handler import DBstore
 from acme.nonce import Nonce
@@ -12,11 +12,16 @@ from acme.signature import Signature
 class Message(object):
     """ Message  handler """
 
-    def __init__(self, debug=None, srv_name=None, logger=None):
+    def __init__(self, debug=None, srv_name=None, logger=None, context=None):
         self.debug = debug
         self.logger = logger
-        self.nonce = Nonce(self.debug, self.logger)
-        self.dbstore = DBstore(self.debug, self.logger)
+        self.context = context
+        if self.context:
+            self.nonce = self.context.nonce_get()
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.nonce = Nonce(self.debug, self.logger)
+            self.dbstore = DBstore(self.debug, self.logger)
         self.server_name = srv_name
         self.path_dic = {'acct_path' : '/acme/acct/', 'revocation_path' : '/acme/revokecert'}
         self.disable_dic = {'signature_check_disable' : False, 'nonce_check_disable' : False}
@@ -40,8 +45,8 @@ class Message(object):
         else:
             skip_signature_check = False
 
-        # decode message
-        (result, error_detail, protected, payload, _signature) = decode_message(self.logger, content)
+        # decode message - the parsed token gets reused for signature verification
+        (result, error_detail, protected, payload, jwstoken) = jws_decode(self.logger, content)
         account_name = None
         if result:
             # decoding successful - check nonce for anti replay protection
@@ -55,9 +60,9 @@ class Message(object):
             if code == 200 and not skip_signature_check:
                 # nonce check successful - check signature
                 account_name = self.name_get(protected)
-                signature = Signature(self.debug, self.server_name, self.logger)
+                signature = Signature(self.debug, self.server_name, self.logger, self.context)
                 # we need the decoded protected header to grab a key to verify signature
-                (sig_check, error, error_detail) = signature.check(account_name, content, use_emb_key, protected)
+                (sig_check, error, error_detail) = signature.check(account_name, jwstoken, use_emb_key, protected)
                 if sig_check:
                     code = 200
                     message = None
@@ -78,7 +83,10 @@ class Message(object):
     def load_config(self):
         """" load config from file """
         self.logger.debug('load_config()')
-        config_dic = load_config()
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
         if 'Nonce' in config_dic:
             self.disable_dic['nonce_check_disable'] = config_dic.getboolean('Nonce', 'nonce_check_disable', fallback=False)
             self.disable_dic['signature_check_disable'] = config_dic.getboolean('Nonce', 'signature_check_disable', fallback=False)
@@ -96,7 +104,7 @@ class Message(object):
             if content['url'] == '{0}{1}'.format(self.server_name, self.path_dic['revocation_path']):
                 # this is needed for cases where we get a revocation message signed with account key but account name is missing)
                 if 'jwk' in content:
-                    account_list = self.dbstore.account_lookup('jwk', json.dumps(content['jwk']))
+                    account_list = self.dbstore.account_lookup('thumbprint', jwk_thumbprint_get(self.logger, content['jwk']))
                     if account_list:
                         if 'name' in account_list:
                             kid = account_list['name']
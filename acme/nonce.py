@@ -2,16 +2,223 @@
 # -*- coding: utf-8 -*-
 """ Nonce class """
 from __future__ import print_function
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import re
+import struct
+import tempfile
+import threading
 import uuid
+from acme.helper import load_config, uts_now
 from acme.db_handler import DBstore
 
+# shards of the in-process nonce store: (lock, {nonce: expiry_uts}, last_purge)
+MEMORY_SHARD_LIST = [[threading.Lock(), {}, 0] for _ in range(16)]
+
+# timestamp of the last expiry run of this process
+EXPIRE_DIC = {'last': 0}
+
+class NonceStoreDb(object):
+    """ nonce store using the acme database (shared by all workers and nodes) """
+
+    def __init__(self, debug=None, logger=None, lifetime=3600):
+        self.logger = logger
+        self.lifetime = lifetime
+        self.dbstore = DBstore(debug, self.logger)
+
+    def add(self, nonce):
+        """ store nonce """
+        self.logger.debug('NonceStoreDb.add({0})'.format(nonce))
+        return self.dbstore.nonce_add(nonce)
+
+    def check_and_delete(self, nonce):
+        """ check if nonce exists and is not expired and delete it - a single statement to be safe against concurrent workers """
+        self.logger.debug('NonceStoreDb.check_and_delete({0})'.format(nonce))
+        return bool(self.dbstore.nonce_consume(nonce, self.lifetime))
+
+    def expire(self):
+        """ delete expired nonces """
+        self.logger.debug('NonceStoreDb.expire()')
+        return self.dbstore.nonce_purge(self.lifetime)
+
+class NonceStoreFile(object):
+    """ nonce store using one file per nonce (shared by all workers on a host, use a tmpfs like /dev/shm) """
+
+    def __init__(self, _debug=None, logger=None, lifetime=3600, path=None):
+        self.logger = logger
+        self.lifetime = lifetime
+        if path:
+            self.path = path
+        elif os.path.isdir('/dev/shm'):
+            self.path = '/dev/shm/acme2certifier_nonce'
+        else:
+            self.path = os.path.join(tempfile.gettempdir(), 'acme2certifier_nonce')
+
+    def add(self, nonce):
+        """ store nonce """
+        self.logger.debug('NonceStoreFile.add({0})'.format(nonce))
+        file_name = self.file_name_get(nonce)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            try:
+                os.makedirs(os.path.dirname(file_name), 0o700)
+            except OSError:
+                # directory got created by another worker
+                pass
+        os.close(os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        return nonce
+
+    def check_and_delete(self, nonce):
+        """ check if nonce exists and delete it - unlink() succeeds for a single caller only """
+        self.logger.debug('NonceStoreFile.check_and_delete({0})'.format(nonce))
+        result = False
+        # nonce is client controlled - never use it as path without validation
+        if re.match(r'^[0-9a-zA-Z_-]{16,64}$', nonce):
+            file_name = self.file_name_get(nonce)
+            try:
+                mtime = os.stat(file_name).st_mtime
+                os.unlink(file_name)
+                result = mtime + self.lifetime >= uts_now()
+            except OSError:
+                result = False
+        return result
+
+    def expire(self):
+        """ delete expired nonces """
+        self.logger.debug('NonceStoreFile.expire()')
+        deleted = 0
+        if os.path.isdir(self.path):
+            threshold = uts_now() - self.lifetime
+            for shard in os.listdir(self.path):
+                shard_path = os.path.join(self.path, shard)
+                if os.path.isdir(shard_path):
+                    for file_name in os.listdir(shard_path):
+                        try:
+                            if os.stat(os.path.join(shard_path, file_name)).st_mtime < threshold:
+                                os.unlink(os.path.join(shard_path, file_name))
+                                deleted += 1
+                        except OSError:
+                            pass
+        return deleted
+
+    def file_name_get(self, nonce):
+        """ build filename for a nonce """
+        return os.path.join(self.path, nonce[:2], nonce)
+
+class NonceStoreHmac(object):
+    """ stateless nonces authenticated by a server secret - consumed nonces are recorded in the acme database (shared by all workers and nodes) """
+
+    # nonce: timestamp (4 bytes), node id (2 bytes), random (12 bytes), truncated hmac (18 bytes)
+    body_format = '>IH12s'
+    mac_length = 18
+
+    def __init__(self, debug=None, logger=None, lifetime=3600, secret='', node_id=0):
+        self.logger = logger
+        self.lifetime = lifetime
+        self.secret = secret.encode('utf-8')
+        self.node_id = node_id
+        self.dbstore = DBstore(debug, self.logger)
+
+    def add(self, nonce):
+        """ nothing to store """
+        self.logger.debug('NonceStoreHmac.add({0})'.format(nonce))
+        return nonce
+
+    def check_and_delete(self, nonce):
+        """ check signature and age of a nonce and record it as consumed """
+        self.logger.debug('NonceStoreHmac.check_and_delete({0})'.format(nonce))
+        result = False
+        body_length = struct.calcsize(self.body_format)
+        try:
+            decoded = base64.urlsafe_b64decode(str(nonce) + '=' * (-len(nonce) % 4))
+        except (binascii.Error, TypeError, ValueError):
+            decoded = b''
+        if len(decoded) == body_length + self.mac_length and hmac.compare_digest(self.mac_get(decoded[:body_length]), decoded[body_length:]):
+            (issued, _node_id, _random) = struct.unpack(self.body_format, decoded[:body_length])
+            if issued + self.lifetime >= uts_now() >= issued - 60:
+                # forged and expired nonces never reach the database - the mac identifies the nonce
+                result = bool(self.dbstore.nonce_spend(base64.urlsafe_b64encode(decoded[body_length:]).decode('utf-8')))
+        return result
+
+    def expire(self):
+        """ delete consumed nonces older than the nonce lifetime - they fail the age check anyway """
+        self.logger.debug('NonceStoreHmac.expire()')
+        return self.dbstore.nonce_purge(self.lifetime)
+
+    def mac_get(self, body):
+        """ compute truncated hmac of a nonce body """
+        return hmac.new(self.secret, body, hashlib.sha256).digest()[:self.mac_length]
+
+    def new(self):
+        """ generate a signed nonce """
+        body = struct.pack(self.body_format, uts_now(), self.node_id, os.urandom(12))
+        return base64.urlsafe_b64encode(body + self.mac_get(body)).decode('utf-8')
+
+class NonceStoreMemory(object):
+    """ in-process nonce store (single worker deployments only) """
+
+    def __init__(self, _debug=None, logger=None, lifetime=3600):
+        self.logger = logger
+        self.lifetime = lifetime
+
+    def add(self, nonce):
+        """ store nonce """
+        self.logger.debug('NonceStoreMemory.add({0})'.format(nonce))
+        shard = self.shard_get(nonce)
+        now = uts_now()
+        with shard[0]:
+            shard[1][nonce] = now + self.lifetime
+            if now - shard[2] > min(self.lifetime, 60):
+                self.shard_purge(shard, now)
+        return nonce
+
+    def check_and_delete(self, nonce):
+        """ check if nonce exists and delete it """
+        self.logger.debug('NonceStoreMemory.check_and_delete({0})'.format(nonce))
+        shard = self.shard_get(nonce)
+        with shard[0]:
+            expires = shard[1].pop(nonce, None)
+        return bool(expires and expires >= uts_now())
+
+    def expire(self):
+        """ delete expired nonces """
+        self.logger.debug('NonceStoreMemory.expire()')
+        deleted = 0
+        now = uts_now()
+        for shard in MEMORY_SHARD_LIST:
+            with shard[0]:
+                deleted += self.shard_purge(shard, now)
+        return deleted
+
+    def shard_get(self, nonce):
+        """ get shard for a nonce """
+        return MEMORY_SHARD_LIST[hash(nonce) % len(MEMORY_SHARD_LIST)]
+
+    def shard_purge(self, shard, now):
+        """ delete expired nonces from a shard - caller must hold the shard lock """
+        expired_list = [nonce for nonce, expires in shard[1].items() if expires < now]
+        for nonce in expired_list:
+            del shard[1][nonce]
+        shard[2] = now
+        return len(expired_list)
+
 class Nonce(object):
     """ Nonce handler """
 
-    def __init__(self, debug=None, logger=None):
+    def __init__(self, debug=None, logger=None, context=None):
         self.debug = debug
         self.logger = logger
-        self.dbstore = DBstore(self.debug, self.logger)
+        self.context = context
+        self.backend = 'db'
+        self.lifetime = 3600
+        self.purge_interval = 60
+        self.file_path = None
+        self.secret = None
+        self.node_id = 0
+        self.load_config()
+        self.store = self.store_get()
 
     def __enter__(self):
         """ Makes ACMEHandler a Context Manager """
@@ -35,8 +242,7 @@ class Nonce(object):
     def check_and_delete(self, nonce):
         """ check if nonce exists and delete it """
         self.logger.debug('Nonce.nonce_check_and_delete({0})'.format(nonce))
-        if self.dbstore.nonce_check(nonce):
-            self.dbstore.nonce_delete(nonce)
+        if self.store.check_and_delete(nonce):
             code = 200
             message = None
             detail = None
@@ -47,16 +253,65 @@ class Nonce(object):
         self.logger.debug('Nonce.check_and_delete() ended with:{0}'.format(code))
         return(code, message, detail)
 
+    def expire(self):
+        """ purge expired nonces once per purge_interval """
+        self.logger.debug('Nonce.expire()')
+        now = uts_now()
+        if now - EXPIRE_DIC['last'] >= self.purge_interval:
+            EXPIRE_DIC['last'] = now
+            deleted = self.store.expire()
+            self.logger.debug('Nonce.expire() deleted {0} nonces'.format(deleted))
+
     def generate_and_add(self):
         """ generate new nonce and store it """
         self.logger.debug('Nonce.nonce_generate_and_add()')
         nonce = self.new()
         self.logger.debug('got nonce: {0}'.format(nonce))
-        _id = self.dbstore.nonce_add(nonce)
+        _id = self.store.add(nonce)
+        self.expire()
         self.logger.debug('Nonce.generate_and_add() ended with:{0}'.format(nonce))
         return nonce
 
+    def load_config(self):
+        """" load config from file """
+        self.logger.debug('Nonce.load_config()')
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
+        if 'Nonce' in config_dic:
+            self.backend = config_dic.get('Nonce', 'nonce_backend', fallback='db')
+            self.lifetime = config_dic.getint('Nonce', 'nonce_lifetime', fallback=3600)
+            self.purge_interval = config_dic.getint('Nonce', 'nonce_purge_interval', fallback=60)
+            self.file_path = config_dic.get('Nonce', 'nonce_file_path', fallback=None)
+            self.secret = config_dic.get('Nonce', 'nonce_secret', fallback=None)
+            self.node_id = config_dic.getint('Nonce', 'nonce_node_id', fallback=0)
+        self.logger.debug('Nonce.load_config() ended')
+
     def new(self):
         """ generate a new nonce """
         self.logger.debug('Nonce.nonce_new()')
-        return uuid.uuid4().hex
+        if self.backend == 'hmac':
+            nonce = self.store.new()
+        else:
+            nonce = uuid.uuid4().hex
+        return nonce
+
+    def store_get(self):
+        """ create nonce store based on configured backend """
+        self.logger.debug('Nonce.store_get({0})'.format(self.backend))
+        if self.backend == 'memory':
+            store = NonceStoreMemory(self.debug, self.logger, self.lifetime)
+        elif self.backend == 'file':
+            store = NonceStoreFile(self.debug, self.logger, self.lifetime, self.file_path)
+        elif self.backend == 'hmac' and self.secret:
+            store = NonceStoreHmac(self.debug, self.logger, self.lifetime, self.secret, self.node_id)
+        else:
+            if self.backend == 'hmac':
+                # a secret per process would make every worker refuse the nonces of the others
+                self.logger.error('Nonce.store_get(): nonce_secret missing. Using database')
+                self.backend = 'db'
+            elif self.backend != 'db':
+                self.logger.error('Nonce.store_get(): unknown backend "{0}". Using database'.format(self.backend))
+            store = NonceStoreDb(self.debug, self.logger, self.lifetime)
+        return store
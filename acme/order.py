@@ -3,23 +3,43 @@
 """ Order class """
 from __future__ import print_function
 import json
-from acme.helper import b64_url_recode, generate_random_string, load_config, parse_url, uts_to_date_utc, uts_now
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from acme.helper import b64_url_recode, csr_parse, generate_random_string, load_config, parse_url, state_cache_get, state_cache_set, uts_to_date_utc, uts_now
 from acme.certificate import Certificate
 from acme.db_handler import DBstore
+from acme.job import Job
 from acme.message import Message
 
+# worker pool for background enrollment: created on first use, recreated in forked children
+# runs: number of enrollment_run calls submitted to the pool and not finished yet
+ENROLLMENT_POOL_DIC = {'lock': threading.Lock(), 'executor': None, 'pid': None, 'runs': 0}
+
+# finalize requests in flight: {order_name: [lock, number of requests using the lock]}
+FINALIZE_DIC = {'lock': threading.Lock(), 'flights': {}}
+
 class Order(object):
     """ class for order handling """
 
-    def __init__(self, debug=None, srv_name=None, logger=None, expiry=86400):
+    def __init__(self, debug=None, srv_name=None, logger=None, expiry=86400, context=None):
         self.server_name = srv_name
         self.debug = debug
         self.logger = logger
-        self.dbstore = DBstore(self.debug, self.logger)
-        self.message = Message(self.debug, self.server_name, self.logger)
+        self.context = context
+        if self.context:
+            self.dbstore = self.context.dbstore_get()
+        else:
+            self.dbstore = DBstore(self.debug, self.logger)
+        self.message = Message(self.debug, self.server_name, self.logger, self.context)
         self.expiry = expiry
         self.path_dic = {'authz_path' : '/acme/authz/', 'order_path' : '/acme/order/', 'cert_path' : '/acme/cert/'}
         self.tnauthlist_support = False
+        self.authz_reuse = False
+        self.authz_reuse_margin = 3600
+        self.enrollment_workers = 0
+        self.retry_after = 10
+        self.state_cache_lifetime = 0
 
     def __enter__(self):
         """ Makes ACMEHandler a Context Manager """
@@ -58,29 +78,177 @@ class Order(object):
             if error:
                 data_dic['status'] = 1
 
-            # add order to db
-            oid = self.dbstore.order_add(data_dic)
-
             if not error:
+                authz_list = []
+                reuse_list = []
+                for auth in payload['identifiers']:
+                    # generate name
+                    auth_name = generate_random_string(self.logger, 12)
+                    # store to return to upper func
+                    auth_dic[auth_name] = auth.copy()
+                    auth['name'] = auth_name
+                    auth['status'] = 'pending'
+                    if self.authz_reuse:
+                        # account validated this identifier already - no need to do it again
+                        reuse_dic = self.dbstore.authorization_reusable_lookup(aname, auth, uts_now() + self.authz_reuse_margin)
+                        if reuse_dic:
+                            self.logger.debug('Order.add(): reuse authorization {0} for {1}'.format(reuse_dic['name'], auth['value']))
+                            auth['status'] = 'valid'
+                            auth['expires'] = reuse_dic['expires']
+                            reuse_list.append((reuse_dic['name'], auth_name))
+                    authz_list.append(auth)
+
+                if authz_list and all(authz['status'] == 'valid' for authz in authz_list):
+                    # all identifiers are authorized - order can be finalized right away
+                    data_dic['status'] = 3
+
+                # add order and authorizations to db in a single transaction
+                oid = self.dbstore.order_add_with_authorizations(data_dic, authz_list)
                 if oid:
-                    error = None
-                    for auth in payload['identifiers']:
-                        # generate name
-                        auth_name = generate_random_string(self.logger, 12)
-                        # store to return to upper func
-                        auth_dic[auth_name] = auth.copy()
-                        auth['name'] = auth_name
-                        auth['order'] = oid
-                        auth['status'] = 'pending'
-                        self.dbstore.authorization_add(auth)
+                    for (source_name, auth_name) in reuse_list:
+                        self.challenges_copy(source_name, auth_name)
                 else:
+                    auth_dic = {}
                     error = 'urn:ietf:params:acme:error:malformed'
+            else:
+                # add order to db
+                self.dbstore.order_add(data_dic)
         else:
             error = 'urn:ietf:params:acme:error:unsupportedIdentifier'
 
         # print(auth_dic)
         return(error, order_name, auth_dic, uts_to_date_utc(expires))
 
+    def challenges_copy(self, source_name, authz_name):
+        """ copy the validated challenges of a reused authorization - otherwise pending challenges get created on first access """
+        self.logger.debug('Order.challenges_copy({0}:{1})'.format(source_name, authz_name))
+        count = 0
+        for challenge in self.dbstore.challenges_lookup('authorization__name', source_name, ['type', 'token', 'status__name', 'expires']):
+            if challenge['status__name'] == 'valid':
+                data_dic = {
+                    'name' : generate_random_string(self.logger, 12),
+                    'expires' : challenge['expires'],
+                    'type' : challenge['type'],
+                    'token' : challenge['token'],
+                    'authorization' : authz_name,
+                    'status' : 5
+                }
+                if self.dbstore.challenge_add(data_dic):
+                    count += 1
+        self.logger.debug('Order.challenges_copy() ended with: {0}'.format(count))
+        return count
+
+    def enrollment_executor_get(self):
+        """ get worker pool for background enrollment """
+        self.logger.debug('Order.enrollment_executor_get()')
+        with ENROLLMENT_POOL_DIC['lock']:
+            # threads do not survive a fork - a child process needs its own pool
+            if not ENROLLMENT_POOL_DIC['executor'] or ENROLLMENT_POOL_DIC['pid'] != os.getpid():
+                self.logger.debug('Order.enrollment_executor_get(): create pool with {0} workers'.format(self.enrollment_workers))
+                ENROLLMENT_POOL_DIC['executor'] = ThreadPoolExecutor(max_workers=self.enrollment_workers)
+                ENROLLMENT_POOL_DIC['pid'] = os.getpid()
+                # runs submitted in the parent will never finish here
+                ENROLLMENT_POOL_DIC['runs'] = 0
+            executor = ENROLLMENT_POOL_DIC['executor']
+        return executor
+
+    def enrollment_run(self):
+        """ process queued enrollment jobs in a worker thread """
+        self.logger.debug('Order.enrollment_run()')
+        # dbstore objects are not thread-safe - use a fresh job object
+        with Job(self.debug, self.server_name, self.logger, self.context) as job:
+            try:
+                count = job.dispatch()
+            except BaseException as err:
+                # job stays claimed and gets picked up again once its lease expired
+                self.logger.error('Order.enrollment_run() failed: {0}'.format(err))
+                count = 0
+            finally:
+                with ENROLLMENT_POOL_DIC['lock']:
+                    ENROLLMENT_POOL_DIC['runs'] -= 1
+        self.logger.debug('Order.enrollment_run() ended with: {0}'.format(count))
+        return count
+
+    def enrollment_run_submit(self, idle=False):
+        """ hand over enrollment_run to the worker pool - idle: only if no run is in flight in this process """
+        self.logger.debug('Order.enrollment_run_submit({0})'.format(idle))
+        executor = self.enrollment_executor_get()
+        with ENROLLMENT_POOL_DIC['lock']:
+            submit = not (idle and ENROLLMENT_POOL_DIC['runs'])
+            if submit:
+                ENROLLMENT_POOL_DIC['runs'] += 1
+        if submit:
+            executor.submit(self.enrollment_run)
+        else:
+            self.logger.debug('Order.enrollment_run_submit(): enrollment_run in flight. Skipping')
+        return submit
+
+    def enrollment_submit(self, order_name, csr):
+        """ store csr, queue the enrollment job and set order to processing """
+        self.logger.debug('Order.enrollment_submit({0})'.format(order_name))
+        # concurrent retries of the same finalize request must not queue a second job
+        flight = self.finalize_enter(order_name)
+        try:
+            (code, message, detail) = self.enrollment_queue(order_name, csr)
+        finally:
+            self.finalize_leave(order_name, flight)
+        self.logger.debug('Order.enrollment_submit() ended with: {0}'.format(code))
+        return(code, message, detail)
+
+    def enrollment_queue(self, order_name, csr):
+        """ store csr, queue the enrollment job and set order to processing """
+        self.logger.debug('Order.enrollment_queue({0})'.format(order_name))
+        order_dic = self.info(order_name)
+        if order_dic:
+            code = 200
+            message = None
+            detail = None
+            if order_dic.get('status') in ('processing', 'valid'):
+                self.logger.debug('Order.enrollment_queue(): order is {0}. Skipping'.format(order_dic['status']))
+            elif order_dic.get('status') != 'ready':
+                code = 403
+                message = 'urn:ietf:params:acme:error:orderNotReady'
+                detail = 'order is {0}'.format(order_dic.get('status'))
+            else:
+                # change decoding from b64url to b64
+                csr = b64_url_recode(self.logger, csr)
+                with Certificate(self.debug, self.server_name, self.logger, self.context) as certificate:
+                    certificate_name = certificate.store_csr(order_name, csr)
+                if certificate_name:
+                    # job survives a restart of this process - any worker can pick it up
+                    with Job(self.debug, self.server_name, self.logger, self.context) as job:
+                        job.add(order_name, certificate_name)
+                    self.update({'name' : order_name, 'status': 'processing'})
+                    self.enrollment_run_submit()
+                else:
+                    code = 500
+                    message = 'urn:ietf:params:acme:error:serverInternal'
+                    detail = 'CSR processing failed'
+        else:
+            code = 400
+            message = 'urn:ietf:params:acme:error:unauthorized'
+            detail = 'order: {0} not found'.format(order_name)
+        self.logger.debug('Order.enrollment_queue() ended with: {0}'.format(code))
+        return(code, message, detail)
+
+    def finalize_enter(self, order_name):
+        """ wait until no other finalize request for this order is in flight """
+        self.logger.debug('Order.finalize_enter({0})'.format(order_name))
+        with FINALIZE_DIC['lock']:
+            flight = FINALIZE_DIC['flights'].setdefault(order_name, [threading.Lock(), 0])
+            flight[1] += 1
+        flight[0].acquire()
+        return flight
+
+    def finalize_leave(self, order_name, flight):
+        """ release finalize lock of an order """
+        self.logger.debug('Order.finalize_leave({0})'.format(order_name))
+        flight[0].release()
+        with FINALIZE_DIC['lock']:
+            flight[1] -= 1
+            if not flight[1]:
+                del FINALIZE_DIC['flights'][order_name]
+
     def name_get(self, url):
         """ get ordername """
         self.logger.debug('Order.get_name({0})'.format(url))
@@ -157,6 +325,7 @@ class Order(object):
         self.logger.debug('Order.parse()')
 
         response_dic = {}
+        order_dic = None
         # check message
         (code, message, detail, protected, payload, _account_name) = self.message.check(content)
         if code == 200:
@@ -164,14 +333,24 @@ class Order(object):
                 order_name = self.name_get(protected['url'])
                 if 'finalize' in protected['url']:
                     self.logger.debug('finalize request()')
-                    if  'csr' in payload:
+                    if  'csr' in payload and self.enrollment_workers:
+                        self.logger.debug('CSR found() - enroll in background')
+                        (code, message, detail) = self.enrollment_submit(order_name, payload['csr'])
+                        # retry of an already finished finalize request
+                        cert_dic = self.dbstore.certificate_lookup('order__name', order_name)
+                        if cert_dic:
+                            certificate_name = cert_dic['name']
+                        else:
+                            certificate_name = None
+                    elif  'csr' in payload:
                         self.logger.debug('CSR found()')
                         # this is a new request
                         (code, certificate_name, detail) = self.process_csr(order_name, payload['csr'])
-                        if code == 200:
-                            # update order_status / set to valid
-                            self.update({'name' : order_name, 'status': 'valid'})
-                        else:
+                        if code == 403:
+                            # order not ready - pass the error on to the client
+                            message = certificate_name
+                            certificate_name = None
+                        elif code != 200:
                             self.logger.debug('no CSR found()')
                             code = 400
                             message = 'urn:ietf:params:acme:error:badCSR'
@@ -183,13 +362,8 @@ class Order(object):
                 else:
                     self.logger.debug('polling request()')
                     code = 200
-                    # this is a polling request; lookup certificate
-                    cert_dic = self.dbstore.certificate_lookup('order__name', order_name)
-                    if cert_dic:
-                        # we found a cert in the database
-                        certificate_name = cert_dic['name']
-                    else:
-                        certificate_name = None
+                    # this is a polling request; lookup certificate and order
+                    (certificate_name, order_dic) = self.state_get(order_name)
             else:
                 code = 400
                 message = 'urn:ietf:params:acme:error:malformed'
@@ -199,9 +373,17 @@ class Order(object):
                 # create response
                 response_dic['header'] = {}
                 response_dic['header']['Location'] = '{0}{1}{2}'.format(self.server_name, self.path_dic['order_path'], order_name)
-                response_dic['data'] = self.lookup(order_name)
+                if order_dic is None:
+                    order_dic = self.lookup(order_name)
+                response_dic['data'] = order_dic
                 response_dic['data']['finalize'] = '{0}{1}{2}/finalize'.format(self.server_name, self.path_dic['order_path'], order_name)
-                if certificate_name:
+                if response_dic['data'].get('status') == 'processing':
+                    # enrollment still running - certificate is not there yet
+                    response_dic['header']['Retry-After'] = '{0}'.format(self.retry_after)
+                    if self.enrollment_workers and 'finalize' not in protected['url']:
+                        # pick up jobs waiting for a retry or left behind by a stopped worker - a running enrollment_run claims them anyway
+                        self.enrollment_run_submit(idle=True)
+                elif certificate_name:
                     response_dic['data']['certificate'] = '{0}{1}{2}'.format(self.server_name, self.path_dic['cert_path'], certificate_name)
 
         # prepare/enrich response
@@ -214,38 +396,89 @@ class Order(object):
     def process_csr(self, order_name, csr):
         """ process certificate signing request """
         self.logger.debug('Order.process_csr({0})'.format(order_name))
+        # concurrent retries wait for the first request and reuse its result
+        flight = self.finalize_enter(order_name)
+        try:
+            (code, message, detail) = self.process_csr_locked(order_name, csr)
+        finally:
+            self.finalize_leave(order_name, flight)
+        self.logger.debug('Order.process_csr() ended with order:{0} {1}:{2}:{3}'.format(order_name, code, message, detail))
+        return(code, message, detail)
+
+    def process_csr_locked(self, order_name, csr):
+        """ process certificate signing request - caller must hold the finalize lock of the order """
+        self.logger.debug('Order.process_csr_locked({0})'.format(order_name))
 
         order_dic = self.info(order_name)
 
         if order_dic:
-            # change decoding from b64url to b64
-            csr = b64_url_recode(self.logger, csr)
+            if order_dic.get('status') in ('processing', 'valid'):
+                # a retried finalize request gets the certificate we already have
+                cert_dic = self.dbstore.certificate_lookup('order__name', order_name, ('name',))
+                self.logger.debug('Order.process_csr_locked(): order is {0}. Skipping'.format(order_dic['status']))
+                code = 200
+                message = cert_dic['name'] if cert_dic else None
+                detail = None
+            elif order_dic.get('status') != 'ready':
+                code = 403
+                message = 'urn:ietf:params:acme:error:orderNotReady'
+                detail = 'order is {0}'.format(order_dic.get('status'))
+            else:
+                # change decoding from b64url to b64 - parsed once for csr check and ca handler
+                csr = csr_parse(self.logger, b64_url_recode(self.logger, csr))
+                cert_dic = self.dbstore.certificate_lookup('order__name', order_name, ('name', 'csr', 'cert'))
+                with Certificate(self.debug, self.server_name, self.logger, self.context) as certificate:
+                    if cert_dic and not cert_dic.get('cert') and cert_dic.get('csr') == csr:
+                        # previous enrollment failed - retry without adding another certificate entry
+                        certificate_name = cert_dic['name']
+                    else:
+                        certificate_name = certificate.store_csr(order_name, csr)
+                    if certificate_name:
+                        (_result, error, detail) = certificate.enroll_and_store(certificate_name, csr)
+                        if not error:
+                            code = 200
+                            message = certificate_name
+                            detail = None
+                            # retries of this finalize request return the certificate from now on
+                            self.update({'name' : order_name, 'status': 'valid'})
+                        else:
+                            code = 500
+                            message = error
 
-            with Certificate(self.debug, self.server_name, self.logger) as certificate:
-                # certificate = Certificate(self.debug, self.server_name, self.logger)
-                certificate_name = certificate.store_csr(order_name, csr)
-                if certificate_name:
-                    (_result, error, detail) = certificate.enroll_and_store(certificate_name, csr)
-                    if not error:
-                        code = 200
-                        message = certificate_name
-                        detail = None
                     else:
                         code = 500
-                        message = error
-
-                else:
-                    code = 500
-                    message = 'urn:ietf:params:acme:error:serverInternal'
-                    detail = 'CSR processing failed'
+                        message = 'urn:ietf:params:acme:error:serverInternal'
+                        detail = 'CSR processing failed'
         else:
             code = 400
             message = 'urn:ietf:params:acme:error:unauthorized'
             detail = 'order: {0} not found'.format(order_name)
 
-        self.logger.debug('Order.process_csr() ended with order:{0} {1}:{2}:{3}'.format(order_name, code, message, detail))
+        self.logger.debug('Order.process_csr_locked() ended with order:{0} {1}:{2}:{3}'.format(order_name, code, message, detail))
         return(code, message, detail)
 
+    def state_get(self, order_name):
+        """ get certificate name and details of a polled order - from cache if enabled """
+        self.logger.debug('Order.state_get({0})'.format(order_name))
+        if self.state_cache_lifetime:
+            (state, generation) = state_cache_get(self.logger, ('order', order_name))
+        else:
+            state = None
+        if state:
+            (certificate_name, order_dic) = state
+        else:
+            cert_dic = self.dbstore.certificate_lookup('order__name', order_name)
+            if cert_dic:
+                # we found a cert in the database
+                certificate_name = cert_dic['name']
+            else:
+                certificate_name = None
+            order_dic = self.lookup(order_name)
+            if self.state_cache_lifetime and order_dic:
+                state_cache_set(self.logger, ('order', order_name), (certificate_name, order_dic), self.state_cache_lifetime, generation)
+        self.logger.debug('Order.state_get() ended with: {0}'.format(certificate_name))
+        return(certificate_name, order_dic)
+
     def update(self, data_dic):
         """ update order based on ordername """
         self.logger.debug('Order.update({0})'.format(data_dic))
@@ -283,7 +516,15 @@ class Order(object):
     def load_config(self):
         """" load config from file """
         self.logger.debug('Order.load_config()')
-        config_dic = load_config()
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
         if 'Order' in config_dic:
             self.tnauthlist_support = config_dic.getboolean('Order', 'tnauthlist_support', fallback=False)
+            self.authz_reuse = config_dic.getboolean('Order', 'authz_reuse', fallback=False)
+            self.authz_reuse_margin = config_dic.getint('Order', 'authz_reuse_margin', fallback=3600)
+            self.enrollment_workers = config_dic.getint('Order', 'enrollment_workers', fallback=0)
+            self.retry_after = config_dic.getint('Order', 'retry_after', fallback=10)
+            self.state_cache_lifetime = config_dic.getint('Order', 'state_cache_lifetime', fallback=0)
         self.logger.debug('Order.load_config() ended.')
@@ -2,21 +2,27 @@
 # -*- coding: utf-8 -*-
 """ Signature class """
 from __future__ import print_function
-from acme.helper import signature_check
+from acme.helper import jwk_cache_get, load_config, signature_check
 from acme.db_handler import DBstore
 
 class Signature(object):
     """ Signature handler """
 
-    def __init__(self, debug=None, srv_name=None, logger=None):
+    def __init__(self, debug=None, srv_name=None, logger=None, context=None):
         self.debug = debug
         self.logger = logger
-        self.dbstore = DBstore(self.debug, self.logger)
+        self.context = context
+        if context:
+            self.dbstore = context.dbstore_get()
+        else:
+            self.dbstore = DBstore(self.debug, self.logger)
         self.server_name = srv_name
         self.revocation_path = '/acme/revokecert'
+        self.jwk_cache_lifetime = 0
+        self.load_config()
 
     def check(self, aname, content, use_emb_key=False, protected=None):
-        """ signature check """
+        """ signature check - content can be a raw message or a token parsed by jws_decode() """
         self.logger.debug('Signature.check({0})'.format(aname))
         result = False
         if content:
@@ -46,4 +52,16 @@ class Signature(object):
     def jwk_load(self, kid):
         """ get key for a specific account id """
         self.logger.debug('Signature.jwk_load({0})'.format(kid))
-        return self.dbstore.jwk_load(kid)
+        (pub_key, _thumbprint) = jwk_cache_get(self.logger, self.dbstore, kid, self.jwk_cache_lifetime)
+        return pub_key
+
+    def load_config(self):
+        """" load config from file """
+        self.logger.debug('Signature.load_config()')
+        if self.context:
+            config_dic = self.context.config_dic
+        else:
+            config_dic = load_config()
+        if 'Account' in config_dic:
+            self.jwk_cache_lifetime = config_dic.getint('Account', 'jwk_cache_lifetime', fallback=0)
+        self.logger.debug('Signature.load_config() ended')
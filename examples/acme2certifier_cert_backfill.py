@@ -0,0 +1,32 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" store serial, fingerprint, validity, issuer and SANs of certificates
+issued before the metadata columns got added
+
+usage: python acme2certifier_cert_backfill.py [batch]
+
+uses the same acme_srv.cfg and database as the web server and can run while
+the server is active. Processes [batch] certificates per query (default: 100). """
+from __future__ import print_function
+import sys
+from acme.context import Context
+from acme.helper import load_config, logger_setup
+from acme.certificate import Certificate
+
+# load config to set debug mode
+CONFIG = load_config()
+DEBUG = CONFIG.getboolean('DEFAULT', 'debug')
+
+# initialize logger
+LOGGER = logger_setup(DEBUG)
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        BATCH = int(sys.argv[1])
+    else:
+        BATCH = 100
+
+    with Certificate(DEBUG, None, LOGGER, Context(DEBUG, LOGGER)) as CERTIFICATE:
+        COUNT = CERTIFICATE.metadata_backfill(BATCH)
+    print('metadata stored for {0} certificates'.format(COUNT))
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" standalone worker processing queued certificate enrollments
+
+usage: python acme2certifier_job_worker.py [interval]
+
+runs next to the web server processes and uses the same acme_srv.cfg and
+database. Checks for due jobs every [interval] seconds (default: 10). """
+from __future__ import print_function
+import sys
+import time
+from acme.context import Context
+from acme.helper import load_config, logger_setup
+from acme.job import Job
+
+# load config to set debug mode
+CONFIG = load_config()
+DEBUG = CONFIG.getboolean('DEFAULT', 'debug')
+
+# initialize logger
+LOGGER = logger_setup(DEBUG)
+
+# application context shared by all runs
+CONTEXT = Context(DEBUG, LOGGER)
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        INTERVAL = int(sys.argv[1])
+    else:
+        INTERVAL = 10
+
+    while True:
+        with Job(DEBUG, None, LOGGER, CONTEXT) as JOB:
+            try:
+                JOB.dispatch()
+            except Exception as err:
+                LOGGER.error('job dispatch failed: {0}'.format(err))
+        time.sleep(INTERVAL)
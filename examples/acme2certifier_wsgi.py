@@ -10,8 +10,8 @@ from acme.account import Account
 from acme.authorization import Authorization
 from acme.certificate import Certificate
 from acme.challenge import Challenge
+from acme.context import Context
 from acme.directory import Directory
-from acme.nonce import Nonce
 from acme.order import Order
 from acme.helper import get_url, load_config, logger_setup, logger_info
 
@@ -32,6 +32,9 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 # initialize logger
 LOGGER = logger_setup(DEBUG)
 
+# application context shared by all requests
+CONTEXT = Context(DEBUG, LOGGER)
+
 # examption handling via logger
 sys.excepthook = handle_exception
 
@@ -69,7 +72,7 @@ def get_request_body(environ):
 
 def acct(environ, start_response):
     """ account handling """
-    with Account(DEBUG, get_url(environ), LOGGER) as account:
+    with Account(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as account:
         request_body = get_request_body(environ)
         response_dic = account.parse(request_body)
 
@@ -82,7 +85,7 @@ def acct(environ, start_response):
 def authz(environ, start_response):
     """ account handling """
     if environ['REQUEST_METHOD'] == 'POST' or environ['REQUEST_METHOD'] == 'GET':
-        with Authorization(DEBUG, get_url(environ), LOGGER) as authorization:
+        with Authorization(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as authorization:
             if environ['REQUEST_METHOD'] == 'POST':
                 try:
                     request_body_size = int(environ.get('CONTENT_LENGTH', 0))
@@ -112,7 +115,7 @@ def newaccount(environ, start_response):
     """ create new account """
     if environ['REQUEST_METHOD'] == 'POST':
 
-        account = Account(DEBUG, get_url(environ), LOGGER)
+        account = Account(DEBUG, get_url(environ), LOGGER, context=CONTEXT)
         request_body = get_request_body(environ)
         response_dic = account.new(request_body)
 
@@ -139,7 +142,7 @@ def directory(environ, start_response):
 
 def cert(environ, start_response):
     """ create new account """
-    with Certificate(DEBUG, get_url(environ), LOGGER) as certificate:
+    with Certificate(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as certificate:
         if environ['REQUEST_METHOD'] == 'POST':
             request_body = get_request_body(environ)
             response_dic = certificate.new_post(request_body)
@@ -170,7 +173,7 @@ def cert(environ, start_response):
 
 def chall(environ, start_response):
     """ create new account """
-    with Challenge(DEBUG, get_url(environ), LOGGER) as challenge:
+    with Challenge(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as challenge:
         if environ['REQUEST_METHOD'] == 'POST':
 
             request_body = get_request_body(environ)
@@ -205,7 +208,7 @@ def chall(environ, start_response):
 def newnonce(environ, start_response):
     """ generate a new nonce """
     if environ['REQUEST_METHOD'] == 'HEAD':
-        nonce = Nonce(DEBUG, LOGGER)
+        nonce = CONTEXT.nonce_get()
         headers = [('Content-Type', 'text/plain'), ('Replay-Nonce', '{0}'.format(nonce.generate_and_add()))]
         start_response('200 OK', headers)
         return []
@@ -216,7 +219,7 @@ def newnonce(environ, start_response):
 def neworders(environ, start_response):
     """ generate a new order """
     if environ['REQUEST_METHOD'] == 'POST':
-        with Order(DEBUG, get_url(environ), LOGGER) as norder:
+        with Order(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as norder:
             request_body = get_request_body(environ)
             response_dic = norder.new(request_body)
 
@@ -235,7 +238,7 @@ def neworders(environ, start_response):
 def order(environ, start_response):
     """ order_handler """
     if environ['REQUEST_METHOD'] == 'POST':
-        with Order(DEBUG, get_url(environ), LOGGER) as eorder:
+        with Order(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as eorder:
             request_body = get_request_body(environ)
             response_dic = eorder.parse(request_body)
 
@@ -254,7 +257,7 @@ def order(environ, start_response):
 def revokecert(environ, start_response):
     """ revocation_handler """
     if environ['REQUEST_METHOD'] == 'POST':
-        with Certificate(DEBUG, get_url(environ), LOGGER) as certificate:
+        with Certificate(DEBUG, get_url(environ), LOGGER, context=CONTEXT) as certificate:
             request_body = get_request_body(environ)
             response_dic = certificate.revoke(request_body)
 
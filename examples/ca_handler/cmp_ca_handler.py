@@ -5,7 +5,7 @@ from __future__ import print_function
 import os
 import time
 import subprocess
-from acme.helper import load_config, csr_dn_get, csr_pubkey_get, csr_san_get
+from acme.helper import load_config, csr_dn_get, csr_parse, csr_pubkey_get, csr_san_get
 
 class CAhandler(object):
     """ EST CA  handler """
@@ -75,6 +75,8 @@ class CAhandler(object):
         cert_raw = None
 
         if self.openssl_bin:
+            # parse csr once for subject, public key and SANs
+            csr = csr_parse(self.logger, csr)
             # get unix time stamp
             uts = str(int(time.time()))
             # get subject
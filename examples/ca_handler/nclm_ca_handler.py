@@ -6,7 +6,7 @@ import json
 import sys
 import time
 import requests
-from acme.helper import load_config, csr_cn_get, b64_url_recode, csr_san_get, cert_serial_get, date_to_uts_utc, uts_now
+from acme.helper import load_config, csr_cn_get, b64_url_recode, csr_parse, csr_san_get, cert_serial_get, date_to_uts_utc, uts_now
 
 class CAhandler(object):
     """ CA  handler """
@@ -164,15 +164,16 @@ class CAhandler(object):
         error = None
         cert_raw = None
 
-        # recode csr
+        # recode csr - keep the parsed one to get cn and SANs
+        csr_obj = csr_parse(self.logger, csr)
         csr = b64_url_recode(self.logger, csr)
 
         if self.tsg_info_dic['id']:
 
             ca_id = self.ca_id_lookup()
             # get common name of CSR
-            csr_cn = csr_cn_get(self.logger, csr)
-            csr_san_list = csr_san_get(self.logger, csr)
+            csr_cn = csr_cn_get(self.logger, csr_obj)
+            csr_san_list = csr_san_get(self.logger, csr_obj)
 
             # import csr to NCLM
             self.request_import(csr)
@@ -7,7 +7,7 @@ import json
 import base64
 import uuid
 from OpenSSL import crypto
-from acme.helper import load_config, build_pem_file, uts_now, uts_to_date_utc, b64_url_recode, cert_serial_get, convert_string_to_byte, convert_byte_to_string
+from acme.helper import load_config, uts_now, uts_to_date_utc, cert_parse, cert_serial_get, convert_string_to_byte, convert_byte_to_string, csr_parse
 
 class CAhandler(object):
     """ CA  handler """
@@ -75,14 +75,14 @@ class CAhandler(object):
 
         if not error:
             try:
-                # prepare the CSR
-                csr = build_pem_file(self.logger, None, b64_url_recode(self.logger, csr), None, True)
+                # parse the CSR - already done if we got a parsed one
+                csr = csr_parse(self.logger, csr)
 
                 # load ca cert and key
                 (ca_key, ca_cert) = self.load_ca_key_cert()
 
                 # creating a rest form CSR
-                req = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr)
+                req = csr.req
                 # sign csr
                 cert = crypto.X509()
                 cert.gmtime_adj_notBefore(0)
@@ -92,7 +92,7 @@ class CAhandler(object):
                 cert.set_pubkey(req.get_pubkey())
                 cert.set_serial_number(uuid.uuid4().int)
                 # cert.set_serial_number(uts_now())
-                cert.add_extensions(req.get_extensions())
+                cert.add_extensions(csr.extension_list)
                 cert.add_extensions([
                     crypto.X509Extension(convert_string_to_byte('authorityKeyIdentifier'), False, convert_string_to_byte('keyid:always'), issuer=ca_cert),
                     crypto.X509Extension(convert_string_to_byte('extendedKeyUsage'), False, convert_string_to_byte('clientAuth')),
@@ -196,6 +196,8 @@ class CAhandler(object):
         if 'crl' in self.issuer_dict and self.issuer_dict['crl']:
             # load ca cert and key
             (ca_key, ca_cert) = self.load_ca_key_cert()
+            # decode the certificate once for chain verification and serial lookup
+            cert = cert_parse(self.logger, cert)
             result = self.verify_certificate_chain(cert, ca_cert)
             # proceed if the cert and ca-cert belong together
             if not result:
@@ -250,9 +252,8 @@ class CAhandler(object):
         """ verify certificate chain """
         self.logger.debug('CAhandler.verify_certificate_chain()')
 
-        pem_file = build_pem_file(self.logger, None, b64_url_recode(self.logger, cert), True)
         try:
-            cert = crypto.load_certificate(crypto.FILETYPE_PEM, pem_file)
+            cert = cert_parse(self.logger, cert).cert
         except BaseException:
             cert = None
 
@@ -3,7 +3,12 @@
 """ django handler for acmesrv.py """
 from __future__ import print_function
 import json
-from acme.models import Account, Authorization, Certificate, Challenge, Nonce, Order, Status
+import datetime
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from acme.helper import cert_fingerprint_get, state_cache_invalidate
+from acme.models import Account, Authorization, Certificate, Challenge, Job, Nonce, Order, Status
 
 class DBstore(object):
     """ helper to do datebase operations """
@@ -15,7 +20,10 @@ class DBstore(object):
     def account_add(self, data_dic):
         """ add account in database """
         self.logger.debug('DBStore.account_add({0})'.format(data_dic))
-        account_list = self.account_lookup('jwk', data_dic['jwk'])
+        if data_dic.get('thumbprint'):
+            account_list = self.account_lookup('thumbprint', data_dic['thumbprint'])
+        else:
+            account_list = self.account_lookup('jwk', data_dic['jwk'])
         if account_list:
             created = False
             aname = account_list['name']
@@ -34,7 +42,11 @@ class DBstore(object):
     def account_lookup(self, mkey, value):
         """ search account for a given id """
         self.logger.debug('DBStore.account_lookup({0}:{1})'.format(mkey, value))
-        account_dict = Account.objects.filter(**{mkey: value}).values('id', 'jwk', 'name', 'contact', 'alg', 'created_at')[:1]
+        # filter(key=None) would match all accounts without value
+        if value is not None:
+            account_dict = Account.objects.filter(**{mkey: value}).values('id', 'jwk', 'thumbprint', 'name', 'contact', 'alg', 'created_at')[:1]
+        else:
+            account_dict = None
         if account_dict:
             result = account_dict[0]
         else:
@@ -55,6 +67,36 @@ class DBstore(object):
         self.logger.debug('acct_id({0})'.format(obj.id))
         return obj.id
 
+    def job_add(self, data_dic):
+        """ add issuance job to database - an existing job for the certificate is kept
+        in: name, order_name, next_run
+        return: true if the job got added """
+        self.logger.debug('DBStore.job_add({0})'.format(data_dic['name']))
+        _obj, created = Job.objects.get_or_create(name=data_dic['name'], defaults=data_dic)
+        return created
+
+    def job_claim(self, token, now, lease):
+        """ claim the next due job - queued jobs and running jobs with an expired lease
+        in: token identifying the claim, current time, lease in seconds
+        return: dictionary of the claimed job or None """
+        self.logger.debug('DBStore.job_claim({0})'.format(token))
+        result = None
+        with transaction.atomic():
+            # row lock keeps concurrent workers from claiming the same job
+            job_list = Job.objects.select_for_update().filter(Q(status='queued', next_run__lte=now) | Q(status='running', lease_until__lt=now)).order_by('next_run').values_list('id', flat=True)[:1]
+            if job_list:
+                Job.objects.filter(id=job_list[0]).update(status='running', token=token, lease_until=now + lease, attempts=F('attempts') + 1)
+                result = Job.objects.filter(id=job_list[0]).values()[0]
+        return result
+
+    def job_update(self, data_dic):
+        """ update job - only possible for the holder of the claim
+        in: name, token, status, next_run, error
+        return: true if the job got updated """
+        self.logger.debug('DBStore.job_update({0})'.format(data_dic))
+        result = Job.objects.filter(name=data_dic['name'], token=data_dic['token']).update(status=data_dic['status'], next_run=data_dic['next_run'], error=data_dic['error'], lease_until=0)
+        return result > 0
+
     def jwk_load(self, aname):
         """ looad account informatino and build jwk key dictionary """
         self.logger.debug('DBStore.jwk_load({0})'.format(aname))
@@ -82,12 +124,37 @@ class DBstore(object):
         nonce_list = Nonce.objects.filter(nonce=nonce).values('nonce')[:1]
         return bool(nonce_list)
 
+    def nonce_consume(self, nonce, lifetime):
+        """ delete nonce from database in a single statement
+        in: nonce, lifetime
+        return: true if the nonce existed, was not older than lifetime seconds and got deleted by this call """
+        self.logger.debug('DBStore.nonce_consume({0})'.format(nonce))
+        (result, _detail) = Nonce.objects.filter(nonce=nonce, created_at__gte=timezone.now() - datetime.timedelta(seconds=lifetime)).delete()
+        return result > 0
+
     def nonce_delete(self, nonce):
         """ delete nonce from datbase
         in: nonce """
         self.logger.debug('DBStore.nonce_delete({0})'.format(nonce))
         Nonce.objects.filter(nonce=nonce).delete()
 
+    def nonce_spend(self, nonce):
+        """ record a consumed nonce
+        in: nonce
+        return: true if the nonce was not recorded before """
+        self.logger.debug('DBStore.nonce_spend({0})'.format(nonce))
+        # unique constraint - concurrent workers cannot record the same nonce twice
+        (_obj, created) = Nonce.objects.get_or_create(nonce=nonce)
+        return created
+
+    def nonce_purge(self, lifetime):
+        """ delete nonces older than lifetime seconds
+        in: lifetime
+        return: number of deleted nonces """
+        self.logger.debug('DBStore.nonce_purge({0})'.format(lifetime))
+        (result, _detail) = Nonce.objects.filter(created_at__lt=timezone.now() - datetime.timedelta(seconds=lifetime)).delete()
+        return result
+
     def order_add(self, data_dic):
         """ add order to database """
         self.logger.debug('DBStore.order_add({0})'.format(data_dic))
@@ -101,6 +168,28 @@ class DBstore(object):
         self.logger.debug('order_id({0})'.format(obj.id))
         return obj.id
 
+    def order_add_with_authorizations(self, data_dic, authz_list):
+        """ add order and all its authorizations within a single transaction """
+        self.logger.debug('DBStore.order_add_with_authorizations({0}:{1})'.format(data_dic['name'], len(authz_list)))
+        # replace accountid with instance
+        data_dic['account'] = self.account_getinstance(data_dic['account'])
+
+        # replace orderstatus with an instance
+        data_dic['status'] = self.status_getinstance(data_dic['status'], 'id')
+
+        with transaction.atomic():
+            obj = Order.objects.create(**data_dic)
+            status_dic = {}
+            authz_obj_list = []
+            for authz in authz_list:
+                if authz['status'] not in status_dic:
+                    status_dic[authz['status']] = self.status_getinstance(authz['status'], 'name')
+                authz_obj_list.append(Authorization(name=authz['name'], order=obj, type=authz['type'], value=authz['value'], status=status_dic[authz['status']], expires=authz.get('expires') or 0))
+            Authorization.objects.bulk_create(authz_obj_list)
+
+        self.logger.debug('order_id({0})'.format(obj.id))
+        return obj.id
+
     # django specific
     def order_getinstance(self, value=id, mkey='id'):
         """ get order instance """
@@ -140,6 +229,7 @@ class DBstore(object):
         # add authorization
         obj, _created = Authorization.objects.update_or_create(name=data_dic['name'], defaults=data_dic)
         obj.save()
+        state_cache_invalidate(self.logger, [('authz', obj.name), ('order', obj.order.name)])
 
         self.logger.debug('auth_id({0})'.format(obj.id))
         return obj.id
@@ -150,6 +240,18 @@ class DBstore(object):
         authz_list = Authorization.objects.filter(**{mkey: value}).values(*vlist)[::1]
         return authz_list
 
+    def authorization_reusable_lookup(self, aname, identifier_dic, expires):
+        """ search valid authorization of an account for an identifier
+        in: account name, identifier (type/value), minimum expiry date
+        return: dictionary with name and expires of the authorization or None """
+        self.logger.debug('DBStore.authorization_reusable_lookup({0}:{1})'.format(aname, identifier_dic['value']))
+        authz_list = Authorization.objects.filter(order__account__name=aname, type=identifier_dic['type'], value=identifier_dic['value'], status__name='valid', expires__gt=expires).order_by('-expires').values('name', 'expires')[:1]
+        if authz_list:
+            result = authz_list[0]
+        else:
+            result = None
+        return result
+
     # django specific
     def authorization_getinstance(self, name):
         """ get authorization instance """
@@ -188,6 +290,22 @@ class DBstore(object):
             result = None
         return result
 
+    def challenges_lookup(self, mkey, value, vlist=('name', 'type', 'token', 'status__name')):
+        """ search all challenges for a given key/value pair """
+        self.logger.debug('DBStore.challenges_lookup({0}:{1})'.format(mkey, value))
+        return Challenge.objects.filter(**{mkey: value}).order_by('id').values(*vlist)[::1]
+
+    def challenge_claim(self, name, now, lease):
+        """ set challenge to processing unless it is valid or another validation holds an unexpired lease
+        in: challenge name, current time, lease in seconds
+        return: true if the challenge got claimed """
+        self.logger.debug('DBStore.challenge_claim({0})'.format(name))
+        # single statement - concurrent requests cannot claim the same challenge
+        result = Challenge.objects.filter(name=name).exclude(status__name='valid').exclude(status__name='processing', lease_until__gte=now).update(status=self.status_getinstance('processing', 'name'), lease_until=now + lease) > 0
+        if result:
+            state_cache_invalidate(self.logger, [('authz', Challenge.objects.get(name=name).authorization.name)])
+        return result
+
     def challenge_update(self, data_dic):
         """ update challenge """
         self.logger.debug('challenge_update({0})'.format(data_dic))
@@ -196,6 +314,7 @@ class DBstore(object):
             data_dic['status'] = self.status_getinstance(data_dic['status'], 'name')
         obj, _created = Challenge.objects.update_or_create(name=data_dic['name'], defaults=data_dic)
         obj.save()
+        state_cache_invalidate(self.logger, [('authz', obj.authorization.name)])
 
     def order_lookup(self, mkey, value, vlist=('name', 'notbefore', 'notafter', 'identifiers', 'status__name', 'account__name', 'expires')):
         """ search orders for a given ordername """
@@ -223,6 +342,7 @@ class DBstore(object):
         # add certificate/CSR
         obj, _created = Certificate.objects.update_or_create(name=data_dic['name'], defaults=data_dic)
         obj.save()
+        state_cache_invalidate(self.logger, [('order', obj.order.name)])
         self.logger.debug('DBStore.certificate_add() ended with :{0}'.format(obj.id))
         return obj.id
 
@@ -234,6 +354,12 @@ class DBstore(object):
             data_dic['status'] = self.status_getinstance(data_dic['status'], 'name')
         obj, _created = Order.objects.update_or_create(name=data_dic['name'], defaults=data_dic)
         obj.save()
+        state_cache_invalidate(self.logger, [('order', obj.name)])
+
+    def certificate_backfill_list(self, last_id, limit):
+        """ get issued certificates without metadata """
+        self.logger.debug('DBStore.certificate_backfill_list({0}:{1})'.format(last_id, limit))
+        return Certificate.objects.filter(id__gt=last_id, fingerprint__isnull=True).exclude(cert_raw='').order_by('id').values('id', 'name', 'cert', 'cert_raw')[:limit][::1]
 
     def certificate_lookup(self, mkey, value, vlist=('name', 'csr', 'cert', 'order__name')):
         """ search certificate based on "something" """
@@ -254,7 +380,10 @@ class DBstore(object):
         self.logger.debug('DBStore.certificate_account_check({0})'.format(account_name))
 
         result = None
-        certificate_list = self.certificate_lookup('cert_raw', certificate, ['name', 'order__name', 'order__account__name'])
+        # rows without metadata get matched by content
+        certificate_list = self.certificate_lookup('fingerprint', cert_fingerprint_get(self.logger, certificate), ['name', 'order__name', 'order__account__name'])
+        if not certificate_list:
+            certificate_list = self.certificate_lookup('cert_raw', certificate, ['name', 'order__name', 'order__account__name'])
 
         if certificate_list:
             if account_name:
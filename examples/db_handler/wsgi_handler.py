@@ -5,12 +5,115 @@ from __future__ import print_function
 import sqlite3
 import json
 import os
-from acme.helper import datestr_to_date
+import threading
+import atexit
+from acme.helper import cert_fingerprint_get, datestr_to_date, jwk_thumbprint_get, load_config, state_cache_invalidate
+
+# connection pool - one connection per process, thread and database file
+DB_POOL = threading.local()
+
+# database files whose schema version got already checked by this process
+DB_SCHEMA_CHECKED = set()
+
+def db_account_thumbprint_fill(logger, cursor):
+    """ store the key thumbprint of existing accounts - duplicate keys keep the oldest account only """
+    logger.debug('db_account_thumbprint_fill()')
+    cursor.execute('SELECT thumbprint FROM account WHERE thumbprint IS NOT NULL')
+    thumbprint_set = set(row['thumbprint'] for row in cursor.fetchall())
+    cursor.execute('SELECT id, name, jwk FROM account WHERE thumbprint IS NULL ORDER BY id')
+    for row in cursor.fetchall():
+        try:
+            thumbprint = jwk_thumbprint_get(logger, json.loads(row['jwk']))
+        except ValueError:
+            thumbprint = None
+        if not thumbprint:
+            logger.error('db_account_thumbprint_fill(): key of account {0} cannot be parsed'.format(row['name']))
+        elif thumbprint in thumbprint_set:
+            logger.error('db_account_thumbprint_fill(): key of account {0} is used by another account'.format(row['name']))
+        else:
+            cursor.execute('UPDATE account SET thumbprint = ? WHERE id = ?', [thumbprint, row['id']])
+            thumbprint_set.add(thumbprint)
+
+def db_column_add(table, column, definition):
+    """ migration step adding a column - skipped if the column exists already """
+    def column_add(logger, cursor):
+        cursor.execute('PRAGMA table_info("{0}")'.format(table))
+        if column in [row['name'] for row in cursor.fetchall()]:
+            logger.debug('db_column_add(): {0}.{1} exists already'.format(table, column))
+        else:
+            cursor.execute('ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(table, column, definition))
+    return column_add
+
+# schema migrations; "PRAGMA user_version" stores the number of applied steps
+DB_MIGRATION_LIST = [
+    # 1: indexes on lookup columns
+    (
+        'CREATE INDEX IF NOT EXISTS "nonce_nonce_idx" ON "nonce" ("nonce")',
+        'CREATE INDEX IF NOT EXISTS "orders_account_id_idx" ON "orders" ("account_id")',
+        'CREATE INDEX IF NOT EXISTS "orders_status_id_idx" ON "orders" ("status_id")',
+        'CREATE INDEX IF NOT EXISTS "authorization_order_id_idx" ON "authorization" ("order_id")',
+        'CREATE INDEX IF NOT EXISTS "authorization_status_id_idx" ON "authorization" ("status_id")',
+        'CREATE INDEX IF NOT EXISTS "authorization_token_idx" ON "authorization" ("token")',
+        'CREATE INDEX IF NOT EXISTS "challenge_authorization_id_idx" ON "challenge" ("authorization_id")',
+        'CREATE INDEX IF NOT EXISTS "challenge_status_id_idx" ON "challenge" ("status_id")',
+        'CREATE INDEX IF NOT EXISTS "certificate_order_id_idx" ON "certificate" ("order_id")',
+        'CREATE INDEX IF NOT EXISTS "certificate_cert_raw_idx" ON "certificate" ("cert_raw")',
+    ),
+    # 2: nonce expiry
+    (
+        'CREATE INDEX IF NOT EXISTS "nonce_created_at_idx" ON "nonce" ("created_at")',
+    ),
+    # 3: issuance job queue
+    (
+        'CREATE TABLE IF NOT EXISTS "job" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "name" varchar(15) NOT NULL UNIQUE, "order_name" varchar(15) NOT NULL, "status" varchar(10) NOT NULL DEFAULT \'queued\', "attempts" integer NOT NULL DEFAULT 0, "next_run" integer NOT NULL DEFAULT 0, "lease_until" integer NOT NULL DEFAULT 0, "token" varchar(32), "error" text, "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS "job_status_next_run_idx" ON "job" ("status", "next_run")',
+        'CREATE INDEX IF NOT EXISTS "job_token_idx" ON "job" ("token")',
+    ),
+    # 4: authorization reuse
+    (
+        'CREATE INDEX IF NOT EXISTS "authorization_value_idx" ON "authorization" ("value")',
+    ),
+    # 5: certificate metadata
+    (
+        db_column_add('certificate', 'serial', 'varchar(64)'),
+        db_column_add('certificate', 'fingerprint', 'varchar(64)'),
+        db_column_add('certificate', 'not_before', 'integer'),
+        db_column_add('certificate', 'not_after', 'integer'),
+        db_column_add('certificate', 'issuer', 'text'),
+        db_column_add('certificate', 'san', 'text'),
+        'CREATE INDEX IF NOT EXISTS "certificate_serial_idx" ON "certificate" ("serial")',
+        'CREATE INDEX IF NOT EXISTS "certificate_fingerprint_idx" ON "certificate" ("fingerprint")',
+        'CREATE INDEX IF NOT EXISTS "certificate_not_after_idx" ON "certificate" ("not_after")',
+    ),
+    # 6: account key thumbprint
+    (
+        db_column_add('account', 'thumbprint', 'varchar(64)'),
+        db_account_thumbprint_fill,
+        'CREATE UNIQUE INDEX IF NOT EXISTS "account_thumbprint_idx" ON "account" ("thumbprint")',
+    ),
+    # 7: lease of background validations
+    (
+        db_column_add('challenge', 'lease_until', 'integer NOT NULL DEFAULT 0'),
+    ),
+]
 
 def dict_from_row(row):
     """ small helper to convert a select list into a dictionary """
     return dict(zip(row.keys(), row))
 
+def db_pool_close():
+    """ close all pooled connections of the current thread """
+    connection_dic = getattr(DB_POOL, 'connection_dic', {})
+    for (_pid, _db_name), dbs in list(connection_dic.items()):
+        try:
+            dbs.commit()
+            dbs.close()
+        except sqlite3.Error:
+            pass
+    DB_POOL.connection_dic = {}
+
+atexit.register(db_pool_close)
+
 class DBstore(object):
     """ helper to do datebase operations """
 
@@ -21,9 +124,18 @@ class DBstore(object):
         self.logger = logger
         self.dbs = None
         self.cursor = None
+        self.connection_pool = True
+        self.busy_timeout = 5
+        self.journal_mode = 'WAL'
+        self.cached_statements = 128
+        self.load_config()
 
         if not os.path.exists(self.db_name):
             self.db_create()
+            DB_SCHEMA_CHECKED.discard(self.db_name)
+        if self.db_name not in DB_SCHEMA_CHECKED:
+            self.db_update()
+            DB_SCHEMA_CHECKED.add(self.db_name)
 
     def account_add(self, data_dic):
         """ add account in database """
@@ -32,16 +144,20 @@ class DBstore(object):
         # we need this for compability with django
         created = False
         # check if we alredy have an entry for the key
-        exists = self.account_search('jwk', data_dic['jwk'])
+        if data_dic.get('thumbprint'):
+            exists = self.account_search('thumbprint', data_dic['thumbprint'])
+        else:
+            data_dic['thumbprint'] = None
+            exists = self.account_search('jwk', data_dic['jwk'])
         self.db_open()
         if bool(exists):
             # update
             aname = exists[1]
             self.logger.debug('account exists: {0} id: {1}'.format(aname, exists[0]))
-            self.cursor.execute('''UPDATE ACCOUNT SET alg = :alg, jwk = :jwk, contact = :contact WHERE jwk = :jwk''', data_dic)
+            self.cursor.execute('''UPDATE ACCOUNT SET alg = :alg, jwk = :jwk, thumbprint = COALESCE(:thumbprint, thumbprint), contact = :contact WHERE name = :aname''', dict(data_dic, aname=aname))
         else:
             # insert
-            self.cursor.execute('''INSERT INTO ACCOUNT(alg, jwk, contact, name) VALUES(:alg, :jwk, :contact, :name)''', data_dic)
+            self.cursor.execute('''INSERT INTO ACCOUNT(alg, jwk, thumbprint, contact, name) VALUES(:alg, :jwk, :thumbprint, :contact, :name)''', data_dic)
             aname = data_dic['name']
             created = True
 
@@ -53,7 +169,7 @@ class DBstore(object):
         """ add account in database """
         self.logger.debug('DBStore.account_delete({0})'.format(aname))
         self.db_open()
-        pre_statement = 'DELETE FROM account WHERE name LIKE ?'
+        pre_statement = 'DELETE FROM account WHERE name = ?'
         self.cursor.execute(pre_statement, [aname])
         result = bool(self.cursor.rowcount)
         self.db_close()
@@ -76,7 +192,7 @@ class DBstore(object):
         """ search account table for a certain key/value pair """
         self.logger.debug('DBStore.account_search(column:{0}, pattern:{1})'.format(column, string))
         self.db_open()
-        pre_statement = 'SELECT * from account WHERE {0} LIKE ?'.format(column)
+        pre_statement = 'SELECT * from account WHERE {0} = ?'.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchone()
         self.db_close()
@@ -95,9 +211,12 @@ class DBstore(object):
                 data_dic['contact'] = lookup['contact']
             if 'jwk' not in data_dic:
                 data_dic['jwk'] = lookup['jwk']
+                data_dic['thumbprint'] = lookup['thumbprint']
+            elif 'thumbprint' not in data_dic:
+                data_dic['thumbprint'] = None
 
             self.db_open()
-            self.cursor.execute('''UPDATE account SET alg = :alg, contact = :contact, jwk = :jwk WHERE name = :name''', data_dic)
+            self.cursor.execute('''UPDATE account SET alg = :alg, contact = :contact, jwk = :jwk, thumbprint = :thumbprint WHERE name = :name''', data_dic)
             self.cursor.execute('''SELECT id FROM account WHERE name=:name''', {'name': data_dic['name']})
             result = self.cursor.fetchone()[0]
             self.db_close()
@@ -132,6 +251,21 @@ class DBstore(object):
         self.logger.debug('DBStore.authorization_lookup() ended')
         return authz_list
 
+    def authorization_reusable_lookup(self, aname, identifier_dic, expires):
+        """ search valid authorization of an account for an identifier
+        in: account name, identifier (type/value), minimum expiry date
+        return: dictionary with name and expires of the authorization or None """
+        self.logger.debug('DBStore.authorization_reusable_lookup({0}:{1})'.format(aname, identifier_dic['value']))
+        data_dic = {'account' : aname, 'type' : identifier_dic['type'], 'value' : identifier_dic['value'], 'expires' : expires}
+        self.db_open()
+        self.cursor.execute('''SELECT authorization.name, authorization.expires from authorization INNER JOIN orders on orders.id = authorization.order_id INNER JOIN account on account.id = orders.account_id INNER JOIN status on status.id = authorization.status_id WHERE authorization.value = :value AND authorization.type = :type AND account.name = :account AND status.name = 'valid' AND authorization.expires > :expires ORDER BY authorization.expires DESC LIMIT 1''', data_dic)
+        result = self.cursor.fetchone()
+        self.db_close()
+        if result:
+            result = dict_from_row(result)
+        self.logger.debug('DBStore.authorization_reusable_lookup() ended with: {0}'.format(result))
+        return result
+
     def authorization_search(self, column, string):
         """ search account table for a certain key/value pair """
         self.logger.debug('DBStore.authorization_search(column:{0}, pattern:{1})'.format(column, string))
@@ -139,7 +273,7 @@ class DBstore(object):
             self.logger.debug('rename name to authorization.name')
             column = 'authorization.name'
         self.db_open()
-        pre_statement = 'SELECT authorization.*, orders.id as orders__id, orders.name as order__name, status.id as status_id, status.name as status__name from authorization INNER JOIN orders on orders.id = authorization.order_id INNER JOIN status on status.id = authorization.status_id WHERE {0} LIKE ?'.format(column)
+        pre_statement = 'SELECT authorization.*, orders.id as orders__id, orders.name as order__name, status.id as status_id, status.name as status__name from authorization INNER JOIN orders on orders.id = authorization.order_id INNER JOIN status on status.id = authorization.status_id WHERE {0} = ?'.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchall()
         self.db_close()
@@ -167,6 +301,7 @@ class DBstore(object):
             self.cursor.execute('''SELECT id FROM authorization WHERE name=:name''', {'name': data_dic['name']})
             result = self.cursor.fetchone()[0]
             self.db_close()
+            state_cache_invalidate(self.logger, [('authz', data_dic['name']), ('order', lookup['order__name'])])
         else:
             result = None
         self.logger.debug('DBStore.authorization_update() ended')
@@ -176,13 +311,15 @@ class DBstore(object):
         """ check issuer against certificate """
         self.logger.debug('DBStore.certificate_account_check({0})'.format(account_name))
 
-        # search certificate table to get the order-id
-        certificate_dic = self.certificate_lookup('cert_raw', certificate, ['name', 'order__name'])
+        # search certificate table to get the order-id - rows without metadata get matched by content
+        certificate_dic = self.certificate_lookup('fingerprint', cert_fingerprint_get(self.logger, certificate), ['name', 'order__name'])
+        if not certificate_dic:
+            certificate_dic = self.certificate_lookup('cert_raw', certificate, ['name', 'order__name'])
 
         result = None
 
         # search order table to get the account-name based on the order-id
-        if 'order__name' in certificate_dic:
+        if certificate_dic and 'order__name' in certificate_dic:
             order_dic = self.order_lookup('name', certificate_dic['order__name'], ['name', 'account__name'])
             if order_dic:
                 if 'account__name' in order_dic:
@@ -217,13 +354,17 @@ class DBstore(object):
             self.db_open()
             if 'error' in data_dic:
                 self.cursor.execute('''UPDATE Certificate SET error = :error WHERE name = :name''', data_dic)
+            elif 'fingerprint' in data_dic:
+                self.cursor.execute('''UPDATE Certificate SET cert = :cert, cert_raw = :cert_raw, serial = :serial, fingerprint = :fingerprint, not_before = :not_before, not_after = :not_after, issuer = :issuer, san = :san WHERE name = :name''', data_dic)
             else:
                 self.cursor.execute('''UPDATE Certificate SET cert = :cert, cert_raw = :cert_raw WHERE name = :name''', data_dic)
             self.db_close()
             rid = dict_from_row(exists)['id']
+            state_cache_invalidate(self.logger, [('order', dict_from_row(exists)['order__name'])])
         else:
             # insert
             self.logger.debug('insert new entry for {0}'.format(data_dic['name']))
+            state_cache_invalidate(self.logger, [('order', data_dic.get('order'))])
             # change order name to id but tackle cases where we cannot do this
             try:
                 data_dic['order'] = dict_from_row(self.order_search('name', data_dic['order']))['id']
@@ -242,6 +383,18 @@ class DBstore(object):
         self.logger.debug('DBStore.certificate_add() ended with: {0}'.format(rid))
         return rid
 
+    def certificate_backfill_list(self, last_id, limit):
+        """ get issued certificates without metadata
+        in: id of the last processed certificate, maximum number of rows
+        return: list of dictionaries with id, name, cert and cert_raw ordered by id """
+        self.logger.debug('DBStore.certificate_backfill_list({0}:{1})'.format(last_id, limit))
+        self.db_open()
+        self.cursor.execute('''SELECT id, name, cert, cert_raw FROM certificate WHERE id > ? AND fingerprint IS NULL AND cert_raw IS NOT NULL AND cert_raw != '' ORDER BY id LIMIT ?''', [last_id, limit])
+        result = [dict_from_row(row) for row in self.cursor.fetchall()]
+        self.db_close()
+        self.logger.debug('DBStore.certificate_backfill_list() ended with: {0}'.format(len(result)))
+        return result
+
     def certificate_lookup(self, column, string, vlist=('name', 'csr', 'cert', 'order__name')):
         """ search certificate based on "something" """
         self.logger.debug('DBstore.certificate_lookup({0}:{1})'.format(column, string))
@@ -268,7 +421,7 @@ class DBstore(object):
             column = 'certificate.{0}'.format(column)
             self.logger.debug('modified column to {0}'.format(column))
 
-        pre_statement = 'SELECT certificate.*, orders.id as order__id, orders.name as order__name from certificate INNER JOIN orders on orders.id = certificate.order_id WHERE {0} LIKE ?'.format(column)
+        pre_statement = 'SELECT certificate.*, orders.id as order__id, orders.name as order__name from certificate INNER JOIN orders on orders.id = certificate.order_id WHERE {0} = ?'.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchone()
         self.db_close()
@@ -312,6 +465,24 @@ class DBstore(object):
         self.logger.debug('DBStore.challenge_lookup() ended with:{0}'.format(result))
         return result
 
+    def challenges_lookup(self, column, string, vlist=('name', 'type', 'token', 'status__name')):
+        """ search all challenges for a certain key/value pair """
+        self.logger.debug('DBStore.challenges_lookup(column:{0}, pattern:{1})'.format(column, string))
+        if column == 'authorization__name':
+            column = 'authorization.name'
+        else:
+            column = 'challenge.{0}'.format(column)
+        self.db_open()
+        pre_statement = 'SELECT challenge.*, status.name as status__name, authorization.name as authorization__name from challenge INNER JOIN status on status.id = challenge.status_id INNER JOIN authorization on authorization.id = challenge.authorization_id WHERE {0} = ? ORDER BY challenge.id'.format(column)
+        self.cursor.execute(pre_statement, [string])
+        challenge_list = []
+        for row in self.cursor.fetchall():
+            row_dic = dict_from_row(row)
+            challenge_list.append({ele: row_dic[ele] for ele in vlist})
+        self.db_close()
+        self.logger.debug('DBStore.challenges_lookup() ended with: {0}'.format(len(challenge_list)))
+        return challenge_list
+
     def challenge_search(self, column, string):
         """ search challenge table for a certain key/value pair """
         self.logger.debug('DBStore.challenge_search(column:{0}, pattern:{1})'.format(column, string))
@@ -326,19 +497,36 @@ class DBstore(object):
                 authorization.type as authorization__type,
                 authorization.value as authorization__value,
                 authorization.token as authorization__token,
+                orders.name as authorization__order__name,
                 account.name as authorization__order__account__name
             from challenge
             INNER JOIN status on status.id = challenge.status_id
             INNER JOIN authorization on authorization.id = challenge.authorization_id
             INNER JOIN orders on orders.id = authorization.order_id
             INNER JOIN account on account.id = orders.account_id
-            WHERE challenge.{0} LIKE ?'''.format(column)
+            WHERE challenge.{0} = ?'''.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchone()
         self.db_close()
         self.logger.debug('DBStore.challenge_search() ended')
         return result
 
+    def challenge_claim(self, name, now, lease):
+        """ set challenge to processing unless it is valid or another validation holds an unexpired lease
+        in: challenge name, current time, lease in seconds
+        return: true if the challenge got claimed """
+        self.logger.debug('DBStore.challenge_claim({0})'.format(name))
+        data_dic = {'name': name, 'now': now, 'lease_until': now + lease}
+        self.db_open()
+        # single statement - concurrent requests cannot claim the same challenge
+        self.cursor.execute('''UPDATE challenge SET status_id = (SELECT id FROM status WHERE name = 'processing'), lease_until = :lease_until WHERE name = :name AND status_id != (SELECT id FROM status WHERE name = 'valid') AND (status_id != (SELECT id FROM status WHERE name = 'processing') OR lease_until < :now)''', data_dic)
+        result = self.cursor.rowcount > 0
+        self.db_close()
+        if result:
+            state_cache_invalidate(self.logger, [('authz', self.challenge_lookup('name', name, ['authorization__name'])['authorization'])])
+        self.logger.debug('DBStore.challenge_claim() ended with: {0}'.format(result))
+        return result
+
     def challenge_update(self, data_dic):
         """ update challenge """
         self.logger.debug('challenge_update({0})'.format(data_dic))
@@ -356,15 +544,27 @@ class DBstore(object):
         self.db_open()
         self.cursor.execute('''UPDATE challenge SET status_id = :status, keyauthorization = :keyauthorization WHERE name = :name''', data_dic)
         self.db_close()
+        state_cache_invalidate(self.logger, [('authz', lookup['authorization__name'])])
         self.logger.debug('DBStore.challenge_update() ended')
 
     def db_close(self):
-        """ commit and close """
+        """ commit and close (pooled connections stay open) """
         self.logger.debug('DBStore.db_close()')
         self.dbs.commit()
-        self.dbs.close()
+        if not self.connection_pool:
+            self.dbs.close()
         self.logger.debug('DBStore.db_close() ended')
 
+    def db_connect(self):
+        """ create a new database connection """
+        self.logger.debug('DBStore.db_connect()')
+        dbs = sqlite3.connect(self.db_name, timeout=self.busy_timeout, cached_statements=self.cached_statements)
+        dbs.row_factory = sqlite3.Row
+        if self.journal_mode:
+            dbs.execute('PRAGMA journal_mode={0}'.format(self.journal_mode))
+        self.logger.debug('DBStore.db_connect() ended')
+        return dbs
+
     def db_create(self):
         """ create the database if dos not exist """
         self.logger.debug('DBStore.db_create({0})'.format(self.db_name))
@@ -410,11 +610,94 @@ class DBstore(object):
     def db_open(self):
         """ opens db and sets cursor """
         self.logger.debug('DBStore.db_open()')
-        self.dbs = sqlite3.connect(self.db_name)
-        self.dbs.row_factory = sqlite3.Row
+        if self.connection_pool:
+            # connections must not be shared between forked processes
+            pool_key = (os.getpid(), self.db_name)
+            if not hasattr(DB_POOL, 'connection_dic'):
+                DB_POOL.connection_dic = {}
+            if pool_key not in DB_POOL.connection_dic:
+                DB_POOL.connection_dic[pool_key] = self.db_connect()
+            self.dbs = DB_POOL.connection_dic[pool_key]
+            # rollback leftovers of a previous operation which did not reach db_close()
+            if self.dbs.in_transaction:
+                self.logger.debug('rollback pending transaction')
+                self.dbs.rollback()
+        else:
+            self.dbs = self.db_connect()
         self.cursor = self.dbs.cursor()
         self.logger.debug('DBStore.db_open() ended')
 
+    def db_update(self):
+        """ apply outstanding schema migrations - each step and its version bump in a single transaction """
+        self.logger.debug('DBStore.db_update({0})'.format(self.db_name))
+        self.db_open()
+        self.cursor.execute('PRAGMA user_version')
+        version = self.cursor.fetchone()[0]
+        while version < len(DB_MIGRATION_LIST):
+            # the write lock serializes processes starting at the same time - re-read the version once we hold it
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                self.cursor.execute('PRAGMA user_version')
+                version = self.cursor.fetchone()[0]
+                if version < len(DB_MIGRATION_LIST):
+                    self.logger.info('apply database migration {0}'.format(version + 1))
+                    for statement in DB_MIGRATION_LIST[version]:
+                        # data migrations are functions getting logger and cursor
+                        if callable(statement):
+                            statement(self.logger, self.cursor)
+                        else:
+                            self.cursor.execute(statement)
+                    version += 1
+                    self.cursor.execute('PRAGMA user_version = {0}'.format(version))
+                self.dbs.commit()
+            except sqlite3.Error:
+                self.dbs.rollback()
+                raise
+        self.db_close()
+        self.logger.debug('DBStore.db_update() ended')
+
+    def job_add(self, data_dic):
+        """ add issuance job to database - an existing job for the certificate is kept
+        in: name, order_name, next_run
+        return: true if the job got added """
+        self.logger.debug('DBStore.job_add({0})'.format(data_dic['name']))
+        self.db_open()
+        self.cursor.execute('''INSERT OR IGNORE INTO job(name, order_name, next_run) VALUES(:name, :order_name, :next_run)''', data_dic)
+        result = self.cursor.rowcount > 0
+        self.db_close()
+        self.logger.debug('DBStore.job_add() ended with: {0}'.format(result))
+        return result
+
+    def job_claim(self, token, now, lease):
+        """ claim the next due job - queued jobs and running jobs with an expired lease
+        in: token identifying the claim, current time, lease in seconds
+        return: dictionary of the claimed job or None """
+        self.logger.debug('DBStore.job_claim({0})'.format(token))
+        data_dic = {'token': token, 'now': now, 'lease_until': now + lease}
+        self.db_open()
+        # single statement - concurrent workers cannot claim the same job
+        self.cursor.execute('''UPDATE job SET status = 'running', token = :token, lease_until = :lease_until, attempts = attempts + 1 WHERE id = (SELECT id FROM job WHERE (status = 'queued' AND next_run <= :now) OR (status = 'running' AND lease_until < :now) ORDER BY next_run LIMIT 1)''', data_dic)
+        if self.cursor.rowcount > 0:
+            self.cursor.execute('''SELECT * FROM job WHERE token = :token''', data_dic)
+            result = dict_from_row(self.cursor.fetchone())
+        else:
+            result = None
+        self.db_close()
+        self.logger.debug('DBStore.job_claim() ended with: {0}'.format(result))
+        return result
+
+    def job_update(self, data_dic):
+        """ update job - only possible for the holder of the claim
+        in: name, token, status, next_run, error
+        return: true if the job got updated """
+        self.logger.debug('DBStore.job_update({0})'.format(data_dic))
+        self.db_open()
+        self.cursor.execute('''UPDATE job SET status = :status, next_run = :next_run, error = :error, lease_until = 0 WHERE name = :name AND token = :token''', data_dic)
+        result = self.cursor.rowcount > 0
+        self.db_close()
+        self.logger.debug('DBStore.job_update() ended with: {0}'.format(result))
+        return result
+
     def jwk_load(self, aname):
         """ looad account informatino and build jwk key dictionary """
         self.logger.debug('DBStore.jwk_load({0})'.format(aname))
@@ -426,6 +709,17 @@ class DBstore(object):
         self.logger.debug('DBStore.jwk_load() ended')
         return jwk_dict
 
+    def load_config(self):
+        """" load config from file """
+        self.logger.debug('DBStore.load_config()')
+        config_dic = load_config()
+        if 'DBhandler' in config_dic:
+            self.connection_pool = config_dic.getboolean('DBhandler', 'connection_pool', fallback=True)
+            self.busy_timeout = config_dic.getfloat('DBhandler', 'busy_timeout', fallback=5)
+            self.journal_mode = config_dic.get('DBhandler', 'journal_mode', fallback='WAL')
+            self.cached_statements = config_dic.getint('DBhandler', 'cached_statements', fallback=128)
+        self.logger.debug('DBStore.load_config() ended')
+
     def nonce_add(self, nonce):
         """ check if nonce is in datbase
         in: nonce
@@ -450,6 +744,18 @@ class DBstore(object):
         self.logger.debug('DBStore.nonce_check() ended')
         return result
 
+    def nonce_consume(self, nonce, lifetime):
+        """ delete nonce from database in a single statement
+        in: nonce, lifetime
+        return: true if the nonce existed, was not older than lifetime seconds and got deleted by this call """
+        self.logger.debug('DBStore.nonce_consume({0})'.format(nonce))
+        self.db_open()
+        self.cursor.execute('''DELETE FROM nonce WHERE nonce=:nonce AND created_at >= datetime('now', :offset)''', {'nonce': nonce, 'offset': '-{0} seconds'.format(int(lifetime))})
+        result = self.cursor.rowcount > 0
+        self.db_close()
+        self.logger.debug('DBStore.nonce_consume() ended with: {0}'.format(result))
+        return result
+
     def nonce_delete(self, nonce):
         """ delete nonce from datbase
         in: nonce """
@@ -459,6 +765,32 @@ class DBstore(object):
         self.db_close()
         self.logger.debug('DBStore.nonce_delete() ended')
 
+    def nonce_spend(self, nonce):
+        """ record a consumed nonce
+        in: nonce
+        return: true if the nonce was not recorded before """
+        self.logger.debug('DBStore.nonce_spend({0})'.format(nonce))
+        self.db_open()
+        # take the write lock before the lookup - concurrent workers cannot record the same nonce twice
+        self.cursor.execute('BEGIN IMMEDIATE')
+        self.cursor.execute('''INSERT INTO nonce(nonce) SELECT :nonce WHERE NOT EXISTS (SELECT 1 FROM nonce WHERE nonce=:nonce)''', {'nonce': nonce})
+        result = self.cursor.rowcount > 0
+        self.db_close()
+        self.logger.debug('DBStore.nonce_spend() ended with: {0}'.format(result))
+        return result
+
+    def nonce_purge(self, lifetime):
+        """ delete nonces older than lifetime seconds
+        in: lifetime
+        return: number of deleted nonces """
+        self.logger.debug('DBStore.nonce_purge({0})'.format(lifetime))
+        self.db_open()
+        self.cursor.execute('''DELETE FROM nonce WHERE created_at < datetime('now', :offset)''', {'offset': '-{0} seconds'.format(int(lifetime))})
+        result = self.cursor.rowcount
+        self.db_close()
+        self.logger.debug('DBStore.nonce_purge() ended with: {0}'.format(result))
+        return result
+
     def order_add(self, data_dic):
         """ add order to database """
         self.logger.debug('DBStore.order_add({0})'.format(data_dic))
@@ -480,6 +812,40 @@ class DBstore(object):
         self.logger.debug('DBStore.order_add() ended')
         return rid
 
+    def order_add_with_authorizations(self, data_dic, authz_list):
+        """ add order and all its authorizations within a single transaction """
+        self.logger.debug('DBStore.order_add_with_authorizations({0}:{1})'.format(data_dic['name'], len(authz_list)))
+        if 'notbefore' not in data_dic:
+            data_dic['notbefore'] = ''
+
+        if 'notafter' not in data_dic:
+            data_dic['notafter'] = ''
+
+        rid = None
+        self.db_open()
+        self.cursor.execute('''SELECT id FROM account WHERE name = :account''', data_dic)
+        account = self.cursor.fetchone()
+        if account:
+            data_dic['account'] = account['id']
+            try:
+                self.cursor.execute('''INSERT INTO orders(name, identifiers, account_id, status_id, expires, notbefore, notafter) VALUES(:name, :identifiers, :account, :status, :expires, :notbefore, :notafter )''', data_dic)
+                rid = self.cursor.lastrowid
+                self.cursor.execute('''SELECT id, name FROM status''')
+                status_dic = {row['name']: row['id'] for row in self.cursor.fetchall()}
+                for authz in authz_list:
+                    authz['order'] = rid
+                    authz['status_id'] = status_dic[authz.get('status', 'pending')]
+                    if 'expires' not in authz:
+                        authz['expires'] = None
+                self.cursor.executemany('''INSERT INTO authorization(name, order_id, type, value, status_id, expires) VALUES(:name, :order, :type, :value, :status_id, :expires)''', authz_list)
+            except sqlite3.Error as err:
+                self.logger.error('DBStore.order_add_with_authorizations() failed: {0}'.format(err))
+                self.dbs.rollback()
+                rid = None
+        self.db_close()
+        self.logger.debug('DBStore.order_add_with_authorizations() ended with: {0}'.format(rid))
+        return rid
+
     def order_lookup(self, column, string, vlist=('notbefore', 'notafter', 'identifiers', 'expires', 'status__name')):
         """ search orders for a given ordername """
         self.logger.debug('order_lookup({0}:{1})'.format(column, string))
@@ -508,7 +874,7 @@ class DBstore(object):
         """ search order table for a certain key/value pair """
         self.logger.debug('DBStore.order_search(column:{0}, pattern:{1})'.format(column, string))
         self.db_open()
-        pre_statement = 'SELECT orders.*, status.name as status__name, status.id as status__id, account.name as account__name, account.id as account_id from orders INNER JOIN status on status.id = orders.status_id INNER JOIN account on account.id = orders.account_id WHERE orders.{0} LIKE ?'.format(column)
+        pre_statement = 'SELECT orders.*, status.name as status__name, status.id as status__id, account.name as account__name, account.id as account_id from orders INNER JOIN status on status.id = orders.status_id INNER JOIN account on account.id = orders.account_id WHERE orders.{0} = ?'.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchone()
         self.db_close()
@@ -523,13 +889,14 @@ class DBstore(object):
         self.db_open()
         self.cursor.execute('''UPDATE orders SET status_id = :status WHERE name = :name''', data_dic)
         self.db_close()
+        state_cache_invalidate(self.logger, [('order', data_dic['name'])])
         self.logger.debug('DBStore.order_update() ended')
 
     def status_search(self, column, string):
         """ search status table for a certain key/value pair """
         self.logger.debug('DBStore.status_search(column:{0}, pattern:{1})'.format(column, string))
         self.db_open()
-        pre_statement = 'SELECT * from status WHERE status.{0} LIKE ?'.format(column)
+        pre_statement = 'SELECT * from status WHERE status.{0} = ?'.format(column)
         self.cursor.execute(pre_statement, [string])
         result = self.cursor.fetchone()
         self.db_close()
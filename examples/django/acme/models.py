@@ -6,8 +6,8 @@ from django.db import models
 # Create your models here.
 class Nonce(models.Model):
     """ nonce table """
-    nonce = models.CharField(max_length=30)
-    created_at = models.DateTimeField(auto_now_add=True)
+    nonce = models.CharField(max_length=30, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     def __unicode__(self):
         return self.nonce
 
@@ -15,6 +15,7 @@ class Account(models.Model):
     """ account table """
     name = models.CharField(max_length=15, unique=True)
     jwk = models.TextField(blank=True)
+    thumbprint = models.CharField(max_length=64, unique=True, blank=True, null=True)
     alg = models.CharField(max_length=10)
     contact = models.CharField(max_length=256)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -63,6 +64,7 @@ class Challenge(models.Model):
     status = models.ForeignKey(Status, default=2, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     keyauthorization = models.CharField(max_length=128, blank=True)
+    lease_until = models.IntegerField(default=0)
     def __unicode__(self):
         return self.name
 
@@ -73,7 +75,29 @@ class Certificate(models.Model):
     csr = models.TextField(blank=True)
     cert = models.TextField(blank=True)
     cert_raw = models.TextField(blank=True)
+    serial = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    fingerprint = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    not_before = models.IntegerField(blank=True, null=True)
+    not_after = models.IntegerField(blank=True, null=True, db_index=True)
+    issuer = models.TextField(blank=True, null=True)
+    san = models.TextField(blank=True, null=True)
     error = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     def __unicode__(self):
         return self.name
+
+class Job(models.Model):
+    """ issuance job table """
+    name = models.CharField(max_length=15, unique=True)
+    order_name = models.CharField(max_length=15)
+    status = models.CharField(max_length=10, default='queued')
+    attempts = models.IntegerField(default=0)
+    next_run = models.IntegerField(default=0)
+    lease_until = models.IntegerField(default=0)
+    token = models.CharField(max_length=32, blank=True, db_index=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_run'])]
+    def __unicode__(self):
+        return self.name
@@ -8,9 +8,9 @@ from acme.authorization import Authorization
 from acme.account import Account
 from acme.certificate import Certificate
 from acme.challenge import Challenge
+from acme.context import Context
 from acme.directory import Directory
 from acme.helper import get_url, load_config, logger_setup, logger_info
-from acme.nonce import Nonce
 from acme.order import Order
 
 # load config to set debug mode
@@ -20,6 +20,9 @@ DEBUG = CONFIG.getboolean('DEFAULT', 'debug', fallback=False)
 # initialize logger
 LOGGER = logger_setup(DEBUG)
 
+# application context shared by all requests
+CONTEXT = Context(DEBUG, LOGGER)
+
 def handle_exception(exc_type, exc_value, exc_traceback):
     """ exception handler """
     print('My Error Information')
@@ -60,7 +63,7 @@ def directory(request):
 def newaccount(request):
     """ new account """
     if request.method == 'POST':
-        with Account(DEBUG, get_url(request.META), LOGGER) as account:
+        with Account(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as account:
             response_dic = account.new(request.body)
             # create the response
             response = JsonResponse(status=response_dic['code'], data=response_dic['data'])
@@ -79,7 +82,7 @@ def newaccount(request):
 def newnonce(request):
     """ new nonce """
     if request.method == 'HEAD':
-        with Nonce(DEBUG, LOGGER) as nonce:
+        with CONTEXT.nonce_get() as nonce:
             response = HttpResponse('')
             # generate nonce
             response['Replay-Nonce'] = nonce.generate_and_add()
@@ -98,7 +101,7 @@ def servername_get(request):
 
 def acct(request):
     """ xxxx command """
-    with Account(DEBUG, get_url(request.META), LOGGER) as account:
+    with Account(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as account:
         response_dic = account.parse(request.body)
         # create the response
         response = JsonResponse(status=response_dic['code'], data=response_dic['data'])
@@ -115,7 +118,7 @@ def acct(request):
 def neworders(request):
     """ new account """
     if request.method == 'POST':
-        with Order(DEBUG, get_url(request.META), LOGGER) as norder:
+        with Order(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as norder:
             response_dic = norder.new(request.body)
             # create the response
             response = JsonResponse(status=response_dic['code'], data=response_dic['data'])
@@ -137,7 +140,7 @@ def neworders(request):
 def authz(request):
     """ new-authz command """
     if request.method == 'POST' or request.method == 'GET':
-        with Authorization(DEBUG, get_url(request.META), LOGGER) as authorization:
+        with Authorization(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as authorization:
             if request.method == 'POST':
                 response_dic = authorization.new_post(request.body)
             else:
@@ -158,7 +161,7 @@ def authz(request):
 
 def chall(request):
     """ challenge command """
-    with Challenge(DEBUG, get_url(request.META), LOGGER) as challenge:
+    with Challenge(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as challenge:
         if request.method == 'POST':
             response_dic = challenge.parse(request.body)
             # create the response
@@ -186,7 +189,7 @@ def chall(request):
 def order(request):
     """ order request """
     if request.method == 'POST':
-        with Order(DEBUG, get_url(request.META), LOGGER) as eorder:
+        with Order(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as eorder:
             response_dic = eorder.parse(request.body)
             # create the response
             response = JsonResponse(status=response_dic['code'], data=response_dic['data'])
@@ -204,7 +207,7 @@ def order(request):
 def cert(request):
     """ cert request """
     if request.method == 'POST' or request.method == 'GET':
-        with Certificate(DEBUG, get_url(request.META), LOGGER) as certificate:
+        with Certificate(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as certificate:
             if request.method == 'POST':
                 response_dic = certificate.new_post(request.body)
             else:
@@ -230,7 +233,7 @@ def cert(request):
 def revokecert(request):
     """ cert revocation """
     if request.method == 'POST':
-        with Certificate(DEBUG, get_url(request.META), LOGGER) as certificate:
+        with Certificate(DEBUG, get_url(request.META), LOGGER, context=CONTEXT) as certificate:
             response_dic = certificate.revoke(request.body)
             # create the response
             if 'data' in response_dic:
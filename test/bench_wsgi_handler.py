@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" lookup benchmark for the sqlite based DBstore
+
+usage: python bench_wsgi_handler.py [rows] [rows] ...
+
+fills nonce, orders, authorization and certificate tables with the given
+number of rows and measures the average duration of the lookups done on
+the request path. With indexes in place the numbers must stay flat while
+the tables grow. """
+from __future__ import print_function
+import logging
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, '..')
+from examples.db_handler.wsgi_handler import DBstore # pylint: disable=C0413
+
+def table_fill(dbstore, start, end):
+    """ add rows start..end-1 to nonce, orders, authorization and certificate table """
+    dbstore.db_open()
+    dbstore.cursor.executemany('''INSERT INTO nonce(nonce) VALUES(?)''', (('nonce{0}'.format(idx),) for idx in range(start, end)))
+    dbstore.cursor.executemany('''INSERT INTO orders(id, name, identifiers, account_id, status_id, expires) VALUES(?, ?, '[]', 1, 2, 0)''', ((idx + 1, 'order{0}'.format(idx)) for idx in range(start, end)))
+    dbstore.cursor.executemany('''INSERT INTO authorization(name, order_id, type, value) VALUES(?, ?, 'dns', 'example.com')''', (('authz{0}'.format(idx), idx + 1) for idx in range(start, end)))
+    dbstore.cursor.executemany('''INSERT INTO certificate(name, cert_raw, order_id, csr) VALUES(?, ?, ?, '')''', (('cert{0}'.format(idx), 'certraw{0}'.format(idx) * 20, idx + 1) for idx in range(start, end)))
+    dbstore.db_close()
+
+def lookup_measure(dbstore, rows, loops=500):
+    """ measure average lookup duration in microseconds """
+    lookup_dic = {
+        'nonce_check': lambda idx: dbstore.nonce_check('nonce{0}'.format(idx)),
+        'order_lookup': lambda idx: dbstore.order_lookup('name', 'order{0}'.format(idx)),
+        'authorization_lookup(order__name)': lambda idx: dbstore.authorization_lookup('order__name', 'order{0}'.format(idx), ['name']),
+        'certificate_lookup(cert_raw)': lambda idx: dbstore.certificate_lookup('cert_raw', 'certraw{0}'.format(idx) * 20, ['name', 'order__name']),
+    }
+    result_dic = {}
+    for name, function in lookup_dic.items():
+        start = time.time()
+        for loop in range(loops):
+            function((loop * 7919) % rows)
+        result_dic[name] = (time.time() - start) / loops * 1000000
+    return result_dic
+
+if __name__ == '__main__':
+
+    ROW_LIST = [int(rows) for rows in sys.argv[1:]] or [1000, 10000, 100000, 1000000]
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    LOGGER = logging.getLogger('bench_wsgi_handler')
+
+    DB_NAME = os.path.join(tempfile.mkdtemp(), 'acme_bench.db')
+    DBSTORE = DBstore(False, LOGGER, DB_NAME)
+    DBSTORE.db_open()
+    DBSTORE.cursor.execute('''INSERT INTO account(name, alg, jwk, contact) VALUES('account', 'alg', 'jwk', 'contact')''')
+    DBSTORE.db_close()
+
+    FILLED = 0
+    for ROWS in sorted(ROW_LIST):
+        table_fill(DBSTORE, FILLED, ROWS)
+        FILLED = ROWS
+        for NAME, DURATION in sorted(lookup_measure(DBSTORE, ROWS).items()):
+            print('{0:>9} rows {1:<35} {2:>8.1f} us'.format(ROWS, NAME, DURATION))
+
+    for SUFFIX in ('', '-wal', '-shm'):
+        if os.path.exists(DB_NAME + SUFFIX):
+            os.remove(DB_NAME + SUFFIX)
@@ -2,8 +2,14 @@
 # -*- coding: utf-8 -*-
 """ unittests for acme2certifier """
 import unittest
+import configparser
 import datetime
+from collections import OrderedDict
+import os
+import shutil
 import sys
+import tempfile
+import threading
 try:
     from mock import patch, MagicMock
 except ImportError:
@@ -30,13 +36,15 @@ class TestACMEHandler(unittest.TestCase):
         from acme.authorization import Authorization
         from acme.certificate import Certificate
         from acme.challenge import Challenge
+        from acme.context import Context
         from acme.directory import Directory
         from acme.error import Error
-        from acme.nonce import Nonce
+        from acme.job import Job
+        from acme.nonce import Nonce, NonceStoreFile, NonceStoreHmac, NonceStoreMemory
         from acme.message import Message
-        from acme.order import Order
+        from acme.order import Order, FINALIZE_DIC
         from acme.signature import Signature
-        from acme.helper import b64decode_pad, b64_decode, b64_url_recode, decode_message, decode_deserialize, generate_random_string, signature_check, validate_email, uts_to_date_utc, date_to_uts_utc, load_config, cert_serial_get, cert_san_get, build_pem_file, date_to_datestr, datestr_to_date, dkeys_lower
+        from acme.helper import b64decode_pad, b64_decode, b64_url_recode, decode_message, decode_deserialize, jws_decode, generate_random_string, signature_check, JWK_CACHE_DIC, STATE_CACHE_DIC, DNS_RESOLVER_DIC, dns_resolver_get, txt_get, b64_url_encode, http_session_get, url_get, state_cache_get, state_cache_invalidate, state_cache_set, validate_email, uts_to_date_utc, date_to_uts_utc, load_config, cert_serial_get, cert_san_get, build_pem_file, date_to_datestr, datestr_to_date, dkeys_lower
         import logging
         logging.basicConfig(
             # format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -51,14 +59,39 @@ class TestACMEHandler(unittest.TestCase):
         self.certificate = Certificate(False, 'http://tester.local', self.logger)
         self.message = Message(False, 'http://tester.local', self.logger)
         self.nonce = Nonce(False, self.logger)
+        self.nonce_store_memory = NonceStoreMemory(False, self.logger, 3600)
+        self.nonce_store_hmac = NonceStoreHmac(False, self.logger, 3600, 'secret', 1)
+        # database refusing nonces recorded before
+        self.nonce_store_hmac.dbstore = MagicMock()
+        self.nonce_spent_list = []
+        self.nonce_store_hmac.dbstore.nonce_spend.side_effect = lambda nonce: nonce not in self.nonce_spent_list and not self.nonce_spent_list.append(nonce)
+        self.nonce_dir = tempfile.mkdtemp()
+        self.nonce_store_file = NonceStoreFile(False, self.logger, 3600, self.nonce_dir)
         self.error = Error(False, self.logger)
+        self.job = Job(False, 'http://tester.local', self.logger)
         self.order = Order(False, 'http://tester.local', self.logger)
         self.signature = Signature(False, 'http://tester.local', self.logger)
+        self.certificate_cls = Certificate
+        self.context_cls = Context
+        self.order_cls = Order
+        self.finalize_dic = FINALIZE_DIC
         self.b64decode_pad = b64decode_pad
         self.validate_email = validate_email
         self.signature_check = signature_check
+        self.jwk_cache_dic = JWK_CACHE_DIC
+        self.state_cache_dic = STATE_CACHE_DIC
+        self.http_session_get = http_session_get
+        self.url_get = url_get
+        self.dns_resolver_dic = DNS_RESOLVER_DIC
+        self.dns_resolver_get = dns_resolver_get
+        self.txt_get = txt_get
+        self.b64_url_encode = b64_url_encode
+        self.state_cache_get = state_cache_get
+        self.state_cache_invalidate = state_cache_invalidate
+        self.state_cache_set = state_cache_set
         self.decode_deserialize = decode_deserialize
         self.decode_message = decode_message
+        self.jws_decode = jws_decode
         self.uts_to_date_utc = uts_to_date_utc
         self.date_to_uts_utc = date_to_uts_utc
         self.generate_random_string = generate_random_string
@@ -72,6 +105,10 @@ class TestACMEHandler(unittest.TestCase):
         self.datestr_to_date = datestr_to_date
         self.dkeys_lower = dkeys_lower
 
+    def tearDown(self):
+        """ remove nonce files """
+        shutil.rmtree(self.nonce_dir, ignore_errors=True)
+
     def test_001_servername_new(self):
         """ test Directory.get_server_name() method """
         self.assertEqual('http://tester.local', self.directory.servername_get())
@@ -440,7 +477,7 @@ class TestACMEHandler(unittest.TestCase):
         protected = {'url' : 'url', 'jwk': 'jwk'}
         self.assertEqual(('result', 'error', None), self.signature.check(None, 1, True, protected))
 
-    @patch('acme.message.decode_message')
+    @patch('acme.message.jws_decode')
     def test_063_message_check(self, mock_decode):
         """ message_check failed bcs of decoding error """
         message = '{"foo" : "bar"}'
@@ -448,7 +485,7 @@ class TestACMEHandler(unittest.TestCase):
         self.assertEqual((400, 'urn:ietf:params:acme:error:malformed', 'detail', None, None, None), self.message.check(message))
 
     @patch('acme.nonce.Nonce.check')
-    @patch('acme.message.decode_message')
+    @patch('acme.message.jws_decode')
     def test_064_message_check(self, mock_decode, mock_nonce_check):
         """ message_check nonce check failed """
         message = '{"foo" : "bar"}'
@@ -457,7 +494,7 @@ class TestACMEHandler(unittest.TestCase):
         self.assertEqual((400, 'badnonce', None, 'protected', 'payload', None), self.message.check(message))
 
     @patch('acme.nonce.Nonce.check')
-    @patch('acme.message.decode_message')
+    @patch('acme.message.jws_decode')
     def test_065_message_check(self, mock_decode, mock_nonce_check):
         """ message check failed bcs account id lookup failed """
         mock_decode.return_value = (True, None, 'protected', 'payload', 'signature')
@@ -468,7 +505,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.signature.Signature.check')
     @patch('acme.message.Message.name_get')
     @patch('acme.nonce.Nonce.check')
-    @patch('acme.message.decode_message')
+    @patch('acme.message.jws_decode')
     def test_066_message_check(self, mock_decode, mock_nonce_check, mock_aname, mock_sig):
         """ message check failed bcs signature_check_failed """
         mock_decode.return_value = (True, None, 'protected', 'payload', 'signature')
@@ -481,7 +518,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.signature.Signature.check')
     @patch('acme.message.Message.name_get')
     @patch('acme.nonce.Nonce.check')
-    @patch('acme.message.decode_message')
+    @patch('acme.message.jws_decode')
     def test_067_message_check(self, mock_decode, mock_nonce_check, mock_aname, mock_sig):
         """ message check successful """
         mock_decode.return_value = (True, None, 'protected', 'payload', 'signature')
@@ -618,8 +655,7 @@ class TestACMEHandler(unittest.TestCase):
         """ test Oder.add() with single identifier in payload dbstore-add returns something real"""
         mock_name.return_value = 'aaaaa'
         mock_uts.return_value = 1543640400
-        self.order.dbstore.order_add.return_value = 1
-        self.order.dbstore.authorization_add.return_value = True
+        self.order.dbstore.order_add_with_authorizations.return_value = 1
         message = {'identifiers' : [{"type": "dns", "value": "example.com"}]}
         e_result = (None, 'aaaaa', {'aaaaa': {'type': 'dns', 'value': 'example.com'}}, '2018-12-02T05:00:00Z')
         self.assertEqual(e_result, self.order.add(message, 1))
@@ -630,8 +666,7 @@ class TestACMEHandler(unittest.TestCase):
         """ test Oder.add() with multiple identifier in payload dbstore-add returns something real"""
         mock_name.side_effect = ['order', 'identifier1', 'identifier2']
         mock_uts.return_value = 1543640400
-        self.order.dbstore.order_add.return_value = 1
-        self.order.dbstore.authorization_add.return_value = True
+        self.order.dbstore.order_add_with_authorizations.return_value = 1
         message = {'identifiers' : [{"type": "dns", "value": "example1.com"}, {"type": "dns", "value": "example2.com"}]}
         e_result = (None, 'order', {'identifier1': {'type': 'dns', 'value': 'example1.com'}, 'identifier2': {'type': 'dns', 'value': 'example2.com'}}, '2018-12-02T05:00:00Z')
         self.assertEqual(e_result, self.order.add(message, 1))
@@ -959,7 +994,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.order.Order.info')
     def test_132_process_csr(self, mock_oinfo, mock_certname):
         """ test order prcoess_csr with failed csr dbsave"""
-        mock_oinfo.return_value = {'foo', 'bar'}
+        mock_oinfo.return_value = {'status' : 'ready'}
         mock_certname.return_value = None
         self.assertEqual((500, 'urn:ietf:params:acme:error:serverInternal', 'CSR processing failed'), self.order.process_csr('order_name', 'csr'))
 
@@ -968,7 +1003,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.order.Order.info')
     def test_133_process_csr(self, mock_oinfo, mock_certname, mock_enroll):
         """ test order prcoess_csr with failed cert enrollment"""
-        mock_oinfo.return_value = {'foo', 'bar'}
+        mock_oinfo.return_value = {'status' : 'ready'}
         mock_certname.return_value = 'foo'
         mock_enroll.return_value = (None, 'error', 'detail')
         self.assertEqual((500, 'error', 'detail'), self.order.process_csr('order_name', 'csr'))
@@ -978,7 +1013,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.order.Order.info')
     def test_134_process_csr(self, mock_oinfo, mock_certname, mock_enroll):
         """ test order prcoess_csr with successful cert enrollment"""
-        mock_oinfo.return_value = {'foo', 'bar'}
+        mock_oinfo.return_value = {'status' : 'ready'}
         mock_certname.return_value = 'foo'
         mock_enroll.return_value = ('bar', None, None)
         self.assertEqual((200, 'foo', None), self.order.process_csr('order_name', 'csr'))
@@ -1366,6 +1401,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_182_authorization_check(self, mock_san):
         """ test Certificate.authorization_check  with some sans and order lookup returning identifiers without json structure) """
         self.account.dbstore.order_lookup.return_value = {'identifiers' : 'test'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:san1.example.com', 'DNS:san2.example.com']
         self.assertFalse(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1373,6 +1409,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_183_authorization_check(self, mock_san):
         """ test Certificate.authorization_check  with wrong sans) """
         self.account.dbstore.order_lookup.return_value = {'identifiers' : 'test'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['san1.example.com', 'san2.example.com']
         self.assertFalse(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1380,6 +1417,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_184_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with SAN entry which is not in the identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "dns", "value": "san1.example.com"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:san1.example.com', 'DNS:san2.example.com']
         self.assertFalse(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1387,6 +1425,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_185_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with single SAN entry and correct entry in identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "dns", "value": "san1.example.com"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:san1.example.com']
         self.assertTrue(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1394,6 +1433,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_186_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with multiple SAN entries and correct entries in identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "dns", "value": "san1.example.com"}, {"type": "dns", "value": "san2.example.com"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:san1.example.com', 'DNS:san2.example.com']
         self.assertTrue(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1401,6 +1441,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_187_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with one SAN entry and multiple entries in identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "dns", "value": "san1.example.com"}, {"type": "dns", "value": "san2.example.com"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:san1.example.com']
         self.assertTrue(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1408,6 +1449,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_188_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with uppercase SAN entries and lowercase entries in identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "dns", "value": "san1.example.com"}, {"type": "dns", "value": "san2.example.com"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['DNS:SAN1.EXAMPLE.COM', 'DNS:SAN2.EXAMPLE.COM']
         self.assertTrue(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1415,6 +1457,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_189_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with lowercase SAN entries and uppercase entries in identifier list"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"TYPE": "DNS", "VALUE": "SAN1.EXAMPLE.COM"}, {"TYPE": "DNS", "VALUE": "SAN2.EXAMPLE.COM"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['dns:san1.example.com', 'dns:san2.example.com']
         self.assertTrue(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1422,6 +1465,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_190_authorization_check(self, mock_san):
         """ test Certificate.authorization_check with lSAN entries (return none) and entries in identifier containing None"""
         self.account.dbstore.order_lookup.return_value = {'identifiers' : '[{"type": "None", "value": "None"}]'}
+        self.certificate.dbstore.certificate_lookup.return_value = None
         mock_san.return_value = ['san1.example.com']
         self.assertFalse(self.certificate.authorization_check('order_name', 'cert'))
 
@@ -1606,7 +1650,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.challenge.txt_get')
     def test_219_validate_dns_challenge(self, mock_dns, mock_code, mock_hash):
         """ test Chalölenge.validate_dns_challenge() with incorrect response """
-        mock_dns.return_value = 'foo'
+        mock_dns.return_value = ['foo']
         mock_code.return_value = 'bar'
         mock_hash.return_value = 'hash'
         self.assertFalse(self.challenge.validate_dns_challenge('fqdn', 'token', 'jwk_thumbprint'))
@@ -1616,7 +1660,7 @@ class TestACMEHandler(unittest.TestCase):
     @patch('acme.challenge.txt_get')
     def test_220_validate_dns_challenge(self, mock_dns, mock_code, mock_hash):
         """ test Chalölenge.validate_dns_challenge() with correct response """
-        mock_dns.return_value = 'foo'
+        mock_dns.return_value = ['foo']
         mock_code.return_value = 'foo'
         mock_hash.return_value = 'hash'
         self.assertTrue(self.challenge.validate_dns_challenge('fqdn', 'token', 'jwk_thumbprint'))
@@ -1638,75 +1682,68 @@ class TestACMEHandler(unittest.TestCase):
         self.assertFalse(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_http_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_224_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with failed http challenge """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'http-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         mock_chall.return_value = False
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertFalse(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_http_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_225_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with succ http challenge """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'http-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         mock_chall.return_value = True
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertTrue(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_dns_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_226_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with failed dns challenge """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'dns-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         mock_chall.return_value = False
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertFalse(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_dns_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_227_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with succ http challenge """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'dns-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         mock_chall.return_value = True
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertTrue(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_tkauth_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_228_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with failed tkauth challenge """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'tkauth-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         mock_chall.return_value = False
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertFalse(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_tkauth_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_229_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with succ tkauth challenge and tnauthlist_support unset """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'tkauth-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         self.challenge.tnauthlist_support = False
         mock_chall.return_value = True
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertFalse(self.challenge.check('name', 'payload'))
 
     @patch('acme.challenge.Challenge.validate_tkauth_challenge')
-    @patch('acme.challenge.jwk_thumbprint_get')
+    @patch('acme.challenge.jwk_cache_get')
     def test_230_challenge_check(self, mock_jwk, mock_chall):
         """ challenge check with with succ tkauth challenge and tnauthlist support set """
         self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'tkauth-01', 'token' : 'token', 'authorization__order__account__name' : 'authorization__order__account__name'}
-        self.challenge.dbstore.jwk_load.return_value = 'pub_key'
         self.challenge.tnauthlist_support = True
         mock_chall.return_value = True
-        mock_jwk.return_value = 'jwk_thumbprint'
+        mock_jwk.return_value = ('pub_key', 'jwk_thumbprint')
         self.assertTrue(self.challenge.check('name', 'payload'))
 
     def test_231_order_identifier_check(self):
@@ -2115,5 +2152,1164 @@ class TestACMEHandler(unittest.TestCase):
         self.account.dbstore.account_update.return_value = True
         self.assertEqual((200, None, None), self.account.key_change('aname', {}, protected))
 
+    @patch('acme.order.uts_now')
+    @patch('acme.order.generate_random_string')
+    def test_292_order_add(self, mock_name, mock_uts):
+        """ test Oder.add() with multiple identifier in payload dbstore-add returns None """
+        mock_name.side_effect = ['order', 'identifier1', 'identifier2']
+        mock_uts.return_value = 1543640400
+        self.order.dbstore.order_add_with_authorizations.return_value = None
+        message = {'identifiers' : [{"type": "dns", "value": "example1.com"}, {"type": "dns", "value": "example2.com"}]}
+        e_result = ('urn:ietf:params:acme:error:malformed', 'order', {}, '2018-12-02T05:00:00Z')
+        self.assertEqual(e_result, self.order.add(message, 1))
+
+    @patch('acme.order.uts_now')
+    @patch('acme.order.generate_random_string')
+    def test_293_order_add(self, mock_name, mock_uts):
+        """ test Oder.add() order and authorizations are stored with a single dbstore call """
+        mock_name.side_effect = ['order', 'identifier1', 'identifier2']
+        mock_uts.return_value = 1543640400
+        self.order.dbstore.reset_mock()
+        self.order.dbstore.order_add_with_authorizations.return_value = 1
+        message = {'identifiers' : [{"type": "dns", "value": "example1.com"}, {"type": "dns", "value": "example2.com"}]}
+        self.order.add(message, 1)
+        self.assertEqual(1, self.order.dbstore.order_add_with_authorizations.call_count)
+        self.assertFalse(self.order.dbstore.authorization_add.called)
+
+    def test_294_nonce_store_memory(self):
+        """ NonceStoreMemory.check_and_delete() succeeds only once """
+        self.nonce_store_memory.add('nonce294')
+        self.assertTrue(self.nonce_store_memory.check_and_delete('nonce294'))
+        self.assertFalse(self.nonce_store_memory.check_and_delete('nonce294'))
+
+    @patch('acme.nonce.uts_now')
+    def test_295_nonce_store_memory(self, mock_uts):
+        """ NonceStoreMemory.check_and_delete() for an expired nonce """
+        mock_uts.side_effect = [1000, 5000]
+        self.nonce_store_memory.add('nonce295')
+        self.assertFalse(self.nonce_store_memory.check_and_delete('nonce295'))
+
+    @patch('acme.nonce.uts_now')
+    def test_296_nonce_store_memory(self, mock_uts):
+        """ NonceStoreMemory.expire() removes expired nonces only """
+        mock_uts.return_value = 1000
+        self.nonce_store_memory.expire()
+        self.nonce_store_memory.add('nonce296a')
+        mock_uts.return_value = 3000
+        self.nonce_store_memory.add('nonce296b')
+        mock_uts.return_value = 5000
+        self.assertEqual(1, self.nonce_store_memory.expire())
+        self.assertTrue(self.nonce_store_memory.check_and_delete('nonce296b'))
+
+    def test_297_nonce_store_file(self):
+        """ NonceStoreFile.check_and_delete() succeeds only once """
+        self.nonce_store_file.add('0123456789abcdef0123456789abcdef')
+        self.assertTrue(self.nonce_store_file.check_and_delete('0123456789abcdef0123456789abcdef'))
+        self.assertFalse(self.nonce_store_file.check_and_delete('0123456789abcdef0123456789abcdef'))
+
+    def test_298_nonce_store_file(self):
+        """ NonceStoreFile.check_and_delete() refuses nonces which are not usable as filename """
+        self.assertFalse(self.nonce_store_file.check_and_delete('../../../../etc/passwd'))
+
+    def test_299_nonce_store_file(self):
+        """ NonceStoreFile.expire() removes expired nonces only """
+        self.nonce_store_file.add('0123456789abcdef0123456789abcde1')
+        self.nonce_store_file.add('0123456789abcdef0123456789abcde2')
+        os.utime(self.nonce_store_file.file_name_get('0123456789abcdef0123456789abcde1'), (1000, 1000))
+        self.assertEqual(1, self.nonce_store_file.expire())
+        self.assertTrue(self.nonce_store_file.check_and_delete('0123456789abcdef0123456789abcde2'))
+
+    def test_300_nonce_store_get(self):
+        """ Nonce.store_get() for the different backends """
+        self.nonce.backend = 'memory'
+        self.assertEqual('NonceStoreMemory', type(self.nonce.store_get()).__name__)
+        self.nonce.backend = 'file'
+        self.assertEqual('NonceStoreFile', type(self.nonce.store_get()).__name__)
+        self.nonce.backend = 'unknown'
+        self.assertEqual('NonceStoreDb', type(self.nonce.store_get()).__name__)
+
+    @patch.dict('acme.nonce.EXPIRE_DIC', {'last': 0})
+    @patch('acme.nonce.uts_now')
+    def test_301_nonce_expire(self, mock_uts):
+        """ Nonce.expire() runs once per purge_interval """
+        self.nonce.store = MagicMock()
+        mock_uts.return_value = 100000
+        self.nonce.expire()
+        self.nonce.expire()
+        mock_uts.return_value = 100060
+        self.nonce.expire()
+        self.assertEqual(2, self.nonce.store.expire.call_count)
+
+    def test_302_nonce_check_and_delete(self):
+        """ Nonce.check_and_delete() database backend - nonce consumed by another worker """
+        self.nonce.store.dbstore.nonce_consume.return_value = False
+        self.assertEqual((400, 'urn:ietf:params:acme:error:badNonce', 'aaa'), self.nonce.check_and_delete('aaa'))
+        self.nonce.store.dbstore.nonce_consume.assert_called_with('aaa', 3600)
+        self.nonce.store.dbstore.nonce_consume.return_value = True
+
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_303_signature_jwk_load(self):
+        """ Signature.jwk_load() parses the key once and serves further requests from cache """
+        self.signature.dbstore.reset_mock()
+        self.signature.jwk_cache_lifetime = 60
+        self.signature.dbstore.jwk_load.return_value = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        pub_key = self.signature.jwk_load('acc303')
+        self.assertIs(pub_key, self.signature.jwk_load('acc303'))
+        self.assertEqual(1, self.signature.dbstore.jwk_load.call_count)
+        message = '{"protected": "eyJub25jZSI6ICI3N2M3MmViMDE5NDc0YzBjOWIzODk5MmU4ZjRkMDIzYSIsICJ1cmwiOiAiaHR0cDovL2xhcHRvcC5uY2xtLXNhbWJhLmxvY2FsL2FjbWUvYWNjdC8xIiwgImFsZyI6ICJSUzI1NiIsICJraWQiOiAiaHR0cDovL2xhcHRvcC5uY2xtLXNhbWJhLmxvY2FsL2FjbWUvYWNjdC8xIn0","payload": "eyJzdGF0dXMiOiJkZWFjdGl2YXRlZCJ9","signature": "QYbMYZ1Dk8dHKqOwWBQHvWdnGD7donGZObb2Ry_Y5PsHpcTrj8Y2CM57SNVAR9V0ePg4vhK3-IbwYAKbhZV8jF7E-ylZaYm4PSQcumKLI55qvDiEvDiZ0gmjf_GAcsC40TwBa11lzR1u0dQYxOlQ_y9ak6705c5bM_V4_ttQeslJXCfVIQoV-sZS0Z6tJfy5dPVDR7JYG77bZbD3K-HCCaVbT7ilqcf00rA16lvw13zZnIgbcZsbW-eJ2BM_QxE24PGqc_vMfAxIiUG0VY7DqrKumLs91lHHTEie8I-CapH6AetsBhGtRcB6EL_Rn6qGQZK9YBpvoXANv_qF2-zQkQ"}'
+        self.assertEqual((True, None), self.signature_check(self.logger, message, pub_key))
+
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict(), 'size': 2})
+    def test_304_signature_jwk_load(self):
+        """ Signature.jwk_load() evicts least recently used keys """
+        self.signature.dbstore.reset_mock()
+        self.signature.jwk_cache_lifetime = 60
+        self.signature.dbstore.jwk_load.return_value = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        self.signature.jwk_load('acc1')
+        self.signature.jwk_load('acc2')
+        self.signature.jwk_load('acc1')
+        self.signature.jwk_load('acc3')
+        self.assertEqual(['acc1', 'acc3'], list(self.jwk_cache_dic['keys']))
+        self.signature.jwk_load('acc2')
+        self.assertEqual(4, self.signature.dbstore.jwk_load.call_count)
+
+    @patch('acme.helper.uts_now')
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_305_signature_jwk_load(self, mock_uts):
+        """ Signature.jwk_load() reloads expired keys from database """
+        self.signature.dbstore.reset_mock()
+        self.signature.jwk_cache_lifetime = 60
+        self.signature.dbstore.jwk_load.return_value = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        mock_uts.return_value = 1000
+        self.signature.jwk_load('acc305')
+        mock_uts.return_value = 1060
+        self.signature.jwk_load('acc305')
+        self.assertEqual(1, self.signature.dbstore.jwk_load.call_count)
+        mock_uts.return_value = 1061
+        self.signature.jwk_load('acc305')
+        self.assertEqual(2, self.signature.dbstore.jwk_load.call_count)
+
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_306_signature_jwk_load(self):
+        """ Signature.jwk_load() unparsable keys do not get cached """
+        self.signature.dbstore.reset_mock()
+        self.signature.dbstore.jwk_load.return_value = {'foo' : 'bar'}
+        self.assertEqual({'foo' : 'bar'}, self.signature.jwk_load('acc306'))
+        self.assertFalse(self.jwk_cache_dic['keys'])
+
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_307_account_delete(self):
+        """ Account.delete() removes account key from cache """
+        self.jwk_cache_dic['keys']['acc307'] = ('pub_key', 'thumbprint', 9999999999)
+        self.account.dbstore.account_delete.return_value = True
+        self.account.delete('acc307')
+        self.assertNotIn('acc307', self.jwk_cache_dic['keys'])
+
+    @patch('acme.account.Account.key_change_validate')
+    @patch('acme.message.Message.check')
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_308_account_key_change(self, mock_mcheck, mock_kcv):
+        """ Account.key_change() removes old account key from cache """
+        self.jwk_cache_dic['keys']['acc308'] = ('pub_key', 'thumbprint', 9999999999)
+        mock_mcheck.return_value = (200, None, None, {'jwk': 'new_jwk'}, 'inner_payload', None)
+        mock_kcv.return_value = (200, None, None)
+        self.account.dbstore.account_update.return_value = True
+        self.assertEqual((200, None, None), self.account.key_change('acc308', 'payload', {'url': 'key-change'}))
+        self.assertNotIn('acc308', self.jwk_cache_dic['keys'])
+
+    @patch('acme.challenge.Challenge.validate_http_challenge')
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_309_challenge_check(self, mock_chall):
+        """ Challenge.check() uses thumbprint of the cached account key """
+        self.challenge.dbstore.reset_mock()
+        self.challenge.jwk_cache_lifetime = 60
+        self.challenge.dbstore.challenge_lookup.return_value = {'authorization__value' : 'authorization__value', 'type' : 'http-01', 'token' : 'token', 'authorization__order__account__name' : 'acc309'}
+        self.challenge.dbstore.jwk_load.return_value = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        mock_chall.return_value = True
+        self.assertTrue(self.challenge.check('name', 'payload'))
+        self.assertTrue(self.challenge.check('name', 'payload'))
+        self.assertEqual(1, self.challenge.dbstore.jwk_load.call_count)
+        self.assertEqual(mock_chall.call_args[0][2], self.jwk_cache_dic['keys']['acc309'][1])
+
+    def test_310_jws_decode(self):
+        """ jws_decode() returns a token which can be verified without deserializing the message again """
+        mkey = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        message = '{"protected": "eyJub25jZSI6ICI3N2M3MmViMDE5NDc0YzBjOWIzODk5MmU4ZjRkMDIzYSIsICJ1cmwiOiAiaHR0cDovL2xhcHRvcC5uY2xtLXNhbWJhLmxvY2FsL2FjbWUvYWNjdC8xIiwgImFsZyI6ICJSUzI1NiIsICJraWQiOiAiaHR0cDovL2xhcHRvcC5uY2xtLXNhbWJhLmxvY2FsL2FjbWUvYWNjdC8xIn0","payload": "eyJzdGF0dXMiOiJkZWFjdGl2YXRlZCJ9","signature": "QYbMYZ1Dk8dHKqOwWBQHvWdnGD7donGZObb2Ry_Y5PsHpcTrj8Y2CM57SNVAR9V0ePg4vhK3-IbwYAKbhZV8jF7E-ylZaYm4PSQcumKLI55qvDiEvDiZ0gmjf_GAcsC40TwBa11lzR1u0dQYxOlQ_y9ak6705c5bM_V4_ttQeslJXCfVIQoV-sZS0Z6tJfy5dPVDR7JYG77bZbD3K-HCCaVbT7ilqcf00rA16lvw13zZnIgbcZsbW-eJ2BM_QxE24PGqc_vMfAxIiUG0VY7DqrKumLs91lHHTEie8I-CapH6AetsBhGtRcB6EL_Rn6qGQZK9YBpvoXANv_qF2-zQkQ"}'
+        (result, error, protected, payload, jwstoken) = self.jws_decode(self.logger, message)
+        self.assertTrue(result)
+        self.assertFalse(error)
+        self.assertEqual('RS256', protected['alg'])
+        self.assertEqual({'status': 'deactivated'}, payload)
+        with patch('acme.helper.jws.JWS.deserialize') as mock_deserialize:
+            self.assertEqual((True, None), self.signature_check(self.logger, jwstoken, mkey))
+        self.assertFalse(mock_deserialize.called)
+
+    def test_311_jws_decode(self):
+        """ jws_decode() with a message which cannot be deserialized """
+        (result, error, protected, payload, jwstoken) = self.jws_decode(self.logger, '{"foo" : "bar"}')
+        self.assertFalse(result)
+        self.assertTrue(error)
+        self.assertEqual(({}, {}, None), (protected, payload, jwstoken))
+
+    @patch('acme.signature.Signature.check')
+    @patch('acme.message.Message.name_get')
+    @patch('acme.nonce.Nonce.check')
+    @patch('acme.message.jws_decode')
+    def test_312_message_check(self, mock_decode, mock_nonce_check, mock_aname, mock_sig):
+        """ Message.check() hands the parsed token over to Signature.check() """
+        mock_decode.return_value = (True, None, 'protected', 'payload', 'jwstoken')
+        mock_nonce_check.return_value = (200, None, None)
+        mock_aname.return_value = 'account_name'
+        mock_sig.return_value = (True, None, None)
+        self.assertEqual((200, None, None, 'protected', 'payload', 'account_name'), self.message.check('message'))
+        mock_sig.assert_called_with('account_name', 'jwstoken', False, 'protected')
+
+    @patch('acme.context.DBstore')
+    def test_313_context_dbstore_get(self, mock_dbstore):
+        """ Context.dbstore_get() hands out one dbstore per thread """
+        mock_dbstore.side_effect = lambda *args: MagicMock()
+        context = self.context_cls(False, self.logger, {'foo': 'bar'})
+        dbstore = context.dbstore_get()
+        self.assertIs(dbstore, context.dbstore_get())
+        result_list = []
+        thread = threading.Thread(target=lambda: result_list.append(context.dbstore_get()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(dbstore, result_list[0])
+        self.assertEqual(2, mock_dbstore.call_count)
+
+    @patch('acme.nonce.load_config')
+    @patch('acme.message.load_config')
+    @patch('acme.order.load_config')
+    def test_314_context_order(self, mock_oload, mock_mload, mock_nload):
+        """ Order() with context uses dbstore, nonce handler and configuration from context """
+        config_dic = configparser.ConfigParser()
+        config_dic.read_dict({'Order': {'tnauthlist_support': True}, 'Nonce': {'nonce_backend': 'memory'}})
+        context = self.context_cls(False, self.logger, config_dic)
+        context.local.dbstore = ('dbstore', config_dic)
+        with self.order_cls(False, 'http://tester.local', self.logger, context=context) as order:
+            self.assertEqual('dbstore', order.dbstore)
+            self.assertEqual('dbstore', order.message.dbstore)
+            self.assertIs(context.nonce_get(), order.message.nonce)
+            self.assertTrue(order.tnauthlist_support)
+        self.assertEqual('memory', context.nonce_get().backend)
+        self.assertFalse(mock_oload.called)
+        self.assertFalse(mock_mload.called)
+        self.assertFalse(mock_nload.called)
+
+    def test_315_certificate_ca_handler_get(self):
+        """ Certificate.ca_handler_get() with and without context """
+        context = self.context_cls(False, self.logger, {'foo': 'bar'})
+        context.local.ca_handler = ('ca_handler', context.config_dic)
+        certificate = self.certificate_cls(False, 'http://tester.local', self.logger, context)
+        self.assertEqual('ca_handler', certificate.ca_handler_get())
+        self.assertNotEqual('ca_handler', self.certificate.ca_handler_get())
+
+    def test_316_load_config(self):
+        """ load_config() parses a file once and reloads it after a change """
+        cfg_file = os.path.join(tempfile.mkdtemp(), 'acme_srv.cfg')
+        with open(cfg_file, 'w') as fso:
+            fso.write('[Order]\ntnauthlist_support: False\n')
+        config_dic = self.load_config(cfg_file=cfg_file)
+        self.assertIs(config_dic, self.load_config(cfg_file=cfg_file))
+        with open(cfg_file, 'w') as fso:
+            fso.write('[Order]\ntnauthlist_support: True\n\n')
+        new_config_dic = self.load_config(cfg_file=cfg_file)
+        self.assertIsNot(config_dic, new_config_dic)
+        self.assertTrue(new_config_dic.getboolean('Order', 'tnauthlist_support'))
+        os.remove(cfg_file)
+
+    def test_317_load_config(self):
+        """ load_config() with a non existing file """
+        cfg_file = os.path.join(tempfile.mkdtemp(), 'acme_srv.cfg')
+        self.assertFalse(self.load_config(cfg_file=cfg_file).sections())
+        self.assertIs(self.load_config(cfg_file=cfg_file), self.load_config(cfg_file=cfg_file))
+
+    @patch('acme.context.load_config')
+    @patch('acme.context.DBstore')
+    def test_318_context_dbstore_get(self, mock_dbstore, mock_load):
+        """ Context.dbstore_get() recreates the dbstore after a config reload """
+        mock_dbstore.side_effect = lambda *args: MagicMock()
+        mock_load.return_value = 'config1'
+        context = self.context_cls(False, self.logger)
+        dbstore = context.dbstore_get()
+        self.assertIs(dbstore, context.dbstore_get())
+        mock_load.return_value = 'config2'
+        self.assertIsNot(dbstore, context.dbstore_get())
+
+    @patch('acme.challenge.Challenge.validate')
+    @patch('acme.challenge.Challenge.validation_executor_get')
+    @patch('acme.nonce.Nonce.generate_and_add')
+    @patch('acme.challenge.Challenge.info')
+    @patch('acme.challenge.Challenge.name_get')
+    @patch('acme.message.Message.check')
+    def test_319_challenge_parse(self, mock_mcheck, mock_cname, mock_cinfo, mock_nnonce, mock_executor, mock_validate):
+        """ Challenge.parse() with worker pool returns processing without validating in the request """
+        self.challenge.validation_workers = 2
+        self.challenge.dbstore.challenge_lookup.return_value = {}
+        mock_mcheck.return_value = (200, None, None, {'url' : 'bar'}, 'payload', 'account_name')
+        mock_cname.return_value = 'foo'
+        mock_cinfo.return_value = {'type' : 'http-01', 'status' : 'pending'}
+        mock_nnonce.return_value = 'new_nonce'
+        self.assertEqual({'code': 200, 'header': {'Link': '<http://tester.local/acme/authz/>;rel="up"', 'Replay-Nonce': 'new_nonce'}, 'data': {'type': 'http-01', 'status': 'processing', 'url': 'bar'}}, self.challenge.parse('content'))
+        mock_executor.return_value.submit.assert_called_with(self.challenge.validation_run, 'foo', 'payload')
+        self.assertFalse(mock_validate.called)
+        self.challenge.validation_workers = 0
+
+    @patch('acme.challenge.Challenge.validation_executor_get')
+    def test_320_challenge_validation_submit(self, mock_executor):
+        """ Challenge.validation_submit() does not validate a challenge twice """
+        self.challenge.dbstore.challenge_claim.reset_mock()
+        self.challenge.dbstore.challenge_claim.return_value = False
+        challenge_dic = {'status' : 'processing'}
+        self.challenge.validation_submit('foo', 'payload', challenge_dic)
+        self.assertTrue(self.challenge.dbstore.challenge_claim.called)
+        self.challenge.dbstore.challenge_claim.reset_mock()
+        challenge_dic = {'status' : 'valid'}
+        self.challenge.validation_submit('foo', 'payload', challenge_dic)
+        self.assertFalse(self.challenge.dbstore.challenge_claim.called)
+        self.assertFalse(mock_executor.called)
+
+    @patch('acme.challenge.Challenge.update')
+    @patch('acme.challenge.Challenge.validate')
+    def test_321_challenge_validation_run(self, mock_validate, mock_update):
+        """ Challenge.validation_run() sets failed challenges back to pending """
+        mock_validate.side_effect = [True, False, Exception('boom')]
+        self.assertTrue(self.challenge.validation_run('foo', 'payload'))
+        self.assertFalse(mock_update.called)
+        self.assertFalse(self.challenge.validation_run('foo', 'payload'))
+        mock_update.assert_called_with({'name' : 'foo', 'status' : 'pending'})
+        mock_update.reset_mock()
+        self.assertFalse(self.challenge.validation_run('foo', 'payload'))
+        mock_update.assert_called_with({'name' : 'foo', 'status' : 'pending'})
+
+    @patch('acme.challenge.os.getpid')
+    @patch('acme.challenge.ThreadPoolExecutor')
+    @patch.dict('acme.challenge.VALIDATION_POOL_DIC', {'executor': None, 'pid': None})
+    def test_322_challenge_validation_executor_get(self, mock_pool, mock_pid):
+        """ Challenge.validation_executor_get() creates one pool per process """
+        mock_pool.side_effect = lambda max_workers: MagicMock()
+        mock_pid.return_value = 10
+        self.challenge.validation_workers = 4
+        executor = self.challenge.validation_executor_get()
+        self.assertIs(executor, self.challenge.validation_executor_get())
+        mock_pid.return_value = 11
+        self.assertIsNot(executor, self.challenge.validation_executor_get())
+        mock_pool.assert_called_with(max_workers=4)
+        self.challenge.validation_workers = 0
+
+    @patch.dict('acme.order.ENROLLMENT_POOL_DIC', {'runs': 0})
+    @patch('acme.order.b64_url_recode')
+    @patch('acme.job.Job.add')
+    @patch('acme.certificate.Certificate.store_csr')
+    @patch('acme.order.Order.process_csr')
+    @patch('acme.order.Order.enrollment_executor_get')
+    @patch('acme.order.Order.update')
+    @patch('acme.order.Order.info')
+    @patch('acme.nonce.Nonce.generate_and_add')
+    @patch('acme.order.Order.name_get')
+    @patch('acme.message.Message.check')
+    def test_323_order_parse(self, mock_mcheck, mock_oname, mock_nnonce, mock_info, mock_update, mock_executor, mock_csr, mock_store, mock_jadd, mock_recode):
+        """ Order.parse() finalize with worker pool queues a job and returns processing order and Retry-After header """
+        self.order.enrollment_workers = 2
+        mock_mcheck.return_value = (200, None, None, {'url' : 'bar_url/finalize'}, {"csr" : "csr_payload"}, 'account_name')
+        mock_oname.return_value = 'order_name'
+        mock_nnonce.return_value = 'new_nonce'
+        mock_info.side_effect = [{'status' : 'ready'}, {'status' : 'processing'}]
+        mock_store.return_value = 'cert_name'
+        mock_recode.return_value = 'csr_b64'
+        self.order.dbstore.authorization_lookup.return_value = []
+        e_result = {'header': {'Location': 'http://tester.local/acme/order/order_name', 'Replay-Nonce': 'new_nonce', 'Retry-After': '10'}, 'code': 200, 'data': {'status': 'processing', 'finalize': 'http://tester.local/acme/order/order_name/finalize'}}
+        self.assertEqual(e_result, self.order.parse('message'))
+        mock_store.assert_called_with('order_name', 'csr_b64')
+        mock_jadd.assert_called_with('order_name', 'cert_name')
+        mock_update.assert_called_with({'name' : 'order_name', 'status': 'processing'})
+        mock_executor.return_value.submit.assert_called_once_with(self.order.enrollment_run)
+        self.assertFalse(mock_csr.called)
+        self.order.enrollment_workers = 0
+
+    @patch('acme.order.Order.info')
+    @patch('acme.nonce.Nonce.generate_and_add')
+    @patch('acme.order.Order.name_get')
+    @patch('acme.message.Message.check')
+    def test_324_order_parse(self, mock_mcheck, mock_oname, mock_nnonce, mock_info):
+        """ Order.parse() polling an order in processing state does not return a certificate """
+        mock_mcheck.return_value = (200, None, None, {'url' : 'bar_url'}, {}, 'account_name')
+        mock_oname.return_value = 'order_name'
+        mock_nnonce.return_value = 'new_nonce'
+        mock_info.return_value = {'status' : 'processing'}
+        self.order.dbstore.authorization_lookup.return_value = []
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name'}
+        result = self.order.parse('message')
+        self.assertEqual('10', result['header']['Retry-After'])
+        self.assertNotIn('certificate', result['data'])
+
+    @patch('acme.order.Order.enrollment_executor_get')
+    @patch('acme.order.Order.update')
+    @patch('acme.order.Order.info')
+    def test_325_order_enrollment_submit(self, mock_info, mock_update, mock_executor):
+        """ Order.enrollment_submit() unknown order and order already processing """
+        mock_info.return_value = {}
+        self.assertEqual((400, 'urn:ietf:params:acme:error:unauthorized', 'order: foo not found'), self.order.enrollment_submit('foo', 'csr'))
+        mock_info.return_value = {'status' : 'processing'}
+        self.assertEqual((200, None, None), self.order.enrollment_submit('foo', 'csr'))
+        self.assertFalse(mock_update.called)
+        self.assertFalse(mock_executor.called)
+
+    @patch.dict('acme.order.ENROLLMENT_POOL_DIC', {'runs': 2})
+    @patch('acme.job.Job.dispatch')
+    def test_326_order_enrollment_run(self, mock_dispatch):
+        """ Order.enrollment_run() processes queued jobs and survives errors """
+        from acme.order import ENROLLMENT_POOL_DIC
+        mock_dispatch.side_effect = [2, Exception('boom')]
+        self.assertEqual(2, self.order.enrollment_run())
+        self.assertEqual(0, self.order.enrollment_run())
+        self.assertEqual(0, ENROLLMENT_POOL_DIC['runs'])
+
+    @patch('acme.job.Job.add')
+    @patch('acme.certificate.Certificate.store_csr')
+    @patch('acme.order.Order.enrollment_executor_get')
+    @patch('acme.order.Order.update')
+    @patch('acme.order.Order.info')
+    def test_327_order_enrollment_submit(self, mock_info, mock_update, mock_executor, mock_store, mock_jadd):
+        """ Order.enrollment_submit() does not queue a job if the csr could not be stored """
+        mock_info.return_value = {'status' : 'ready'}
+        mock_store.return_value = None
+        self.assertEqual((500, 'urn:ietf:params:acme:error:serverInternal', 'CSR processing failed'), self.order.enrollment_submit('foo', 'csr'))
+        self.assertFalse(mock_jadd.called)
+        self.assertFalse(mock_update.called)
+        self.assertFalse(mock_executor.called)
+
+    @patch.dict('acme.order.ENROLLMENT_POOL_DIC', {'runs': 0})
+    @patch('acme.order.Order.enrollment_executor_get')
+    @patch('acme.order.Order.info')
+    @patch('acme.nonce.Nonce.generate_and_add')
+    @patch('acme.order.Order.name_get')
+    @patch('acme.message.Message.check')
+    def test_328_order_parse(self, mock_mcheck, mock_oname, mock_nnonce, mock_info, mock_executor):
+        """ Order.parse() polling an order in processing state picks up queued jobs """
+        self.order.enrollment_workers = 2
+        mock_mcheck.return_value = (200, None, None, {'url' : 'bar_url'}, {}, 'account_name')
+        mock_oname.return_value = 'order_name'
+        mock_nnonce.return_value = 'new_nonce'
+        mock_info.return_value = {'status' : 'processing'}
+        self.order.dbstore.authorization_lookup.return_value = []
+        self.order.dbstore.certificate_lookup.return_value = None
+        self.order.parse('message')
+        mock_executor.return_value.submit.assert_called_once_with(self.order.enrollment_run)
+        self.order.enrollment_workers = 0
+
+    def test_329_job_add(self):
+        """ Job.add() queues a job due immediately """
+        self.job.dbstore.reset_mock()
+        self.job.dbstore.job_add.return_value = True
+        self.assertTrue(self.job.add('order_name', 'cert_name'))
+        data_dic = self.job.dbstore.job_add.call_args[0][0]
+        self.assertEqual(('cert_name', 'order_name'), (data_dic['name'], data_dic['order_name']))
+        self.assertIn('next_run', data_dic)
+
+    @patch('acme.job.Job.run')
+    def test_330_job_dispatch(self, mock_run):
+        """ Job.dispatch() runs claimed jobs until the queue is empty or limit is reached """
+        self.job.dbstore.reset_mock()
+        self.job.dbstore.job_claim.side_effect = [{'name' : 'job1'}, {'name' : 'job2'}, None]
+        self.assertEqual(2, self.job.dispatch())
+        self.assertEqual(2, mock_run.call_count)
+        self.job.dbstore.job_claim.side_effect = [{'name' : 'job3'}, {'name' : 'job4'}]
+        self.assertEqual(1, self.job.dispatch(1))
+        self.job.dbstore.job_claim.side_effect = None
+
+    @patch('acme.job.uts_now')
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    def test_331_job_run(self, mock_enroll, mock_now):
+        """ Job.run() sets job done and order valid after a successful enrollment """
+        self.job.dbstore.reset_mock()
+        mock_now.return_value = 1000
+        self.job.dbstore.certificate_lookup.return_value = {'csr' : 'csr'}
+        self.job.dbstore.job_update.return_value = True
+        mock_enroll.return_value = (1, None, None)
+        self.assertEqual('done', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 1}))
+        self.job.dbstore.job_update.assert_called_with({'name' : 'cert_name', 'token' : 'token', 'next_run' : 1000, 'error' : None, 'status' : 'done'})
+        self.job.dbstore.order_update.assert_called_with({'name' : 'order_name', 'status' : 'valid'})
+        mock_enroll.assert_called_with('cert_name', 'csr')
+
+    @patch('acme.job.uts_now')
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    def test_332_job_run(self, mock_enroll, mock_now):
+        """ Job.run() requeues failed enrollments with backoff and fails after max_attempts """
+        self.job.dbstore.reset_mock()
+        mock_now.return_value = 1000
+        self.job.dbstore.certificate_lookup.return_value = {'csr' : 'csr'}
+        self.job.dbstore.job_update.return_value = True
+        mock_enroll.side_effect = [(None, 'ca error', None), Exception('boom'), (None, 'ca error', None)]
+        self.assertEqual('queued', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 1}))
+        self.job.dbstore.job_update.assert_called_with({'name' : 'cert_name', 'token' : 'token', 'next_run' : 1030, 'error' : 'ca error', 'status' : 'queued'})
+        self.assertEqual('queued', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 3}))
+        self.job.dbstore.job_update.assert_called_with({'name' : 'cert_name', 'token' : 'token', 'next_run' : 1120, 'error' : 'boom', 'status' : 'queued'})
+        self.assertFalse(self.job.dbstore.order_update.called)
+        self.assertEqual('failed', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 5}))
+        self.job.dbstore.order_update.assert_called_with({'name' : 'order_name', 'status' : 'invalid'})
+
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    def test_333_job_run(self, mock_enroll):
+        """ Job.run() does not retry invalid csrs, missing csrs and jobs exceeding max_attempts """
+        self.job.dbstore.reset_mock()
+        self.job.dbstore.job_update.return_value = True
+        self.job.dbstore.certificate_lookup.return_value = {'csr' : 'csr'}
+        mock_enroll.return_value = (None, 'urn:ietf:params:acme:badCSR', 'CSR validation failed')
+        self.assertEqual('failed', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 1}))
+        self.job.dbstore.certificate_lookup.return_value = None
+        self.assertEqual('failed', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 1}))
+        mock_enroll.reset_mock()
+        self.job.dbstore.certificate_lookup.return_value = {'csr' : 'csr'}
+        self.assertEqual('failed', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 6}))
+        self.assertFalse(mock_enroll.called)
+        self.job.dbstore.order_update.assert_called_with({'name' : 'order_name', 'status' : 'invalid'})
+
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    def test_334_job_run(self, mock_enroll):
+        """ Job.run() does not touch the order if the lease got lost """
+        self.job.dbstore.reset_mock()
+        self.job.dbstore.certificate_lookup.return_value = {'csr' : 'csr'}
+        self.job.dbstore.job_update.return_value = False
+        mock_enroll.return_value = (1, None, None)
+        self.assertEqual('done', self.job.run({'name' : 'cert_name', 'order_name' : 'order_name', 'token' : 'token', 'attempts' : 1}))
+        self.assertFalse(self.job.dbstore.order_update.called)
+
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    @patch('acme.certificate.Certificate.store_csr')
+    @patch('acme.order.Order.info')
+    def test_335_process_csr(self, mock_oinfo, mock_certname, mock_enroll):
+        """ Order.process_csr() returns the existing certificate for a retried finalize request """
+        mock_oinfo.return_value = {'status' : 'valid'}
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name', 'csr' : 'csr=', 'cert' : 'cert'}
+        self.assertEqual((200, 'cert_name', None), self.order.process_csr('order_name', 'csr'))
+        self.assertFalse(mock_certname.called)
+        self.assertFalse(mock_enroll.called)
+
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    @patch('acme.certificate.Certificate.store_csr')
+    @patch('acme.order.Order.info')
+    def test_336_process_csr(self, mock_oinfo, mock_certname, mock_enroll):
+        """ Order.process_csr() retries a failed enrollment without adding a new certificate entry, a new csr gets stored """
+        mock_oinfo.return_value = {'status' : 'ready'}
+        mock_certname.return_value = 'new_name'
+        mock_enroll.return_value = ('bar', None, None)
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name', 'csr' : 'csr=', 'cert' : None}
+        self.assertEqual((200, 'cert_name', None), self.order.process_csr('order_name', 'csr'))
+        self.assertFalse(mock_certname.called)
+        mock_enroll.assert_called_with('cert_name', 'csr=')
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name', 'csr' : 'other=', 'cert' : 'cert'}
+        self.assertEqual((200, 'new_name', None), self.order.process_csr('order_name', 'csr'))
+        mock_enroll.assert_called_with('new_name', 'csr=')
+
+    @patch('acme.order.Order.process_csr_locked')
+    def test_337_process_csr(self, mock_locked):
+        """ Order.process_csr() lets concurrent requests for the same order wait for the first one """
+        started = threading.Event()
+        release = threading.Event()
+        active = []
+        def locked(order_name, _csr):
+            active.append(order_name)
+            self.assertEqual(1, len(active))
+            started.set()
+            release.wait(5)
+            active.remove(order_name)
+            return (200, 'cert_name', None)
+        mock_locked.side_effect = locked
+        result_list = []
+        thread_list = [threading.Thread(target=lambda: result_list.append(self.order.process_csr('order_name', 'csr'))) for _ in range(3)]
+        for thread in thread_list:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in thread_list:
+            thread.join(5)
+        self.assertEqual([(200, 'cert_name', None)] * 3, result_list)
+        self.assertEqual(3, mock_locked.call_count)
+        self.assertFalse(self.finalize_dic['flights'])
+
+    @patch('acme.order.uts_now')
+    @patch('acme.order.generate_random_string')
+    def test_338_order_add(self, mock_name, mock_uts):
+        """ Order.add() reuses valid authorizations and sets order to ready once all identifiers are authorized """
+        mock_name.side_effect = ['order', 'identifier1', 'identifier2']
+        mock_uts.return_value = 1000
+        self.order.authz_reuse = True
+        self.order.dbstore.reset_mock()
+        self.order.dbstore.authorization_reusable_lookup.side_effect = [{'name' : 'old1', 'expires' : 90000}, None]
+        message = {'identifiers' : [{"type": "dns", "value": "example1.com"}, {"type": "dns", "value": "example2.com"}]}
+        self.order.add(message, 'account')
+        (data_dic, authz_list) = self.order.dbstore.order_add_with_authorizations.call_args[0]
+        self.assertEqual(2, data_dic['status'])
+        self.assertEqual([('valid', 90000), ('pending', None)], [(authz['status'], authz.get('expires')) for authz in authz_list])
+        self.order.dbstore.authorization_reusable_lookup.assert_called_with('account', authz_list[1], 4600)
+        mock_name.side_effect = ['order', 'identifier1']
+        self.order.dbstore.authorization_reusable_lookup.side_effect = [{'name' : 'old1', 'expires' : 90000}]
+        self.order.add({'identifiers' : [{"type": "dns", "value": "example1.com"}]}, 'account')
+        self.assertEqual(3, self.order.dbstore.order_add_with_authorizations.call_args[0][0]['status'])
+        self.order.dbstore.authorization_reusable_lookup.side_effect = None
+        self.order.authz_reuse = False
+
+    @patch('acme.order.generate_random_string')
+    def test_339_order_add(self, mock_name):
+        """ Order.add() does not look for reusable authorizations by default """
+        mock_name.side_effect = ['order', 'identifier1']
+        self.order.dbstore.reset_mock()
+        self.order.add({'identifiers' : [{"type": "dns", "value": "example1.com"}]}, 'account')
+        self.assertFalse(self.order.dbstore.authorization_reusable_lookup.called)
+
+    @patch('acme.challenge.Challenge.new_set')
+    @patch('acme.authorization.uts_now')
+    def test_340_authorization_info(self, mock_uts, mock_challengeset):
+        """ Authorization.auth_info() does not extend the lifetime of a valid authorization """
+        mock_uts.return_value = 1543640400
+        mock_challengeset.return_value = []
+        self.authorization.dbstore.reset_mock()
+        self.authorization.dbstore.authorization_lookup.return_value = [{'type' : 'dns', 'value' : 'example.com', 'status__name' : 'valid', 'expires' : 1543600000}]
+        self.assertEqual('2018-11-30T17:46:40Z', self.authorization.authz_info('http://tester.local/acme/authz/foo')['expires'])
+        self.assertFalse(self.authorization.dbstore.authorization_update.called)
+
+    @patch('acme.challenge.Challenge.new')
+    def test_341_challenge_new_set(self, mock_new):
+        """ Challenge.new_set() returns existing challenges instead of creating new ones """
+        self.challenge.dbstore.challenges_lookup.return_value = [{'name' : 'chall1', 'type' : 'http-01', 'token' : 'token1'}, {'name' : 'chall2', 'type' : 'tkauth-01', 'token' : 'token1'}]
+        e_result = [{'type' : 'http-01', 'url' : 'http://tester.local/acme/chall/chall1', 'token' : 'token1'}, {'type' : 'tkauth-01', 'url' : 'http://tester.local/acme/chall/chall2', 'token' : 'token1', 'tkauth-type' : 'atc'}]
+        self.assertEqual(e_result, self.challenge.new_set('authz_name', 'token2', False))
+        self.assertFalse(mock_new.called)
+        self.challenge.dbstore.challenges_lookup.return_value = []
+        mock_new.return_value = {'foo' : 'bar'}
+        self.assertEqual([{'foo' : 'bar'}, {'foo' : 'bar'}], self.challenge.new_set('authz_name', 'token2', False))
+        self.challenge.dbstore.challenges_lookup.assert_called_with('authorization__name', 'authz_name', ['name', 'type', 'token'])
+
+    @patch('acme.challenge.Challenge.new_set')
+    @patch('acme.authorization.uts_now')
+    def test_342_authorization_info(self, mock_uts, mock_challengeset):
+        """ Authorization.auth_info() polling a pending authorization does not update it """
+        mock_uts.return_value = 1543640400
+        mock_challengeset.return_value = []
+        self.authorization.dbstore.reset_mock()
+        self.authorization.dbstore.authorization_lookup.return_value = [{'type' : 'dns', 'value' : 'example.com', 'status__name' : 'pending', 'expires' : 1543700000}]
+        self.assertEqual('2018-12-01T21:33:20Z', self.authorization.authz_info('http://tester.local/acme/authz/foo')['expires'])
+        self.assertFalse(self.authorization.dbstore.authorization_update.called)
+        self.assertEqual(1, self.authorization.dbstore.authorization_lookup.call_count)
+
+    @patch('acme.helper.uts_now')
+    def test_343_state_cache(self, mock_now):
+        """ state_cache_get() returns copies of unexpired entries, state_cache_invalidate() removes them """
+        self.state_cache_dic['entries'].clear()
+        mock_now.return_value = 1000
+        (value, generation) = self.state_cache_get(self.logger, ('order', 'foo'))
+        self.assertIsNone(value)
+        self.state_cache_set(self.logger, ('order', 'foo'), {'status' : 'pending'}, 5, generation)
+        (value, generation) = self.state_cache_get(self.logger, ('order', 'foo'))
+        self.assertEqual({'status' : 'pending'}, value)
+        value['status'] = 'modified'
+        self.assertEqual({'status' : 'pending'}, self.state_cache_get(self.logger, ('order', 'foo'))[0])
+        mock_now.return_value = 1006
+        self.assertIsNone(self.state_cache_get(self.logger, ('order', 'foo'))[0])
+        mock_now.return_value = 1000
+        self.state_cache_invalidate(self.logger, [('order', 'foo')])
+        self.assertIsNone(self.state_cache_get(self.logger, ('order', 'foo'))[0])
+
+    def test_344_state_cache(self):
+        """ state_cache_set() skips values read before a concurrent invalidation """
+        self.state_cache_dic['entries'].clear()
+        (_value, generation) = self.state_cache_get(self.logger, ('authz', 'foo'))
+        self.state_cache_invalidate(self.logger, [('authz', 'bar')])
+        self.state_cache_set(self.logger, ('authz', 'foo'), {'status' : 'pending'}, 5, generation)
+        self.assertIsNone(self.state_cache_get(self.logger, ('authz', 'foo'))[0])
+
+    @patch('acme.order.Order.lookup')
+    def test_345_order_state_get(self, mock_lookup):
+        """ Order.state_get() serves repeated polls from cache if enabled """
+        self.state_cache_dic['entries'].clear()
+        self.order.dbstore.reset_mock()
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name'}
+        mock_lookup.return_value = {'status' : 'valid'}
+        self.order.state_get('order_name')
+        self.order.state_get('order_name')
+        self.assertEqual(2, mock_lookup.call_count)
+        self.order.state_cache_lifetime = 10
+        self.assertEqual(('cert_name', {'status' : 'valid'}), self.order.state_get('order_name'))
+        self.assertEqual(('cert_name', {'status' : 'valid'}), self.order.state_get('order_name'))
+        self.assertEqual(3, mock_lookup.call_count)
+        self.assertEqual(3, self.order.dbstore.certificate_lookup.call_count)
+        self.order.state_cache_lifetime = 0
+        self.state_cache_dic['entries'].clear()
+
+    @patch('acme.authorization.Authorization.authz_load')
+    def test_346_authorization_info(self, mock_load):
+        """ Authorization.authz_info() serves repeated polls from cache if enabled """
+        self.state_cache_dic['entries'].clear()
+        mock_load.return_value = {'status' : 'pending'}
+        self.authorization.state_cache_lifetime = 10
+        self.assertEqual({'status' : 'pending'}, self.authorization.authz_info('http://tester.local/acme/authz/foo'))
+        self.assertEqual({'status' : 'pending'}, self.authorization.authz_info('http://tester.local/acme/authz/foo'))
+        self.assertEqual(1, mock_load.call_count)
+        self.state_cache_invalidate(self.logger, [('authz', 'foo')])
+        self.authorization.authz_info('http://tester.local/acme/authz/foo')
+        self.assertEqual(2, mock_load.call_count)
+        self.authorization.state_cache_lifetime = 0
+        self.state_cache_dic['entries'].clear()
+
+    @patch('acme.helper.http_session_get')
+    def test_347_url_get(self, mock_session):
+        """ url_get() uses timeouts and stops reading after HTTP_CLIENT_DIC['size'] bytes """
+        response = mock_session.return_value.get.return_value.__enter__.return_value
+        response.encoding = None
+        response.iter_content.return_value = iter([b'a' * 500] * 20)
+        self.assertEqual('a' * 4096, self.url_get(self.logger, 'http://foo'))
+        mock_session.return_value.get.assert_called_with('http://foo', timeout=(5, 5), stream=True)
+        response.iter_content.assert_called_with(chunk_size=512)
+
+    @patch('acme.helper.time.time')
+    @patch('acme.helper.http_session_get')
+    def test_348_url_get(self, mock_session, mock_time):
+        """ url_get() returns None on errors and if the deadline got exceeded """
+        mock_session.return_value.get.side_effect = Exception('connection refused')
+        self.assertIsNone(self.url_get(self.logger, 'http://foo'))
+        mock_session.return_value.get.side_effect = None
+        response = mock_session.return_value.get.return_value.__enter__.return_value
+        response.iter_content.return_value = iter([b'a'] * 100)
+        mock_time.side_effect = [100, 101, 111]
+        self.assertIsNone(self.url_get(self.logger, 'http://foo'))
+
+    def test_349_http_session_get(self):
+        """ http_session_get() keeps one session per thread with limited redirects """
+        session = self.http_session_get()
+        self.assertIs(session, self.http_session_get())
+        self.assertEqual(3, session.max_redirects)
+        session_list = []
+        thread = threading.Thread(target=lambda: session_list.append(self.http_session_get()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(session, session_list[0])
+
+    @patch('acme.challenge.txt_get')
+    def test_350_validate_dns_challenge(self, mock_dns):
+        """ Challenge.validate_dns_challenge() finds the expected value among several TXT records """
+        mock_dns.return_value = ['foo', '61rBZ_4knHblO0MNoxFsXZ_eTFUHum0B6IVRbhvUn5I']
+        self.assertTrue(self.challenge.validate_dns_challenge('example.com', 'token', 'thumbprint'))
+        mock_dns.assert_called_with(self.logger, '_acme-challenge.example.com', None, 5, 60, 5)
+        mock_dns.return_value = ['foo']
+        self.assertFalse(self.challenge.validate_dns_challenge('example.com', 'token', 'thumbprint'))
+
+    def test_351_b64_url_encode(self):
+        """ b64_url_encode() returns a string without padding """
+        self.assertEqual('Zm9vYg', self.b64_url_encode(self.logger, b'foob'))
+
+    @patch('acme.helper.dns.resolver.Resolver')
+    def test_352_dns_resolver_get(self, mock_resolver):
+        """ dns_resolver_get() keeps the resolver until nameservers or timeout change """
+        self.dns_resolver_dic['resolver'] = None
+        mock_resolver.side_effect = lambda **kwargs: MagicMock()
+        resolver = self.dns_resolver_get(self.logger, ['10.0.0.1'], 5)
+        self.assertIs(resolver, self.dns_resolver_get(self.logger, ['10.0.0.1'], 5))
+        self.assertEqual(['10.0.0.1'], resolver.nameservers)
+        self.assertEqual(5, resolver.lifetime)
+        mock_resolver.assert_called_with(configure=False)
+        self.assertIsNot(resolver, self.dns_resolver_get(self.logger, ['10.0.0.2'], 5))
+        self.dns_resolver_dic['resolver'] = None
+
+    @patch('acme.helper.uts_now')
+    @patch('acme.helper.dns_resolver_get')
+    def test_353_txt_get(self, mock_resolver, mock_now):
+        """ txt_get() returns all TXT records and caches them for their ttl """
+        self.dns_resolver_dic['cache'].clear()
+        mock_now.return_value = 1000
+        rdata1 = MagicMock()
+        rdata1.strings = [b'foo', b'bar']
+        rdata2 = MagicMock()
+        rdata2.strings = [b'baz']
+        answer = MagicMock()
+        answer.__iter__.return_value = [rdata1, rdata2]
+        answer.rrset.ttl = 30
+        mock_resolver.return_value.resolve.return_value = answer
+        self.assertEqual(['foobar', 'baz'], self.txt_get(self.logger, 'Example.com'))
+        self.assertEqual(['foobar', 'baz'], self.txt_get(self.logger, 'example.com.'))
+        self.assertEqual(1, mock_resolver.return_value.resolve.call_count)
+        mock_now.return_value = 1031
+        self.txt_get(self.logger, 'example.com')
+        self.assertEqual(2, mock_resolver.return_value.resolve.call_count)
+        self.dns_resolver_dic['cache'].clear()
+
+    @patch('acme.helper.uts_now')
+    @patch('acme.helper.dns_resolver_get')
+    def test_354_txt_get(self, mock_resolver, mock_now):
+        """ txt_get() caches missing records for negative_ttl seconds but not failed queries """
+        import dns.resolver
+        self.dns_resolver_dic['cache'].clear()
+        mock_now.return_value = 1000
+        mock_resolver.return_value.resolve.side_effect = dns.resolver.NXDOMAIN()
+        self.assertEqual([], self.txt_get(self.logger, 'example.com', negative_ttl=5))
+        self.assertEqual([], self.txt_get(self.logger, 'example.com', negative_ttl=5))
+        self.assertEqual(1, mock_resolver.return_value.resolve.call_count)
+        mock_resolver.return_value.resolve.side_effect = dns.resolver.NoNameservers()
+        self.assertEqual([], self.txt_get(self.logger, 'example.org'))
+        self.assertEqual([], self.txt_get(self.logger, 'example.org'))
+        self.assertEqual(3, mock_resolver.return_value.resolve.call_count)
+        self.dns_resolver_dic['cache'].clear()
+
+    @patch('acme.challenge.uts_now')
+    @patch('acme.challenge.Challenge.validation_schedule')
+    @patch('acme.challenge.Challenge.validation_executor_get')
+    def test_355_challenge_validation_submit(self, mock_executor, mock_schedule, mock_uts):
+        """ Challenge.validation_submit() schedules the validation per order """
+        mock_uts.return_value = 1000
+        self.challenge.validation_lease = 120
+        self.challenge.dbstore.challenge_claim.return_value = True
+        self.challenge.dbstore.challenge_lookup.return_value = {'authorization__order__name' : 'order'}
+        self.challenge.validation_submit('foo', 'payload', {'status' : 'pending'})
+        self.challenge.dbstore.challenge_claim.assert_called_with('foo', 1000, 120)
+        mock_schedule.assert_called_with('order', 'foo', 'payload')
+        self.assertFalse(mock_executor.called)
+
+    @patch('acme.challenge.Challenge.validation_executor_get')
+    @patch.dict('acme.challenge.VALIDATION_POOL_DIC', {'orders': {}})
+    def test_356_challenge_validation_schedule(self, mock_executor):
+        """ Challenge.validation_schedule() queues validations above validation_order_limit """
+        from acme.challenge import VALIDATION_POOL_DIC
+        self.challenge.validation_order_limit = 2
+        self.assertTrue(self.challenge.validation_schedule('order1', 'chall1', 'payload'))
+        self.assertTrue(self.challenge.validation_schedule('order1', 'chall2', 'payload'))
+        self.assertFalse(self.challenge.validation_schedule('order1', 'chall3', 'payload'))
+        self.assertTrue(self.challenge.validation_schedule('order2', 'chall4', 'payload'))
+        self.assertEqual(3, mock_executor.return_value.submit.call_count)
+        self.assertEqual(2, VALIDATION_POOL_DIC['orders']['order1'][0])
+        self.assertEqual([('chall3', 'payload')], list(VALIDATION_POOL_DIC['orders']['order1'][1]))
+        self.challenge.validation_order_limit = 0
+
+    @patch('acme.challenge.Challenge.validation_run')
+    @patch('acme.challenge.Challenge.validation_executor_get')
+    @patch.dict('acme.challenge.VALIDATION_POOL_DIC', {'orders': {}})
+    def test_357_challenge_validation_order_run(self, mock_executor, mock_run):
+        """ Challenge.validation_order_run() submits the next queued validation and releases the order slot """
+        from collections import deque
+        from acme.challenge import VALIDATION_POOL_DIC
+        mock_run.side_effect = [True, Exception('boom')]
+        VALIDATION_POOL_DIC['orders']['order'] = [1, deque([('chall2', 'payload2')])]
+        self.assertTrue(self.challenge.validation_order_run('order', 'chall1', 'payload1'))
+        mock_executor.return_value.submit.assert_called_with(self.challenge.validation_order_run, 'order', 'chall2', 'payload2')
+        self.assertEqual(1, VALIDATION_POOL_DIC['orders']['order'][0])
+        with self.assertRaises(Exception):
+            self.challenge.validation_order_run('order', 'chall2', 'payload2')
+        self.assertNotIn('order', VALIDATION_POOL_DIC['orders'])
+        self.assertEqual(1, mock_executor.return_value.submit.call_count)
+
+    @patch('acme.challenge.Challenge.validate_execute')
+    def test_358_challenge_validate(self, mock_execute):
+        """ Challenge.validate() runs a single check for concurrent requests of the same challenge """
+        import threading
+        started = threading.Event()
+        release = threading.Event()
+        def execute(_challenge_name, _payload):
+            started.set()
+            release.wait(5)
+            return True
+        mock_execute.side_effect = execute
+        result_list = []
+        leader = threading.Thread(target=lambda: result_list.append(self.challenge.validate('foo', 'payload')))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: result_list.append(self.challenge.validate('foo', 'payload')))
+        follower.start()
+        follower.join(0.2)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual([True, True], result_list)
+        self.assertEqual(1, mock_execute.call_count)
+        self.assertTrue(self.challenge.validate('foo', 'payload'))
+        self.assertEqual(2, mock_execute.call_count)
+
+    @patch('acme.challenge.Challenge.validate_execute')
+    def test_359_challenge_validate(self, mock_execute):
+        """ Challenge.validate() releases the challenge if the check fails """
+        from acme.challenge import VALIDATION_FLIGHT_DIC
+        mock_execute.side_effect = [Exception('boom'), False]
+        with self.assertRaises(Exception):
+            self.challenge.validate('foo', 'payload')
+        self.assertNotIn('foo', VALIDATION_FLIGHT_DIC['flights'])
+        self.assertFalse(self.challenge.validate('foo', 'payload'))
+
+    def test_360_nonce_store_hmac(self):
+        """ NonceStoreHmac.check_and_delete() accepts a signed nonce only once """
+        nonce = self.nonce_store_hmac.new()
+        self.assertEqual(nonce, self.nonce_store_hmac.add(nonce))
+        self.assertRegex(nonce, r'^[0-9a-zA-Z_-]{48}$')
+        self.assertTrue(self.nonce_store_hmac.check_and_delete(nonce))
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(nonce))
+        self.assertTrue(self.nonce_store_hmac.check_and_delete(self.nonce_store_hmac.new()))
+
+    def test_361_nonce_store_hmac(self):
+        """ NonceStoreHmac.check_and_delete() refuses forged and malformed nonces without database access """
+        from acme.nonce import NonceStoreHmac
+        nonce = self.nonce_store_hmac.new()
+        forged = NonceStoreHmac(False, self.logger, 3600, 'other_secret', 1).new()
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(forged))
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(nonce[:-2] + 'AA'))
+        self.assertFalse(self.nonce_store_hmac.check_and_delete('../../etc/passwd'))
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(''))
+        self.assertFalse(self.nonce_store_hmac.dbstore.nonce_spend.called)
+        self.assertTrue(self.nonce_store_hmac.check_and_delete(nonce))
+
+    @patch('acme.nonce.uts_now')
+    def test_362_nonce_store_hmac(self, mock_uts):
+        """ NonceStoreHmac refuses expired nonces and expire() purges consumed nonces """
+        mock_uts.return_value = 100000
+        nonce1 = self.nonce_store_hmac.new()
+        nonce2 = self.nonce_store_hmac.new()
+        self.assertTrue(self.nonce_store_hmac.check_and_delete(nonce1))
+        mock_uts.return_value = 104000
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(nonce2))
+        self.assertEqual(1, self.nonce_store_hmac.dbstore.nonce_spend.call_count)
+        self.nonce_store_hmac.expire()
+        self.nonce_store_hmac.dbstore.nonce_purge.assert_called_with(3600)
+
+    def test_363_nonce_new(self):
+        """ Nonce.new() lets the hmac store create the nonce """
+        self.nonce.backend = 'hmac'
+        self.nonce.secret = 'secret'
+        self.assertEqual('NonceStoreHmac', type(self.nonce.store_get()).__name__)
+        store = self.nonce.store
+        self.nonce.store = MagicMock()
+        self.nonce.store.new.return_value = 'signed_nonce'
+        self.assertEqual('signed_nonce', self.nonce.new())
+        self.nonce.backend = 'db'
+        self.nonce.secret = None
+        self.nonce.store = store
+
+    def test_364_cert_metadata_get(self):
+        """ cert_metadata_get() returns the certificate metadata in database format """
+        from acme.helper import cert_metadata_get, cert_fingerprint_get
+        cert = 'MIIDDTCCAfWgAwIBAgIBCjANBgkqhkiG9w0BAQsFADAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wHhcNMTkwMTIwMTY1OTIwWhcNMTkwMjE5MTY1OTIwWjAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wggEiMA0GCSqGSIb3DQEBAQUAA4IBDwAwggEKAoIBAQCqUeNzDyBVugUKZq597ishYAdMPgus5Nw5pWE/Jw7PP0koeFE2wODqHVb+XNFFEX4IOyiE2Pi4ilzfXYGKchhP3wHgnkxGNIwt/cDNZgyTiUpITV/ciFaC7avkvQS6ScCYUYrhby7QnvcU02mAyhNcSVGI5TW7HhFdtWrEAK3N8H6yhxHLSi2ydpQ3kCJyJylqt/Rv3uKNjCvTv867K6A1QSsXoAxtPK9P0UOTRvgHkFf8T32Bn/Er1bjkX9Ms8rqDQmicCWJk260lUHzN6vxaeiEg7Kz3TA8Ik3DMIcvwJrE168G1APo+FyOIKyx+t78HWOlNINIqZMj5e2DpulV7AgMBAAGjXjBcMB8GA1UdIwQYMBaAFK1ZzuGt0Pe+NLerCXqQBYmVV7suMB0GA1UdDgQWBBStWc7hrdD3vjS3qwl6kAWJlVe7LjAaBgNVHREEEzARgg9mb28uZXhhbXBsZS5jb20wDQYJKoZIhvcNAQELBQADggEBAANW0DD4Xp7LH/Rzf2jVLwiFlbtR6iazyn9S/pH2Gwqjkscv/27/dqJb7CfPdD025ItQcYkZPJhDOsj63kvUaD89QU31RnYQrXrbXFqYOIAq6kxfZUoQmpfEBxbB4WxmTW0OWS+FMqNw/SuGs6EQjTRA+gBOeGzj4H9yOFOg0PpadBayZ7UT4lm1LOiFHh8hbta75ocePrurdNxsxKJhLlXbnKD6lurCb4khRhrmLmpK8JxhuaevEVklSQX0gqlRfxAH4XQsaqcaedPNI+W5OUITMz40ezDCbUqxS9KEMCGPoOTXNRAjbr72sc4Vkw7Ht+eRUDECE+0UnjyeCjTn3EU='
+        e_result = {'serial' : 'a', 'fingerprint' : 'ebe9ca60b8e6260da3bc188c303d3f33ab74f29afeacceec4e1ca595ad4b971c', 'not_before' : 1548003560, 'not_after' : 1550595560, 'issuer' : '/CN=foo.example.com', 'san' : '["DNS:foo.example.com"]'}
+        self.assertEqual(e_result, cert_metadata_get(self.logger, cert))
+        self.assertEqual(e_result['fingerprint'], cert_fingerprint_get(self.logger, cert.replace('+', '-').replace('/', '_').rstrip('=')))
+        self.assertIsNone(cert_fingerprint_get(self.logger, 'a'))
+
+    @patch('acme.certificate.cert_metadata_get')
+    def test_365_store_cert(self, mock_meta):
+        """ Certificate.store_cert() stores metadata and the certificate if metadata extraction fails """
+        self.certificate.dbstore.reset_mock()
+        mock_meta.side_effect = [{'serial' : 'a', 'fingerprint' : 'fp'}, Exception('boom')]
+        self.certificate.store_cert('cert_name', 'cert', 'raw')
+        self.certificate.dbstore.certificate_add.assert_called_with({'cert' : 'cert', 'name' : 'cert_name', 'cert_raw' : 'raw', 'serial' : 'a', 'fingerprint' : 'fp'})
+        self.certificate.store_cert('cert_name', 'cert', 'raw')
+        self.certificate.dbstore.certificate_add.assert_called_with({'cert' : 'cert', 'name' : 'cert_name', 'cert_raw' : 'raw'})
+
+    @patch('acme.certificate.cert_fingerprint_get')
+    @patch('acme.certificate.cert_san_get')
+    def test_366_san_list_get(self, mock_san, mock_fp):
+        """ Certificate.san_list_get() uses stored SANs and parses certificates without metadata """
+        mock_fp.return_value = 'fp'
+        mock_san.return_value = ['DNS:parsed.example.com']
+        self.certificate.dbstore.certificate_lookup.return_value = {'san' : '["DNS:stored.example.com"]'}
+        self.assertEqual(['DNS:stored.example.com'], self.certificate.san_list_get('cert'))
+        self.certificate.dbstore.certificate_lookup.assert_called_with('fingerprint', 'fp', ['san'])
+        self.assertFalse(mock_san.called)
+        self.certificate.dbstore.certificate_lookup.return_value = None
+        self.assertEqual(['DNS:parsed.example.com'], self.certificate.san_list_get('cert'))
+
+    @patch('acme.certificate.Certificate.store_cert')
+    def test_367_metadata_backfill(self, mock_store):
+        """ Certificate.metadata_backfill() processes all batches """
+        self.certificate.dbstore.certificate_backfill_list.side_effect = [[{'id' : 1, 'name' : 'cert1', 'cert' : 'cert', 'cert_raw' : 'raw'}, {'id' : 5, 'name' : 'cert5', 'cert' : 'cert', 'cert_raw' : 'raw'}], [{'id' : 7, 'name' : 'cert7', 'cert' : 'cert', 'cert_raw' : 'raw'}], []]
+        self.assertEqual(3, self.certificate.metadata_backfill(2))
+        self.certificate.dbstore.certificate_backfill_list.assert_called_with(7, 2)
+        mock_store.assert_called_with('cert7', 'cert', 'raw')
+        self.certificate.dbstore.certificate_backfill_list.side_effect = None
+
+    @patch('acme.account.jwk_thumbprint_get')
+    @patch('acme.account.generate_random_string')
+    def test_368_account_add(self, mock_name, mock_thumbprint):
+        """ Account.add() stores the key thumbprint """
+        mock_name.return_value = 'acc368'
+        mock_thumbprint.return_value = 'thumbprint'
+        self.account.dbstore.account_add.return_value = ('acc368', True)
+        dic = {'alg': 'RS256', 'jwk': {'e': u'AQAB', 'kty': u'RSA', 'n': u'foo'}}
+        self.assertEqual((201, 'acc368', None), self.account.add(dic, 'foo@example.com'))
+        self.account.dbstore.account_add.assert_called_with({'name' : 'acc368', 'alg' : 'RS256', 'jwk' : '{"e": "AQAB", "kty": "RSA", "n": "foo"}', 'thumbprint' : 'thumbprint', 'contact' : '"foo@example.com"'})
+
+    @patch('acme.account.jwk_thumbprint_get')
+    def test_369_onlyreturnexisting(self, mock_thumbprint):
+        """ Account.onlyreturnexisting() looks up the account by key thumbprint """
+        mock_thumbprint.return_value = 'thumbprint'
+        self.account.dbstore.account_lookup.return_value = {'name' : 'acc369'}
+        self.assertEqual((200, 'acc369', None), self.account.onlyreturnexisting({'jwk' : {'n' : 'foo'}}, {'onlyreturnexisting' : True}))
+        self.account.dbstore.account_lookup.assert_called_with('thumbprint', 'thumbprint')
+
+    @patch('acme.message.jwk_thumbprint_get')
+    def test_370_message_name_get(self, mock_thumbprint):
+        """ Message.name_get() for a revocation signed with account key looks up the account by key thumbprint """
+        mock_thumbprint.return_value = 'thumbprint'
+        self.message.dbstore.account_lookup.return_value = {'name' : 'acc370'}
+        self.assertEqual('acc370', self.message.name_get({'jwk' : {'n' : 'foo'}, 'url' : 'http://tester.local/acme/revokecert'}))
+        self.message.dbstore.account_lookup.assert_called_with('thumbprint', 'thumbprint')
+
+    def test_371_parsed_csr(self):
+        """ ParsedCsr decodes the csr once and serves all fields from it """
+        import OpenSSL
+        from acme.helper import csr_parse, csr_cn_get, csr_dn_get, csr_pubkey_get, csr_san_get, csr_tnauthlist_get
+        with patch('acme.helper.OpenSSL.crypto.load_certificate_request', wraps=OpenSSL.crypto.load_certificate_request) as mock_load:
+            csr = csr_parse(self.logger, 'MIIBFDCBugIBADAaMRgwFgYDVQQDDA9mb28uZXhhbXBsZS5jb20wWTATBgcqhkjOPQIBBggqhkjOPQMBBwNCAAR60Pony6CMulqDXPP4Fy0dVkF1uGyyq1EKvbXfs5ByZlTdVvfeBH3FwzSuaZY9VDCiMKOj3ifbyy7K4NuBtNpDoD4wPAYJKoZIhvcNAQkOMS8wLTArBgNVHREEJDAigg9mb28uZXhhbXBsZS5jb22CD2Jhci5leGFtcGxlLmNvbTAKBggqhkjOPQQDAgNJADBGAiEAlEwlOUy1NdiB47Y8-oLisXgFyf7rc3z843NjL-8U1iECIQCuRngkI9cd2Jj9M58wOPbkEeSzpfUzR-M5-o2LtfRsrw')
+            self.assertEqual('foo.example.com', csr_cn_get(self.logger, csr))
+            self.assertEqual('/CN=foo.example.com', csr_dn_get(self.logger, csr))
+            self.assertEqual(['DNS:foo.example.com', 'DNS:bar.example.com'], csr_san_get(self.logger, csr))
+            self.assertIn(b'-----BEGIN PUBLIC KEY-----\nMFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAEetD6J8ugjLpag1zz+BctHVZBdbhs', csr_pubkey_get(self.logger, csr))
+            self.assertEqual(1, len(csr_tnauthlist_get(self.logger, csr)))
+            self.assertEqual(1, mock_load.call_count)
+            self.assertIs(csr, csr_parse(self.logger, csr))
+            self.assertTrue(csr.startswith('MIIBFDCBugIBADAaMRgw'))
+
+    @patch('acme.certificate.Certificate.ca_handler_get')
+    @patch('acme.certificate.Certificate.store_cert')
+    @patch('acme.certificate.Certificate.csr_check')
+    def test_372_enroll_and_store(self, mock_check, mock_store, mock_ca):
+        """ Certificate.enroll_and_store() hands over the same parsed csr to csr check and ca handler """
+        from acme.helper import ParsedCsr
+        mock_check.return_value = True
+        mock_store.return_value = 1
+        mock_ca.return_value.__enter__.return_value.enroll.return_value = (None, 'certificate', 'raw')
+        self.assertEqual((1, None, None), self.certificate.enroll_and_store('cert_name', 'csr'))
+        csr = mock_check.call_args[0][1]
+        self.assertIsInstance(csr, ParsedCsr)
+        self.assertEqual('csr', csr)
+        self.assertIs(csr, mock_ca.return_value.__enter__.return_value.enroll.call_args[0][0])
+
+    def test_373_cert_parse(self):
+        """ cert_parse() decodes a certificate once for serial, SANs, extensions, fingerprint and metadata """
+        import OpenSSL
+        from acme.helper import cert_parse, cert_serial_get, cert_san_get, cert_tnauthlist_get, cert_fingerprint_get, cert_metadata_get
+        with patch('acme.helper.OpenSSL.crypto.load_certificate', wraps=OpenSSL.crypto.load_certificate) as mock_load:
+            cert = cert_parse(self.logger, 'MIIDDTCCAfWgAwIBAgIBCjANBgkqhkiG9w0BAQsFADAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wHhcNMTkwMTIwMTY1OTIwWhcNMTkwMjE5MTY1OTIwWjAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wggEiMA0GCSqGSIb3DQEBAQUAA4IBDwAwggEKAoIBAQCqUeNzDyBVugUKZq597ishYAdMPgus5Nw5pWE/Jw7PP0koeFE2wODqHVb+XNFFEX4IOyiE2Pi4ilzfXYGKchhP3wHgnkxGNIwt/cDNZgyTiUpITV/ciFaC7avkvQS6ScCYUYrhby7QnvcU02mAyhNcSVGI5TW7HhFdtWrEAK3N8H6yhxHLSi2ydpQ3kCJyJylqt/Rv3uKNjCvTv867K6A1QSsXoAxtPK9P0UOTRvgHkFf8T32Bn/Er1bjkX9Ms8rqDQmicCWJk260lUHzN6vxaeiEg7Kz3TA8Ik3DMIcvwJrE168G1APo+FyOIKyx+t78HWOlNINIqZMj5e2DpulV7AgMBAAGjXjBcMB8GA1UdIwQYMBaAFK1ZzuGt0Pe+NLerCXqQBYmVV7suMB0GA1UdDgQWBBStWc7hrdD3vjS3qwl6kAWJlVe7LjAaBgNVHREEEzARgg9mb28uZXhhbXBsZS5jb20wDQYJKoZIhvcNAQELBQADggEBAANW0DD4Xp7LH/Rzf2jVLwiFlbtR6iazyn9S/pH2Gwqjkscv/27/dqJb7CfPdD025ItQcYkZPJhDOsj63kvUaD89QU31RnYQrXrbXFqYOIAq6kxfZUoQmpfEBxbB4WxmTW0OWS+FMqNw/SuGs6EQjTRA+gBOeGzj4H9yOFOg0PpadBayZ7UT4lm1LOiFHh8hbta75ocePrurdNxsxKJhLlXbnKD6lurCb4khRhrmLmpK8JxhuaevEVklSQX0gqlRfxAH4XQsaqcaedPNI+W5OUITMz40ezDCbUqxS9KEMCGPoOTXNRAjbr72sc4Vkw7Ht+eRUDECE+0UnjyeCjTn3EU='.replace('+', '-').replace('/', '_').rstrip('='))
+            self.assertEqual(10, cert_serial_get(self.logger, cert))
+            self.assertEqual(['DNS:foo.example.com'], cert_san_get(self.logger, cert))
+            self.assertEqual(3, len(cert_tnauthlist_get(self.logger, cert)))
+            self.assertEqual('ebe9ca60b8e6260da3bc188c303d3f33ab74f29afeacceec4e1ca595ad4b971c', cert_fingerprint_get(self.logger, cert))
+            self.assertEqual('a', cert_metadata_get(self.logger, cert)['serial'])
+            self.assertEqual(1, mock_load.call_count)
+            self.assertIs(cert, cert_parse(self.logger, cert))
+            self.assertTrue(cert.endswith('jTn3EU='))
+
+    @patch('acme.message.Message.prepare_response')
+    @patch('acme.certificate.Certificate.ca_handler_get')
+    @patch('acme.certificate.Certificate.revocation_request_validate')
+    @patch('acme.message.Message.check')
+    def test_374_revoke(self, mock_mcheck, mock_validate, mock_ca, mock_response):
+        """ Certificate.revoke() hands over the same parsed certificate to request validation and ca handler """
+        from acme.helper import ParsedCert
+        mock_mcheck.return_value = (200, None, None, None, {'certificate' : 'certificate'}, 'account_name')
+        mock_validate.return_value = (200, 'reason')
+        mock_ca.return_value.__enter__.return_value.revoke.return_value = (200, None, None)
+        mock_response.return_value = 'response'
+        self.assertEqual('response', self.certificate.revoke('content'))
+        cert = mock_validate.call_args[0][1]['certificate']
+        self.assertIsInstance(cert, ParsedCert)
+        self.assertEqual('certificate=', cert)
+        self.assertIs(cert, mock_ca.return_value.__enter__.return_value.revoke.call_args[0][0])
+
+    @patch('acme.order.uts_now')
+    @patch('acme.order.generate_random_string')
+    def test_375_order_add(self, mock_name, mock_uts):
+        """ Order.add() copies the validated challenge of a reused authorization """
+        mock_name.side_effect = ['order', 'identifier1', 'challenge1']
+        mock_uts.return_value = 1000
+        self.order.authz_reuse = True
+        self.order.dbstore.reset_mock()
+        self.order.dbstore.authorization_reusable_lookup.side_effect = [{'name' : 'old1', 'expires' : 90000}]
+        self.order.dbstore.challenges_lookup.return_value = [{'type' : 'http-01', 'token' : 'token1', 'status__name' : 'pending', 'expires' : 80000}, {'type' : 'dns-01', 'token' : 'token1', 'status__name' : 'valid', 'expires' : 80000}]
+        self.order.add({'identifiers' : [{"type": "dns", "value": "example1.com"}]}, 'account')
+        self.order.dbstore.challenges_lookup.assert_called_with('authorization__name', 'old1', ['type', 'token', 'status__name', 'expires'])
+        self.order.dbstore.challenge_add.assert_called_once_with({'name' : 'challenge1', 'expires' : 80000, 'type' : 'dns-01', 'token' : 'token1', 'authorization' : 'identifier1', 'status' : 5})
+        self.order.dbstore.authorization_reusable_lookup.side_effect = None
+        self.order.dbstore.challenges_lookup.return_value = []
+        self.order.authz_reuse = False
+
+    def test_376_nonce_store_hmac(self):
+        """ NonceStoreHmac.check_and_delete() accepts nonces of other processes and nodes once - replays are refused by the shared database """
+        from acme.nonce import NonceStoreHmac
+        other_store = NonceStoreHmac(False, self.logger, 3600, 'secret', 2)
+        other_store.dbstore = self.nonce_store_hmac.dbstore
+        nonce = other_store.new()
+        self.assertTrue(self.nonce_store_hmac.check_and_delete(nonce))
+        self.assertFalse(other_store.check_and_delete(nonce))
+        self.assertFalse(self.nonce_store_hmac.check_and_delete(nonce))
+
+    def test_377_nonce_store_get(self):
+        """ Nonce.store_get() uses the database if the hmac backend has no nonce_secret """
+        self.nonce.backend = 'hmac'
+        self.nonce.secret = None
+        self.assertEqual('NonceStoreDb', type(self.nonce.store_get()).__name__)
+        self.assertEqual('db', self.nonce.backend)
+
+    @patch.dict('acme.helper.JWK_CACHE_DIC', {'keys': OrderedDict()})
+    def test_378_signature_jwk_load(self):
+        """ Signature.jwk_load() compares cached keys with the database - key changes and deletions of other workers apply at once """
+        self.signature.dbstore.reset_mock()
+        self.signature.jwk_cache_lifetime = 0
+        self.signature.dbstore.jwk_load.return_value = {'alg' : 'RS256', 'e' : 'AQAB', 'kty' : 'RSA', 'n' : '2CFMV4MK6Uo_2GQWa0KVWlzffgSDiLwur4ujSZkCRzbA3w5p1ABJgr7l_P84HpRv8R8rGL67hqmDJuT52mGD6fMVAhHPX5pSdtyZlQQuzpXonzNmHbG1DbMSiXrxg5jWVXchCxHx82wAt9Kf13O5ATxD0WOBB5FffpqQHh8zTf29jTL4vBd8N57ce17ZgNWl_EcoByjigqNFJcO0rrvrf6xyNaO9nbun4PAMJTLbfVa6CiEqjnjYMX80VYLH4fCqsAZgxIoli_D2j9P5Kq6KZZUL_bZ2QQV4UuwWZvh6tcA393YQLeMARnhWI6dqlZVdcU74NXi9NhSxcMkM8nZZ8Q'}
+        pub_key = self.signature.jwk_load('acc378')
+        self.assertIs(pub_key, self.signature.jwk_load('acc378'))
+        self.assertEqual(2, self.signature.dbstore.jwk_load.call_count)
+        self.signature.dbstore.jwk_load.return_value = {'kty' : 'EC', 'crv' : 'P-256', 'x' : 'f83OJ3D2xF1Bg8vub9tLe1gHMzV76e8Tus9uPHvRVEU', 'y' : 'x_FEzRu9m36HLN_tue659LNpXW6pCyStikYjKIWI5a0'}
+        new_key = self.signature.jwk_load('acc378')
+        self.assertIsNot(pub_key, new_key)
+        self.assertEqual('EC', new_key['kty'])
+        self.signature.dbstore.jwk_load.return_value = None
+        self.assertIsNone(self.signature.jwk_load('acc378'))
+        self.assertNotIn('acc378', self.jwk_cache_dic['keys'])
+
+    @patch('acme.challenge.Challenge.validation_schedule')
+    def test_379_challenge_validation_submit(self, mock_schedule):
+        """ Challenge.validation_submit() resubmits processing challenges once the lease expired - unless the validation runs in this process """
+        from acme.challenge import VALIDATION_FLIGHT_DIC
+        self.challenge.dbstore.challenge_claim.reset_mock()
+        self.challenge.dbstore.challenge_claim.return_value = True
+        self.challenge.dbstore.challenge_lookup.return_value = {'authorization__order__name' : 'order'}
+        with patch.dict(VALIDATION_FLIGHT_DIC['flights'], {'foo' : [None, False]}):
+            self.challenge.validation_submit('foo', 'payload', {'status' : 'processing'})
+        self.assertFalse(self.challenge.dbstore.challenge_claim.called)
+        self.assertFalse(mock_schedule.called)
+        self.challenge.validation_submit('foo', 'payload', {'status' : 'processing'})
+        self.assertTrue(self.challenge.dbstore.challenge_claim.called)
+        mock_schedule.assert_called_with('order', 'foo', 'payload')
+
+    @patch.dict('acme.order.ENROLLMENT_POOL_DIC', {'runs': 0})
+    @patch('acme.order.Order.enrollment_executor_get')
+    def test_380_order_enrollment_run_submit(self, mock_executor):
+        """ Order.enrollment_run_submit() - polls do not submit another run while one is in flight """
+        from acme.order import ENROLLMENT_POOL_DIC
+        self.assertTrue(self.order.enrollment_run_submit(idle=True))
+        self.assertFalse(self.order.enrollment_run_submit(idle=True))
+        self.assertTrue(self.order.enrollment_run_submit())
+        self.assertEqual(2, mock_executor.return_value.submit.call_count)
+        self.assertEqual(2, ENROLLMENT_POOL_DIC['runs'])
+
+    @patch('acme.certificate.Certificate.enroll_and_store')
+    @patch('acme.certificate.Certificate.store_csr')
+    @patch('acme.order.Order.info')
+    def test_381_process_csr(self, mock_oinfo, mock_certname, mock_enroll):
+        """ Order.process_csr() decides on the order status - processing orders return the certificate entry, pending orders are not ready """
+        mock_oinfo.return_value = {'status' : 'processing'}
+        self.order.dbstore.certificate_lookup.return_value = {'name' : 'cert_name'}
+        self.assertEqual((200, 'cert_name', None), self.order.process_csr('order_name', 'other_csr'))
+        mock_oinfo.return_value = {'status' : 'pending'}
+        self.assertEqual((403, 'urn:ietf:params:acme:error:orderNotReady', 'order is pending'), self.order.process_csr('order_name', 'csr'))
+        self.assertEqual((403, 'urn:ietf:params:acme:error:orderNotReady', 'order is pending'), self.order.enrollment_submit('order_name', 'csr'))
+        self.assertFalse(mock_certname.called)
+        self.assertFalse(mock_enroll.called)
+
+    @patch('acme.order.Order.process_csr')
+    @patch('acme.order.Order.name_get')
+    @patch('acme.message.Message.check')
+    def test_382_order_parse(self, mock_mcheck, mock_oname, mock_csr):
+        """ Order.parse() finalize of an order not ready """
+        mock_mcheck.return_value = (200, None, None, {'url' : 'bar_url/finalize'}, {"csr" : "csr_payload"}, 'account_name')
+        mock_oname.return_value = 'order_name'
+        mock_csr.return_value = (403, 'urn:ietf:params:acme:error:orderNotReady', 'order is pending')
+        self.assertEqual({'header': {}, 'code': 403, 'data': {'detail': 'order is pending', 'message': 'urn:ietf:params:acme:error:orderNotReady', 'status': 403}}, self.order.parse('message'))
+
 if __name__ == '__main__':
     unittest.main()
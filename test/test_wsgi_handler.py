@@ -124,7 +124,7 @@ class TestACMEHandler(unittest.TestCase):
     def test_020_account_lookup(self, mock_datestr):
         """ test DBstore.account_delete() for an exisitng key"""
         mock_datestr.return_value = 'datestr'
-        self.assertEqual({'id': 1, 'name': u'name1', 'jwk': '{"key11": "val11", "key12": "val12"}', 'contact': 'contact1', 'alg': 'alg1', 'created_at': 'datestr'}, self.dbstore.account_lookup('jwk', '{"key11": "val11", "key12": "val12"}'))
+        self.assertEqual({'id': 1, 'name': u'name1', 'jwk': '{"key11": "val11", "key12": "val12"}', 'thumbprint': None, 'contact': 'contact1', 'alg': 'alg1', 'created_at': 'datestr'}, self.dbstore.account_lookup('jwk', '{"key11": "val11", "key12": "val12"}'))
 
     def test_021_account_lookup(self):
         """ test DBstore.account_delete() for an non exisitng key"""
@@ -225,8 +225,251 @@ class TestACMEHandler(unittest.TestCase):
         """ test DBstore.order_search() method (succesful) """
         self.assertEqual('name', dict_from_row(self.dbstore.order_search('name', 'name'))['name'])
 
+    def test_043_db_open(self):
+        """ test DBstore.db_open() returns the pooled connection """
+        self.dbstore.db_open()
+        dbs = self.dbstore.dbs
+        self.dbstore.db_close()
+        self.dbstore.db_open()
+        self.assertEqual(dbs, self.dbstore.dbs)
+        self.dbstore.db_close()
+
+    def test_044_db_open(self):
+        """ test DBstore.db_open() without connection pooling """
+        self.dbstore.connection_pool = False
+        self.dbstore.db_open()
+        dbs = self.dbstore.dbs
+        self.dbstore.db_close()
+        self.dbstore.db_open()
+        self.assertNotEqual(dbs, self.dbstore.dbs)
+        self.dbstore.db_close()
+
+    def test_045_db_open(self):
+        """ test DBstore.db_open() - database is in wal mode """
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA journal_mode')
+        self.assertEqual('wal', self.dbstore.cursor.fetchone()[0])
+        self.dbstore.db_close()
+
+    def test_046_order_add_with_authorizations(self):
+        """ test DBstore.order_add_with_authorizations() for an existing account """
+        data_dic = {'name' : 'order46', 'identifiers' : 'identifiers', 'account' : 'name1', 'status' : 2, 'expires' : '25'}
+        authz_list = [{'name' : 'authz46a', 'type' : 'dns', 'value': 'a.example.com'}, {'name' : 'authz46b', 'type' : 'dns', 'value': 'b.example.com'}]
+        self.assertTrue(self.dbstore.order_add_with_authorizations(data_dic, authz_list))
+        self.assertEqual([{'value': 'b.example.com', 'order__name': 'order46'}], self.dbstore.authorization_lookup('name', 'authz46b', ['value', 'order__name']))
+
+    def test_047_order_add_with_authorizations(self):
+        """ test DBstore.order_add_with_authorizations() for a non existing account """
+        data_dic = {'name' : 'order47', 'identifiers' : 'identifiers', 'account' : 'not_existing', 'status' : 2, 'expires' : '25'}
+        authz_list = [{'name' : 'authz47a', 'type' : 'dns', 'value': 'a.example.com'}]
+        self.assertFalse(self.dbstore.order_add_with_authorizations(data_dic, authz_list))
+        self.assertFalse(self.dbstore.authorization_lookup('name', 'authz47a'))
+
+    def test_048_order_add_with_authorizations(self):
+        """ test DBstore.order_add_with_authorizations() rollback of the order if an authorization insert fails """
+        data_dic = {'name' : 'order48', 'identifiers' : 'identifiers', 'account' : 'name1', 'status' : 2, 'expires' : '25'}
+        authz_list = [{'name' : 'authz48a', 'type' : 'dns', 'value': 'a.example.com'}, {'name' : 'authz46a', 'type' : 'dns', 'value': 'b.example.com'}]
+        self.assertFalse(self.dbstore.order_add_with_authorizations(data_dic, authz_list))
+        self.assertFalse(self.dbstore.order_search('name', 'order48'))
+
+    def test_049_db_update(self):
+        """ test DBstore.db_update() - all migrations got applied """
+        from examples.db_handler.wsgi_handler import DB_MIGRATION_LIST
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA user_version')
+        self.assertEqual(len(DB_MIGRATION_LIST), self.dbstore.cursor.fetchone()[0])
+        self.dbstore.db_close()
+
+    def test_050_db_update(self):
+        """ test DBstore.db_update() - nonce lookup uses an index """
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('EXPLAIN QUERY PLAN SELECT nonce FROM nonce WHERE nonce=:nonce', {'nonce': 'aaa'})
+        self.assertIn('nonce_nonce_idx', str([tuple(row) for row in self.dbstore.cursor.fetchall()]))
+        self.dbstore.db_close()
+
+    def test_051_account_search(self):
+        """ test DBstore.account_seach() does not match wildcards """
+        self.assertFalse(self.dbstore.account_search('name', 'name%'))
+
+    def test_052_nonce_purge(self):
+        """ test DBstore.nonce_purge() deletes expired nonces only """
+        self.dbstore.nonce_add('nonce52a')
+        self.dbstore.nonce_add('nonce52b')
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute("UPDATE nonce SET created_at = datetime('now', '-2 hours') WHERE nonce = 'nonce52a'")
+        self.dbstore.db_close()
+        self.assertEqual(1, self.dbstore.nonce_purge(3600))
+        self.assertFalse(self.dbstore.nonce_check('nonce52a'))
+        self.assertTrue(self.dbstore.nonce_check('nonce52b'))
+
+    def test_053_nonce_consume(self):
+        """ test DBstore.nonce_consume() succeeds only once """
+        self.dbstore.nonce_add('nonce53')
+        self.assertTrue(self.dbstore.nonce_consume('nonce53', 3600))
+        self.assertFalse(self.dbstore.nonce_consume('nonce53', 3600))
+        self.assertFalse(self.dbstore.nonce_check('nonce53'))
+
+    def test_054_job_claim(self):
+        """ test DBstore.job_claim() - a job gets claimed once until its lease expires """
+        self.dbstore.order_add({'name' : 'order54', 'identifiers' : '[]', 'account' : 'name2', 'status' : 2, 'expires' : 0})
+        self.assertTrue(self.dbstore.job_add({'name' : 'job54', 'order_name' : 'order54', 'next_run' : 100}))
+        self.assertFalse(self.dbstore.job_add({'name' : 'job54', 'order_name' : 'order54', 'next_run' : 100}))
+        self.assertFalse(self.dbstore.job_claim('token1', 99, 60))
+        job_dic = self.dbstore.job_claim('token1', 100, 60)
+        self.assertEqual(('job54', 'order54', 'running', 1, 160), (job_dic['name'], job_dic['order_name'], job_dic['status'], job_dic['attempts'], job_dic['lease_until']))
+        self.assertFalse(self.dbstore.job_claim('token2', 150, 60))
+        job_dic = self.dbstore.job_claim('token2', 161, 60)
+        self.assertEqual(('job54', 'token2', 2), (job_dic['name'], job_dic['token'], job_dic['attempts']))
+
+    def test_055_job_update(self):
+        """ test DBstore.job_update() - only the holder of the claim can update a job """
+        self.assertFalse(self.dbstore.job_update({'name' : 'job54', 'token' : 'token1', 'status' : 'done', 'next_run' : 200, 'error' : None}))
+        self.assertTrue(self.dbstore.job_update({'name' : 'job54', 'token' : 'token2', 'status' : 'queued', 'next_run' : 200, 'error' : 'ca error'}))
+        self.assertFalse(self.dbstore.job_claim('token3', 199, 60))
+        self.assertEqual('job54', self.dbstore.job_claim('token3', 200, 60)['name'])
+        self.assertTrue(self.dbstore.job_update({'name' : 'job54', 'token' : 'token3', 'status' : 'done', 'next_run' : 200, 'error' : None}))
+        self.assertFalse(self.dbstore.job_claim('token4', 1000, 60))
+
+    def test_056_authorization_reusable_lookup(self):
+        """ test DBstore.authorization_reusable_lookup() - valid and not expiring authorizations of the account only """
+        data_dic = {'name' : 'order56', 'identifiers' : 'identifiers', 'account' : 'name1', 'status' : 2, 'expires' : '25'}
+        authz_list = [{'name' : 'authz56a', 'type' : 'dns', 'value': 'a.reuse.com', 'status' : 'valid', 'expires' : 1000}, {'name' : 'authz56b', 'type' : 'dns', 'value': 'b.reuse.com', 'status' : 'pending'}]
+        self.assertTrue(self.dbstore.order_add_with_authorizations(data_dic, authz_list))
+        self.assertEqual({'name' : 'authz56a', 'expires' : 1000}, self.dbstore.authorization_reusable_lookup('name1', {'type' : 'dns', 'value' : 'a.reuse.com'}, 500))
+        self.assertFalse(self.dbstore.authorization_reusable_lookup('name1', {'type' : 'dns', 'value' : 'a.reuse.com'}, 1000))
+        self.assertFalse(self.dbstore.authorization_reusable_lookup('name2', {'type' : 'dns', 'value' : 'a.reuse.com'}, 500))
+        self.assertFalse(self.dbstore.authorization_reusable_lookup('name1', {'type' : 'dns', 'value' : 'b.reuse.com'}, 0))
+
+    def test_057_challenges_lookup(self):
+        """ test DBstore.challenges_lookup() returns all challenges of an authorization """
+        self.assertEqual([], self.dbstore.challenges_lookup('authorization__name', 'authz56b'))
+        for (name, mtype) in (('chall57a', 'http-01'), ('chall57b', 'dns-01')):
+            self.dbstore.challenge_add({'name' : name, 'token' : 'token57', 'authorization' : 'authz56b', 'expires' : 25, 'type' : mtype})
+        e_result = [{'name' : 'chall57a', 'type' : 'http-01', 'token' : 'token57', 'status__name' : 'pending'}, {'name' : 'chall57b', 'type' : 'dns-01', 'token' : 'token57', 'status__name' : 'pending'}]
+        self.assertEqual(e_result, self.dbstore.challenges_lookup('authorization__name', 'authz56b'))
+
+    def test_058_order_update(self):
+        """ test DBstore.order_update() and authorization_update() invalidate cached states """
+        from acme.helper import state_cache_get, state_cache_set
+        for key in (('order', 'order56'), ('authz', 'authz56b')):
+            state_cache_set(self.logger, key, {'status' : 'pending'}, 60, state_cache_get(self.logger, key)[1])
+        self.dbstore.order_update({'name' : 'order56', 'status' : 'ready'})
+        self.assertIsNone(state_cache_get(self.logger, ('order', 'order56'))[0])
+        self.assertTrue(state_cache_get(self.logger, ('authz', 'authz56b'))[0])
+        self.dbstore.authorization_update({'name' : 'authz56b', 'status' : 'valid'})
+        self.assertIsNone(state_cache_get(self.logger, ('authz', 'authz56b'))[0])
+
+    def test_059_challenge_lookup(self):
+        """ test DBstore.challenge_lookup() returns the order of a challenge """
+        self.assertEqual({'authorization__order__name' : 'order56'}, self.dbstore.challenge_lookup('name', 'chall57a', ['authorization__order__name']))
+
+    def test_060_certificate_add(self):
+        """ test DBstore.certificate_add() stores metadata used by certificate_account_check() and certificate_backfill_list() """
+        cert = 'MIIDDTCCAfWgAwIBAgIBCjANBgkqhkiG9w0BAQsFADAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wHhcNMTkwMTIwMTY1OTIwWhcNMTkwMjE5MTY1OTIwWjAaMRgwFgYDVQQDEw9mb28uZXhhbXBsZS5jb20wggEiMA0GCSqGSIb3DQEBAQUAA4IBDwAwggEKAoIBAQCqUeNzDyBVugUKZq597ishYAdMPgus5Nw5pWE/Jw7PP0koeFE2wODqHVb+XNFFEX4IOyiE2Pi4ilzfXYGKchhP3wHgnkxGNIwt/cDNZgyTiUpITV/ciFaC7avkvQS6ScCYUYrhby7QnvcU02mAyhNcSVGI5TW7HhFdtWrEAK3N8H6yhxHLSi2ydpQ3kCJyJylqt/Rv3uKNjCvTv867K6A1QSsXoAxtPK9P0UOTRvgHkFf8T32Bn/Er1bjkX9Ms8rqDQmicCWJk260lUHzN6vxaeiEg7Kz3TA8Ik3DMIcvwJrE168G1APo+FyOIKyx+t78HWOlNINIqZMj5e2DpulV7AgMBAAGjXjBcMB8GA1UdIwQYMBaAFK1ZzuGt0Pe+NLerCXqQBYmVV7suMB0GA1UdDgQWBBStWc7hrdD3vjS3qwl6kAWJlVe7LjAaBgNVHREEEzARgg9mb28uZXhhbXBsZS5jb20wDQYJKoZIhvcNAQELBQADggEBAANW0DD4Xp7LH/Rzf2jVLwiFlbtR6iazyn9S/pH2Gwqjkscv/27/dqJb7CfPdD025ItQcYkZPJhDOsj63kvUaD89QU31RnYQrXrbXFqYOIAq6kxfZUoQmpfEBxbB4WxmTW0OWS+FMqNw/SuGs6EQjTRA+gBOeGzj4H9yOFOg0PpadBayZ7UT4lm1LOiFHh8hbta75ocePrurdNxsxKJhLlXbnKD6lurCb4khRhrmLmpK8JxhuaevEVklSQX0gqlRfxAH4XQsaqcaedPNI+W5OUITMz40ezDCbUqxS9KEMCGPoOTXNRAjbr72sc4Vkw7Ht+eRUDECE+0UnjyeCjTn3EU='
+        for name in ('cert60a', 'cert60b'):
+            self.dbstore.certificate_add({'name' : name, 'csr' : 'csr60', 'order' : 'order56'})
+        self.dbstore.certificate_add({'name' : 'cert60a', 'cert' : 'cert', 'cert_raw' : 'raw60', 'serial' : 'a', 'fingerprint' : 'ebe9ca60b8e6260da3bc188c303d3f33ab74f29afeacceec4e1ca595ad4b971c', 'not_before' : 1548003560, 'not_after' : 1550595560, 'issuer' : '/CN=foo.example.com', 'san' : '["DNS:foo.example.com"]'})
+        self.dbstore.certificate_add({'name' : 'cert60b', 'cert' : 'cert', 'cert_raw' : 'raw60b'})
+        self.assertEqual({'serial' : 'a', 'not_after' : 1550595560}, self.dbstore.certificate_lookup('name', 'cert60a', ['serial', 'not_after']))
+        self.assertEqual('order56', self.dbstore.certificate_account_check(None, cert.replace('+', '-').replace('/', '_').rstrip('=')))
+        self.assertEqual(['cert60b'], [row['name'] for row in self.dbstore.certificate_backfill_list(0, 10)])
+
+    def test_061_account_add(self):
+        """ test DBstore.account_add() finds existing accounts by key thumbprint """
+        data_dic = {'alg' : 'alg61', 'jwk' : '{"e": "AQAB", "kty": "RSA", "n": "n61"}', 'thumbprint' : 'thumbprint61', 'contact' : 'contact61', 'name' : 'name61'}
+        self.assertEqual(('name61', True), self.dbstore.account_add(data_dic))
+        data_dic = {'alg' : 'alg61', 'jwk' : '{"n": "n61", "kty": "RSA", "e": "AQAB"}', 'thumbprint' : 'thumbprint61', 'contact' : 'contact61b', 'name' : 'name61b'}
+        self.assertEqual(('name61', False), self.dbstore.account_add(data_dic))
+        self.assertEqual('contact61b', self.dbstore.account_lookup('thumbprint', 'thumbprint61')['contact'])
+        self.dbstore.account_update({'name' : 'name61', 'contact' : 'contact61c'})
+        self.assertEqual('contact61c', self.dbstore.account_lookup('thumbprint', 'thumbprint61')['contact'])
+
+    def test_062_db_account_thumbprint_fill(self):
+        """ test db_account_thumbprint_fill() stores thumbprints of parsable and unique keys """
+        from examples.db_handler.wsgi_handler import db_account_thumbprint_fill
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('DROP INDEX account_thumbprint_idx')
+        self.dbstore.cursor.execute('UPDATE account SET thumbprint = NULL')
+        for (name, jwk) in (('name62a', '{"e": "AQAB", "kty": "RSA", "n": "n62"}'), ('name62b', '{"n": "n62", "e": "AQAB", "kty": "RSA"}')):
+            self.dbstore.cursor.execute('INSERT INTO account(name, alg, jwk, contact) VALUES(?, ?, ?, ?)', [name, 'alg62', jwk, 'contact62'])
+        db_account_thumbprint_fill(self.logger, self.dbstore.cursor)
+        self.dbstore.cursor.execute('CREATE UNIQUE INDEX account_thumbprint_idx ON account (thumbprint)')
+        self.dbstore.db_close()
+        self.assertEqual('name62a', self.dbstore.account_lookup('thumbprint', '2Aj0K29lMcm_67NGWrRlq3fNfwb_UywH-v-t2m3bT9o')['name'])
+        self.assertIsNone(self.dbstore.account_lookup('name', 'name62b')['thumbprint'])
+        self.assertIsNone(self.dbstore.account_lookup('name', 'name1')['thumbprint'])
+
+    def test_063_nonce_consume(self):
+        """ test DBstore.nonce_consume() refuses nonces older than lifetime """
+        self.dbstore.nonce_add('nonce63')
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute("UPDATE nonce SET created_at = datetime('now', '-1 day') WHERE nonce = 'nonce63'")
+        self.dbstore.db_close()
+        self.assertFalse(self.dbstore.nonce_consume('nonce63', 3600))
+        self.assertTrue(self.dbstore.nonce_check('nonce63'))
+        self.assertEqual(1, self.dbstore.nonce_purge(3600))
+
+    def test_064_challenges_lookup(self):
+        """ test DBstore.challenges_lookup() returns status and expiry needed to copy a validated challenge """
+        self.dbstore.challenge_add({'name' : 'chall64', 'expires' : 1000, 'type' : 'http-01', 'token' : 'token64', 'authorization' : 'authz56a', 'status' : 5})
+        self.assertEqual([{'type' : 'http-01', 'token' : 'token64', 'status__name' : 'valid', 'expires' : 1000}], self.dbstore.challenges_lookup('authorization__name', 'authz56a', ['type', 'token', 'status__name', 'expires']))
+
+    def test_065_db_update(self):
+        """ test DBstore.db_update() - steps applied without their version bump are repeated without errors """
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA user_version = 4')
+        self.dbstore.db_close()
+        self.dbstore.db_update()
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA user_version')
+        self.assertEqual(7, self.dbstore.cursor.fetchone()[0])
+        self.dbstore.cursor.execute('PRAGMA table_info("certificate")')
+        self.assertEqual(1, [row['name'] for row in self.dbstore.cursor.fetchall()].count('serial'))
+        self.dbstore.db_close()
+
+    def test_066_db_update(self):
+        """ test DBstore.db_update() - processes starting at the same time apply each step once """
+        import threading
+        from examples.db_handler.wsgi_handler import DBstore
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA user_version = 4')
+        self.dbstore.db_close()
+        error_list = []
+        def update():
+            try:
+                DBstore(False, self.logger, 'acme_test.db').db_update()
+            except Exception as err:
+                error_list.append(err)
+        thread_list = [threading.Thread(target=update) for _ in range(4)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        self.assertEqual([], error_list)
+        self.dbstore.db_open()
+        self.dbstore.cursor.execute('PRAGMA user_version')
+        self.assertEqual(7, self.dbstore.cursor.fetchone()[0])
+        self.dbstore.db_close()
+
+    def test_067_challenge_claim(self):
+        """ test DBstore.challenge_claim() - processing challenges can be claimed again once their lease expired """
+        self.dbstore.challenge_add({'name' : 'chall67', 'expires' : 1000, 'type' : 'http-01', 'token' : 'token67', 'authorization' : 'authz56a'})
+        self.assertTrue(self.dbstore.challenge_claim('chall67', 1000, 60))
+        self.assertEqual('processing', self.dbstore.challenge_lookup('name', 'chall67', ['status__name'])['status'])
+        self.assertFalse(self.dbstore.challenge_claim('chall67', 1060, 60))
+        self.assertTrue(self.dbstore.challenge_claim('chall67', 1061, 60))
+        self.dbstore.challenge_update({'name' : 'chall67', 'status' : 'valid'})
+        self.assertFalse(self.dbstore.challenge_claim('chall67', 5000, 60))
+
+    def test_068_nonce_spend(self):
+        """ test DBstore.nonce_spend() records a nonce once """
+        self.assertTrue(self.dbstore.nonce_spend('nonce68'))
+        self.assertFalse(self.dbstore.nonce_spend('nonce68'))
+        self.assertTrue(self.dbstore.nonce_check('nonce68'))
+
 if __name__ == '__main__':
 
-    if os.path.exists('acme_test.db'):
-        os.remove('acme_test.db')
+    for db_file in ('acme_test.db', 'acme_test.db-wal', 'acme_test.db-shm'):
+        if os.path.exists(db_file):
+            os.remove(db_file)
     unittest.main()